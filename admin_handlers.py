@@ -1,31 +1,38 @@
 # handlers/admin_handlers.py
 import asyncio
+import html
+import re
+import time
+from contextlib import suppress
 # import aiohttp # No longer used directly
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from aiogram import Router, types, F, Bot, BaseMiddleware
+from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
 # from openai import OpenAI, APIError, APIConnectionError # No longer used directly
 
 import config
 import keyboards as kb
-# from database import Database # Global db instance removed
+from database import Database
 from states import AdminActions
 from api_service import APIService # For type hinting if needed, services accessed via bot
+from user_service import UserService
+from task_supervisor import TaskSupervisor
+from model_catalog import ModelCatalog, reload_catalog
+from model_prober import ModelProber, probe_model
+from bulk_subscriptions import BulkResult, apply_bulk_subscriptions, prepare_subscription_csv
+from media import FileTooLarge, download_file
+from utils import send_limiter
 
 admin_router = Router()
+_NOT_USERNAME_RE = re.compile(r'[^A-Za-z0-9_]') # username в Telegram: латиница, цифры и "_", до 32 символов
 # db = Database(config.DATABASE_PATH) # Global db instance removed
 
 class AdminMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: types.TelegramObject, data: dict):
         if hasattr(event, 'from_user') and event.from_user.id in config.ADMIN_IDS:
-            # Pass db and services from bot dispatcher to data for handlers
-            # This assumes bot instance is in data from dispatcher setup
-            if "bot" in data:
-                data["db"] = data["bot"]["db"]
-                data["user_service"] = data["bot"]["user_service"]
-                data["api_service"] = data["bot"]["api_service"]
-            # else: Provide fallback or log error if bot is not in data
+            # db и сервисы приходят в data из диспатчера (dp["db"] и т.д.)
             return await handler(event, data)
         if isinstance(event, types.CallbackQuery): # Non-admin
             try:
@@ -37,8 +44,7 @@ class AdminMiddleware(BaseMiddleware):
 admin_router.message.middleware(AdminMiddleware())
 admin_router.callback_query.middleware(AdminMiddleware())
 
-async def get_user_id_from_input(input_str: str, bot: Bot): # Added bot for db access
-    db = bot["db"]
+async def get_user_id_from_input(input_str: str, db: Database):
     if input_str.startswith('@'):
         user = await db.get_user_id_by_username(input_str[1:])
         return user[0] if user else None
@@ -47,48 +53,6 @@ async def get_user_id_from_input(input_str: str, bot: Bot): # Added bot for db a
     except ValueError:
         return None
 
-async def test_chat_model(model: str, api_service: APIService) -> dict: # Takes APIService
-    content, error = await api_service.chat_completion(
-        model=model,
-        messages=[{'role': 'user', 'content': 'Test'}],
-        temperature=0.7,
-        max_tokens=10
-    )
-    if content and not error:
-        return {'model': model, 'status': 'OK'}
-    elif error:
-        if "timed out" in error.lower() or "timeout" in error.lower(): # Basic timeout check
-             return {'model': model, 'status': 'Timeout'}
-        try: # Attempt to parse status code if error is like "Error: <status_code> - <message>"
-            if error.startswith("Error: ") and " - " in error:
-                status_code_str = error.split(" ")[1]
-                if status_code_str.isdigit():
-                    return {'model': model, 'status': f'Error {status_code_str}'}
-        except Exception: pass # Fallback if parsing fails
-        if "invalid json" in error.lower(): # Check for invalid JSON specifically
-            return {'model': model, 'status': 'Invalid JSON'}
-        return {'model': model, 'status': f'Error: {error[:50]}'} # Generic error, truncated
-    else:
-        return {'model': model, 'status': 'Unknown Error'}
-
-
-async def test_image_model(api_service: APIService) -> dict: # Takes APIService
-    image_url, error = await api_service.generate_image(
-        model=config.IMAGE_MODEL,
-        prompt="Test"
-    )
-    if image_url and not error:
-        return {'model': config.IMAGE_MODEL, 'status': 'OK'}
-    elif error:
-        if "connection" in error.lower(): # Basic connection error check
-            return {'model': config.IMAGE_MODEL, 'status': 'Connection Error'}
-        if "api error" in error.lower() or (error.startswith("Error: ") and " - " in error):
-            return {'model': config.IMAGE_MODEL, 'status': f'API Error {error[:50]}'}
-        return {'model': config.IMAGE_MODEL, 'status': f'Error: {error[:50]}'} # Generic error
-    else:
-        return {'model': config.IMAGE_MODEL, 'status': 'Unknown Error'}
-
-
 @admin_router.callback_query(F.data == 'menu_admin')
 async def menu_admin(callback: types.CallbackQuery, bot: Bot, state: FSMContext): # Added bot, state
     await state.clear() # Clear any previous admin states
@@ -102,8 +66,7 @@ async def admin_back(callback: types.CallbackQuery, state: FSMContext, bot: Bot)
     await callback.answer()
 
 @admin_router.callback_query(F.data == 'admin_stats')
-async def admin_stats(callback: types.CallbackQuery, bot: Bot):
-    db = bot["db"]
+async def admin_stats(callback: types.CallbackQuery, db: Database):
     await db.cleanup_expired_subscriptions()
 
     total_users = await db.get_user_count()
@@ -126,57 +89,108 @@ async def admin_stats(callback: types.CallbackQuery, bot: Bot):
     await callback.message.edit_text(text, reply_markup=kb.get_admin_back_menu())
     await callback.answer()
 
-@admin_router.callback_query(F.data == 'admin_test')
-async def admin_test_models(callback: types.CallbackQuery, bot: Bot):
-    model_status_cache = bot["model_status_cache"]
-    api_service = bot["api_service"]
+# Идущие проверки моделей: id админа -> задача. Нужны для кнопки отмены
+_model_test_runs: dict[int, asyncio.Task] = {}
+# Админы, нажавшие "Отменить": только такая отмена завершает проверку отчетом, остальные (остановка бота) пробрасываются
+_model_test_cancel_requests: set[int] = set()
 
-    await callback.answer("Начинаю тестирование...")
-    msg = await callback.message.edit_text('Начинаю тестирование моделей... Это может занять несколько минут.')
+def format_model_test_report(results: list[dict], total: int, finished: bool, cancelled: bool = False) -> str:
+    working_models = [r for r in results if r['status'] == 'OK']
+    failed_models = [r for r in results if r['status'] != 'OK']
 
-    chat_models = sorted(list(set(model for models_list in config.ALL_MODELS.values() for model in models_list))) # Corrected iteration
+    if cancelled:
+        header = f'<b>Тестирование отменено</b> ({len(results)}/{total})'
+    elif finished:
+        header = '<b>Результаты тестирования:</b>'
+    else:
+        header = f'<b>Тестирование моделей... {len(results)}/{total}</b>'
 
-    tasks = [test_chat_model(model, api_service) for model in chat_models]
-    if config.IMAGE_MODEL: # Only test image model if configured
-        tasks.append(test_image_model(api_service))
-
-    results = await asyncio.gather(*tasks, return_exceptions=True) # Handle individual task errors
-
-    working_models = []
-    failed_models = []
-    model_status_cache.clear()
-
-    for r in results:
-        if isinstance(r, Exception): # If asyncio.gather caught an exception for a task
-            # Log this error, decide how to represent in status
-            # For now, mark as a generic failure for the model if possible, or skip
-            # This part depends on how you want to handle tasks that fail catastrophically
-            # For simplicity, we'll assume test_chat_model/test_image_model return dicts even on internal errors
-            # If they raise exceptions that reach here, it's an issue in their error handling.
-            # Let's assume they always return a dict.
-            pass # Should not happen if test functions catch their own exceptions.
-
-        if not isinstance(r, dict) or 'model' not in r or 'status' not in r: # Defensive check
-            # Log unexpected result format
-            continue
-
-        is_ok = r['status'] == 'OK'
-        model_status_cache[r['model']] = is_ok # Update cache from bot dispatcher
-        if is_ok:
-            working_models.append(r)
-        else:
-            failed_models.append(r)
-
-    text = f'<b>Результаты тестирования:</b>\n\n<b>✅ Рабочие модели ({len(working_models)}):</b>\n'
-    text += "\n".join(f"✓ {r['model']}" for r in working_models) if working_models else "Нет рабочих моделей."
+    text = f'{header}\n\n<b>✅ Рабочие модели ({len(working_models)}):</b>\n'
+    text += "\n".join(f"✓ {r['model']} ({r['latency']:.1f}с)" for r in working_models) if working_models else "Нет рабочих моделей."
 
     if failed_models:
         text += f'\n\n<b>❌ Нерабочие или проблемные модели ({len(failed_models)}):</b>\n'
         text += "\n".join(f"✗ {r['model']} - {r['status']}" for r in failed_models)
-    else:
+    elif finished and not cancelled:
         text += "\n\nВсе модели в порядке!"
+    return text
 
-    await msg.edit_text(text, reply_markup=kb.get_admin_back_menu())
+async def run_model_test(msg: types.Message, admin_id: int, db, api_service: APIService, model_prober: ModelProber, model_catalog: ModelCatalog):
+    models = sorted(model_catalog.all_models())
+    if config.IMAGE_MODEL: # Only test image model if configured
+        models.append(config.IMAGE_MODEL)
+
+    semaphore = asyncio.Semaphore(config.ADMIN_TEST_CONCURRENCY)
+
+    async def bounded(model: str) -> dict:
+        async with semaphore:
+            return await probe_model(api_service, model, config.ADMIN_TEST_TIMEOUT)
+
+    async def edit(text: str, reply_markup):
+        try:
+            await msg.edit_text(text, reply_markup=reply_markup)
+        except TelegramRetryAfter:
+            pass # Пропускаем промежуточное обновление, следующее придет позже
+        except TelegramBadRequest:
+            pass # message is not modified
+
+    results = []
+    tasks = [asyncio.create_task(bounded(model)) for model in models]
+    last_edit = 0.0
+    cancelled = False
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            r = await next_result
+            results.append(r)
+            model_prober.record(r) # Тот же гистерезис и EWMA задержки, что у фоновой проверки
+            # Промежуточные правки не чаще раза в ADMIN_TEST_EDIT_INTERVAL, чтобы не упереться в лимиты Telegram
+            now = time.monotonic()
+            if len(results) < len(models) and now - last_edit >= config.ADMIN_TEST_EDIT_INTERVAL:
+                last_edit = now
+                await edit(format_model_test_report(results, len(models), finished=False), kb.get_model_test_cancel_keyboard())
+    except asyncio.CancelledError:
+        if admin_id not in _model_test_cancel_requests:
+            raise
+        cancelled = True
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Дожидаемся отмененных проб, чтобы их запросы к API не пережили проверку
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _model_test_runs.pop(admin_id, None)
+        _model_test_cancel_requests.discard(admin_id)
+
+    await db.add_model_test_results(results)
+    await edit(format_model_test_report(results, len(models), finished=True, cancelled=cancelled), kb.get_admin_back_menu())
+
+@admin_router.callback_query(F.data == 'admin_test')
+async def admin_test_models(callback: types.CallbackQuery, db, api_service: APIService, model_prober: ModelProber, task_supervisor: TaskSupervisor, model_catalog: ModelCatalog):
+    admin_id = callback.from_user.id
+    if admin_id in _model_test_runs:
+        await callback.answer("Тестирование уже идет.", show_alert=True)
+        return
+
+    await callback.answer("Начинаю тестирование...")
+    msg = await callback.message.edit_text('Начинаю тестирование моделей...', reply_markup=kb.get_model_test_cancel_keyboard())
+    # Проверка идет в фоне, чтобы хэндлер не держал апдейт и кнопка отмены обрабатывалась сразу
+    _model_test_runs[admin_id] = task_supervisor.spawn(
+        run_model_test(msg, admin_id, db, api_service, model_prober, model_catalog), name=f"model_test:{admin_id}"
+    )
+
+@admin_router.callback_query(F.data == 'admin_test_cancel')
+async def admin_test_cancel(callback: types.CallbackQuery):
+    task = _model_test_runs.get(callback.from_user.id)
+    if task:
+        _model_test_cancel_requests.add(callback.from_user.id)
+        task.cancel()
+        await callback.answer("Отменяю тестирование...")
+    else:
+        await callback.answer("Тестирование уже завершено.")
+
+@admin_router.message(Command('reload_models'))
+async def admin_reload_models(message: types.Message, model_catalog: ModelCatalog):
+    # В режиме нескольких воркеров команда перечитает каталог только в одном из них, для всех - SIGHUP
+    await message.answer(reload_catalog(model_catalog))
 
 @admin_router.callback_query(F.data == 'admin_users')
 async def admin_users_menu_callback(callback: types.CallbackQuery, bot: Bot): # Added bot
@@ -197,16 +211,18 @@ async def process_admin_action(message: types.Message, state: FSMContext, bot: B
     # However, if action_func needs state data, clear after it.
     # For simple actions, clearing here is fine.
 
-    success, result_text = await action_func(message.text, bot)
+    # action_func возвращает (успех, текст) или (успех, текст, клавиатура); по умолчанию - главное меню админки
+    success, result_text, *markup = await action_func(message.text, bot)
     await state.clear() # Clear state after action_func has completed.
+    reply_markup = markup[0] if markup else kb.get_admin_menu()
 
     if prompt_message_id:
         try:
-            await bot.edit_message_text(result_text, chat_id=message.chat.id, message_id=prompt_message_id, reply_markup=kb.get_admin_menu()) # Back to main admin menu
+            await bot.edit_message_text(result_text, chat_id=message.chat.id, message_id=prompt_message_id, reply_markup=reply_markup)
         except TelegramBadRequest:
-            await message.answer(result_text, reply_markup=kb.get_admin_menu())
+            await message.answer(result_text, reply_markup=reply_markup)
     else:
-        await message.answer(result_text, reply_markup=kb.get_admin_menu())
+        await message.answer(result_text, reply_markup=reply_markup)
 
     try:
         await message.delete()
@@ -246,64 +262,103 @@ def format_user_card(user_data, page, total_pages):
             f"<b>Последняя модель:</b> {last_model or 'Не выбрана'}\n<b>Регистрация:</b> {created_at_text}")
     return text
 
-@admin_router.callback_query(kb.Paginator.filter())
-@admin_router.callback_query(F.data.startswith("admin_list_users")) # Ensure this doesn't conflict with Paginator if page is not part of data
-async def admin_list_users(callback: types.CallbackQuery, bot: Bot, callback_data: kb.Paginator = None):
-    db = bot["db"]
-    page = 1 # Default to page 1 if not from paginator
-
-    # If callback_data is None, it implies direct call e.g. from admin_list_users button
-    # So, start at page 1.
-    if callback_data and isinstance(callback_data, kb.Paginator):
-        if callback_data.action == "next": page = callback_data.page + 1
-        elif callback_data.action == "prev": page = callback_data.page - 1
-        # If page is already part of callback_data (e.g. page itself), use it.
-        # This depends on how Paginator callback_data is structured.
-        # Assuming Paginator passes current page and action.
-
-    total_users = await db.get_user_count()
-    if total_users == 0:
-        await callback.message.edit_text("В базе данных пока нет пользователей.", reply_markup=kb.get_admin_back_menu())
+def format_user_row(row) -> str:
+    uid, uname, sub_level, sub_end, is_blocked, created_at = row
+    sub_name = config.SUB_LEVEL_MAP.get(sub_level, "?").capitalize()
+    created = created_at[:10] if isinstance(created_at, str) else "—"
+    return (f"<code>{uid}</code> {'@' + html.escape(uname) if uname else '—'} · {sub_name}"
+            f"{' · 🚫' if is_blocked else ''} · {created}")
+
+@admin_router.callback_query(kb.UsersPage.filter())
+@admin_router.callback_query(F.data.startswith("admin_list_users"))
+async def admin_list_users(callback: types.CallbackQuery, db, callback_data: kb.UsersPage | None = None):
+    callback_data = callback_data or kb.UsersPage(page=1)
+    filters = kb.parse_user_filters(callback_data.filters)
+    active_since = date.today() - timedelta(days=filters['active_days']) if filters['active_days'] else None
+    query_filters = dict(level=filters['level'], blocked=filters['blocked'], active_since=active_since)
+    per_page = config.ADMIN_USERS_PER_PAGE
+
+    cursor = kb.decode_user_cursor(callback_data.cursor) if callback_data.direction else None
+    backward = callback_data.direction == "p"
+    rows, has_more = await db.get_users_page(per_page, cursor, backward=backward, **query_filters)
+    page = callback_data.page if cursor else 1
+    if backward and not has_more:
+        page = 1 # Дошли до начала списка (пока листали, могли добавиться пользователи)
+
+    if not rows:
+        if cursor:
+            await callback.answer("Больше пользователей нет.", show_alert=True)
+            return
+        text = "Пользователей с такими фильтрами нет." if callback_data.filters else "В базе данных пока нет пользователей."
+        await callback.message.edit_text(text, reply_markup=kb.get_users_page_keyboard(1, 1, None, None, callback_data.filters))
         await callback.answer()
         return
 
-    user_data_list = await db.get_all_users_paginated(page=page, per_page=1) # Assuming per_page=1 for one card
-    if not user_data_list: # Should not happen if total_users > 0 and page is valid. Could mean page out of bounds.
-        await callback.answer("Больше пользователей нет или страница недействительна.", show_alert=True)
-        # Optionally, reset to page 1 or last valid page
-        # For now, just inform and don't change message.
-        return
-
-    text = format_user_card(user_data_list[0], page, total_users)
-    await callback.message.edit_text(text, reply_markup=kb.get_paginated_users_keyboard(page, total_users, "admin_list_users")) # Added base_callback_data
+    total = await db.count_users(**query_filters) # Кэшируется, не считается заново на каждой странице
+    total_pages = max(page, -(-total // per_page))
+    has_prev = has_more if backward else page > 1
+    has_next = True if backward else has_more
+    first, last = rows[0], rows[-1]
+    prev_cursor = kb.encode_user_cursor(first[5], first[0]) if has_prev else None
+    next_cursor = kb.encode_user_cursor(last[5], last[0]) if has_next else None
+
+    start = (page - 1) * per_page + 1
+    text = (f"<b>👥 Пользователи {start}–{start + len(rows) - 1} из {total}</b>\n\n"
+            + "\n".join(format_user_row(row) for row in rows))
+    await callback.message.edit_text(
+        text, reply_markup=kb.get_users_page_keyboard(page, total_pages, prev_cursor, next_cursor, callback_data.filters)
+    )
     await callback.answer()
 
 
 @admin_router.callback_query(F.data == 'admin_search')
 async def admin_search_start(callback: types.CallbackQuery, state: FSMContext, bot: Bot): # Added bot
-    await start_admin_action(callback, state, AdminActions.waiting_for_search_user, "Отправьте ID или @username для поиска.")
+    await start_admin_action(callback, state, AdminActions.waiting_for_search_user,
+                             "Отправьте ID, @username или часть username для поиска.")
+
+async def render_user_search(db, query: str, offset: int) -> tuple[str, types.InlineKeyboardMarkup]:
+    per_page = config.ADMIN_USERS_PER_PAGE
+    rows, has_more = await db.search_users(query, per_page, offset)
+    if not rows:
+        text = f"По запросу «{query}» никого не найдено." if offset == 0 else "Больше результатов нет."
+    else:
+        text = (f"<b>🔍 «{query}»: {offset + 1}–{offset + len(rows)}{'+' if has_more else ''}</b>\n\n"
+                + "\n".join(format_user_row(row) for row in rows))
+    return text, kb.get_user_search_keyboard(query, offset, per_page, has_more)
 
 @admin_router.message(AdminActions.waiting_for_search_user)
-async def admin_search_process(message: types.Message, state: FSMContext, bot: Bot):
-    db = bot["db"]
+async def admin_search_process(message: types.Message, state: FSMContext, bot: Bot, db):
     async def action(input_str, current_bot):
-        user_id = await get_user_id_from_input(input_str, current_bot)
-        if not user_id: return False, f"Пользователь '{input_str}' не найден."
-        user_data = await db.get_user_info(user_id)
-        if not user_data: return False, f"Пользователь с ID '{user_id}' не найден в базе."
-
-        text = format_user_card(user_data, 1, 1).replace(" 1/1", "") # Page 1 of 1 for single user
-        return True, text
+        input_str = (input_str or "").strip()
+        if input_str.isdigit():
+            user_data = await db.get_user_info(int(input_str))
+            if not user_data: return False, f"Пользователь с ID '{input_str}' не найден в базе."
+            return True, format_user_card(user_data, 1, 1).replace(" 1/1", "")
+
+        query = _NOT_USERNAME_RE.sub("", input_str.lstrip("@"))[:32]
+        if not query:
+            return False, "Отправьте ID или часть username (латиница, цифры, _)."
+        rows, _ = await db.search_users(query, 2)
+        if len(rows) == 1: # Единственное совпадение - сразу карточка пользователя
+            user_data = await db.get_user_info(rows[0][0])
+            return True, format_user_card(user_data, 1, 1).replace(" 1/1", "")
+        text, markup = await render_user_search(db, query, 0)
+        return bool(rows), text, markup
 
     await process_admin_action(message, state, bot, action)
 
+@admin_router.callback_query(kb.UserSearch.filter())
+async def admin_search_page(callback: types.CallbackQuery, db, callback_data: kb.UserSearch):
+    text, markup = await render_user_search(db, callback_data.query, callback_data.offset)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
 @admin_router.callback_query(F.data == 'admin_grant')
 async def admin_grant_start(callback: types.CallbackQuery, state: FSMContext, bot: Bot): # Added bot
     await start_admin_action(callback, state, AdminActions.waiting_for_grant_user, 'Отправьте ID/@username и уровень (0, 1, 2):\nФормат: `ID/username LEVEL`')
 
 @admin_router.message(AdminActions.waiting_for_grant_user)
-async def admin_grant_process(message: types.Message, state: FSMContext, bot: Bot):
-    db = bot["db"]
+async def admin_grant_process(message: types.Message, state: FSMContext, bot: Bot, db: Database):
     async def action(input_str, current_bot):
         try:
             parts = input_str.split()
@@ -314,7 +369,7 @@ async def admin_grant_process(message: types.Message, state: FSMContext, bot: Bo
             if level not in config.SUB_LEVEL_MAP.keys():
                 return False, f"Неверный уровень подписки. Укажите одно из чисел: {list(config.SUB_LEVEL_MAP.keys())}."
 
-            target_user_id = await get_user_id_from_input(target_input, current_bot)
+            target_user_id = await get_user_id_from_input(target_input, db)
             if not target_user_id:
                 return False, f"Пользователь {target_input} не найден."
 
@@ -323,8 +378,7 @@ async def admin_grant_process(message: types.Message, state: FSMContext, bot: Bo
 
             try:
                 if level > 0: # Notify only for actual subscriptions
-                    notification_text = f"Вам была выдана подписка администратором. Установлен уровень: <b>{sub_name}</b>."
-                    await current_bot.send_message(target_user_id, notification_text)
+                    await current_bot.send_message(target_user_id, subscription_notice(level, None))
             except (TelegramForbiddenError, TelegramBadRequest): pass # User blocked bot or error
 
             return True, f"Подписка уровня {sub_name} выдана пользователю {target_input}."
@@ -338,10 +392,9 @@ async def admin_revoke_start(callback: types.CallbackQuery, state: FSMContext, b
     await start_admin_action(callback, state, AdminActions.waiting_for_revoke_user, 'Отправьте ID или @username, чтобы забрать подписку (установить Free):')
 
 @admin_router.message(AdminActions.waiting_for_revoke_user)
-async def admin_revoke_process(message: types.Message, state: FSMContext, bot: Bot):
-    db = bot["db"]
+async def admin_revoke_process(message: types.Message, state: FSMContext, bot: Bot, db: Database):
     async def action(input_str, current_bot):
-        target_user_id = await get_user_id_from_input(input_str, current_bot)
+        target_user_id = await get_user_id_from_input(input_str, db)
         if not target_user_id:
             return False, f"Пользователь {input_str} не найден."
 
@@ -351,16 +404,15 @@ async def admin_revoke_process(message: types.Message, state: FSMContext, bot: B
         await db.update_subscription(target_user_id, 0, None) # Set to Free, remove expiry
 
         try:
-            await current_bot.send_message(target_user_id, 'Ваша платная подписка была отозвана администратором. Установлен уровень Free.')
+            await current_bot.send_message(target_user_id, subscription_notice(0, None))
         except (TelegramForbiddenError, TelegramBadRequest): pass
 
         return True, f"Подписка у пользователя {input_str} успешно сброшена до Free."
 
     await process_admin_action(message, state, bot, action)
 
-async def blocking_action(input_str: str, block: bool, bot: Bot):
-    db = bot["db"]
-    target_user_id = await get_user_id_from_input(input_str, bot)
+async def blocking_action(input_str: str, block: bool, bot: Bot, db: Database):
+    target_user_id = await get_user_id_from_input(input_str, db)
     if not target_user_id: return False, f"Пользователь {input_str} не найден."
 
     if target_user_id in config.ADMIN_IDS and block: # Prevent self-lockout or locking other admins
@@ -378,8 +430,8 @@ async def admin_block_start(callback: types.CallbackQuery, state: FSMContext, bo
     await start_admin_action(callback, state, AdminActions.waiting_for_block_user, 'Отправьте ID или @username для блокировки:')
 
 @admin_router.message(AdminActions.waiting_for_block_user)
-async def admin_block_process(message: types.Message, state: FSMContext, bot: Bot):
-    await process_admin_action(message, state, bot, lambda text, current_bot: blocking_action(text, True, current_bot))
+async def admin_block_process(message: types.Message, state: FSMContext, bot: Bot, db: Database):
+    await process_admin_action(message, state, bot, lambda text, current_bot: blocking_action(text, True, current_bot, db))
 
 
 @admin_router.callback_query(F.data == 'admin_unblock')
@@ -387,18 +439,102 @@ async def admin_unblock_start(callback: types.CallbackQuery, state: FSMContext,
     await start_admin_action(callback, state, AdminActions.waiting_for_unblock_user, 'Отправьте ID или @username для разблокировки:')
 
 @admin_router.message(AdminActions.waiting_for_unblock_user)
-async def admin_unblock_process(message: types.Message, state: FSMContext, bot: Bot):
-    await process_admin_action(message, state, bot, lambda text, current_bot: blocking_action(text, False, current_bot))
+async def admin_unblock_process(message: types.Message, state: FSMContext, bot: Bot, db: Database):
+    await process_admin_action(message, state, bot, lambda text, current_bot: blocking_action(text, False, current_bot, db))
+
+
+BULK_SUBSCRIPTIONS_PROMPT = (
+    "Отправьте CSV-файл со строками <code>id_или_username,уровень,дней</code>, например:\n"
+    "<code>123456789,1,30\n@username,2,\n@other,0,</code>\n\n"
+    "Пустое число дней - подписка без срока, уровень 0 - забрать подписку. Разделитель - запятая или точка с запятой."
+)
+
+def subscription_notice(level: int, end: datetime | None) -> str:
+    """end - срок окончания в том виде, в каком он записан в базу."""
+    if level == 0:
+        return 'Ваша платная подписка была отозвана администратором. Установлен уровень Free.'
+    sub_name = config.SUB_LEVEL_MAP.get(level, "Неизвестный").capitalize()
+    text = f"Вам была выдана подписка администратором. Установлен уровень: <b>{sub_name}</b>."
+    if end:
+        text += f" Действует до {end.strftime('%d.%m.%Y')}."
+    return text
+
+def format_bulk_report(rows_total: int, errors: list[str], result: BulkResult | None) -> str:
+    limit = config.BULK_REPORT_DETAILS
+    def details(title: str, items: list[str]) -> str:
+        if not items:
+            return ""
+        more = f"\n… и еще {len(items) - limit}" if len(items) > limit else ""
+        return f"\n\n<b>{title} ({len(items)}):</b>\n" + "\n".join(html.escape(item) for item in items[:limit]) + more
+
+    applied = len(result.changes) if result else 0
+    text = f"<b>📥 Подписки из CSV</b>\n\nСтрок к применению: {rows_total}\nПрименено: {applied}"
+    if result and result.notices:
+        text += "\nУведомления отправляются в фоне, по завершении придет отчет."
+    text += details("Ошибки в файле", errors)
+    if result:
+        text += details("Не найдены в базе", result.not_found) + details("Пропущены", result.skipped)
+    return text
+
+async def notify_subscription_changes(bot: Bot, notices: list[tuple[int, int, datetime | None]], initiator_id: int):
+    """Уведомляет пользователей о новых подписках в темпе общего send_limiter. Отчет приходит, даже если задачу прервали."""
+    sent, failed = 0, 0
+    try:
+        for user_id, level, end in notices:
+            for attempt in range(2):
+                await send_limiter.wait(user_id)
+                try:
+                    await bot.send_message(user_id, subscription_notice(level, end))
+                    sent += 1
+                    break
+                except TelegramRetryAfter as e: # Повторяем один раз после паузы, которую попросил Telegram
+                    if attempt:
+                        failed += 1
+                    else:
+                        await asyncio.sleep(e.retry_after)
+                except TelegramAPIError: # Заблокировал бота, удален, сетевая ошибка - переходим к следующему
+                    failed += 1
+                    break
+    finally:
+        with suppress(TelegramAPIError):
+            await bot.send_message(initiator_id, f"📨 Уведомления о подписках: доставлено {sent}, не доставлено {failed}"
+                                                 f" из {len(notices)}.")
 
+@admin_router.callback_query(F.data == 'admin_bulk_subscriptions')
+async def admin_bulk_subscriptions_start(callback: types.CallbackQuery, state: FSMContext):
+    await start_admin_action(callback, state, AdminActions.waiting_for_bulk_subscriptions, BULK_SUBSCRIPTIONS_PROMPT)
 
-async def broadcast_to_users(bot: Bot, text: str, pin_message: bool, initiator_id: int):
-    db = bot["db"]
-    broadcast_id = await db.add_broadcast(text, initiator_id) # Store who initiated
-    user_ids = await db.get_all_user_ids(exclude_blocked=True) # Get non-blocked users
+@admin_router.message(AdminActions.waiting_for_bulk_subscriptions, F.document)
+async def admin_bulk_subscriptions_process(message: types.Message, state: FSMContext, bot: Bot, db, task_supervisor: TaskSupervisor):
+    async def action(_, current_bot):
+        try:
+            data = await download_file(current_bot, message.document.file_id, config.BULK_SUBSCRIPTION_MAX_BYTES)
+        except FileTooLarge as e:
+            return False, f"Файл слишком большой (максимум {e.limit // 1024} КБ)."
+        rows, errors = await prepare_subscription_csv(data)
+        if not rows:
+            return False, format_bulk_report(0, errors, None)
+
+        result = await apply_bulk_subscriptions(db, rows)
+        if result.notices:
+            task_supervisor.spawn(
+                notify_subscription_changes(current_bot, result.notices, message.from_user.id),
+                name=f"bulk subscriptions from {message.from_user.id}"
+            )
+        return True, format_bulk_report(len(rows), errors, result)
+
+    await process_admin_action(message, state, bot, action)
+
+@admin_router.message(AdminActions.waiting_for_bulk_subscriptions)
+async def admin_bulk_subscriptions_no_file(message: types.Message):
+    await message.answer("Нужен CSV-файл. " + BULK_SUBSCRIPTIONS_PROMPT, reply_markup=kb.get_cancel_keyboard())
+
+async def broadcast_to_users(bot: Bot, db: Database, text: str, pin_message: bool, initiator_id: int):
+    broadcast_id = await db.add_broadcast(text)
+    user_ids = await db.get_all_user_ids() # Только незаблокированные
     success_count, fail_count = 0, 0
 
-    for user_id_tuple in user_ids: # Assuming get_all_user_ids returns list of tuples e.g. (id,)
-        user_id = user_id_tuple[0]
+    for user_id in user_ids:
         try:
             sent_message = await bot.send_message(user_id, text, parse_mode="HTML") # parse_mode for formatting
             await db.add_sent_broadcast_message(broadcast_id, user_id, sent_message.message_id)
@@ -455,7 +591,7 @@ async def admin_broadcast_confirm(message: types.Message, state: FSMContext, bot
 
 
 @admin_router.callback_query(F.data.startswith('broadcast_'), AdminActions.waiting_for_broadcast_confirmation)
-async def admin_broadcast_process(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+async def admin_broadcast_process(callback: types.CallbackQuery, state: FSMContext, bot: Bot, db: Database, task_supervisor: TaskSupervisor):
     user_data = await state.get_data()
     text_to_broadcast = user_data.get('broadcast_text') # This is html_text
 
@@ -475,14 +611,16 @@ async def admin_broadcast_process(callback: types.CallbackQuery, state: FSMConte
 
     initiator_id = callback.from_user.id
 
-    asyncio.create_task(broadcast_to_users(bot, text_to_broadcast, pin_message=pin, initiator_id=initiator_id))
+    task_supervisor.spawn(
+        broadcast_to_users(bot, db, text_to_broadcast, pin_message=pin, initiator_id=initiator_id),
+        name=f"broadcast from {initiator_id}"
+    )
 
     await callback.answer() # Acknowledge callback quickly
 
 
 @admin_router.callback_query(kb.BroadcastCallback.filter())
-async def manage_broadcast(callback: types.CallbackQuery, callback_data: kb.BroadcastCallback, bot: Bot):
-    db = bot["db"]
+async def manage_broadcast(callback: types.CallbackQuery, callback_data: kb.BroadcastCallback, bot: Bot, db: Database):
     action = callback_data.action
     broadcast_id = callback_data.broadcast_id
 
@@ -530,8 +668,7 @@ async def admin_reset_all_subs_confirm(callback: types.CallbackQuery, bot: Bot):
     await callback.answer()
 
 @admin_router.callback_query(F.data == 'confirm_reset_all_subs')
-async def admin_reset_all_subs_process(callback: types.CallbackQuery, bot: Bot):
-    db = bot["db"]
+async def admin_reset_all_subs_process(callback: types.CallbackQuery, db: Database):
     await callback.message.edit_text("Выполняю сброс подписок...")
 
     updated_count = await db.reset_all_subscriptions(config.ADMIN_IDS)
@@ -543,9 +680,7 @@ async def admin_reset_all_subs_process(callback: types.CallbackQuery, bot: Bot):
     await callback.answer()
 
 @admin_router.callback_query(F.data == 'admin_self_test')
-async def admin_self_test(callback: types.CallbackQuery, bot: Bot):
-    db = bot["db"]
-    user_service = bot["user_service"]
+async def admin_self_test(callback: types.CallbackQuery, db: Database, user_service: UserService):
 
     await callback.answer("🤖 Запускаю автотесты...")
     msg = await callback.message.edit_text("<b>🤖 Проведение автотестов...</b>")
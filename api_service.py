@@ -1,16 +1,45 @@
 import aiohttp
+import asyncio
+import base64
 import json
+import time
+
+from cassette import Cassette
+from metrics import UPSTREAM_SECONDS, UPSTREAM_ERRORS
+from tracing import trace_methods
 # Assuming config is available or values are passed directly
 # import config
 
+@trace_methods("api")
 class APIService:
-    def __init__(self, api_key: str, chat_api_url: str, image_api_url: str, session: aiohttp.ClientSession):
+    def __init__(self, api_key: str, chat_api_url: str, image_api_url: str, session: aiohttp.ClientSession, cassette: Cassette | None = None):
         self.api_key = api_key
         self.chat_api_url = chat_api_url
         self.image_api_url = image_api_url
         self.session = session
+        self.cassette = cassette # Запись/воспроизведение трафика (см. cassette.py)
+
+    async def _post(self, base_url: str, endpoint: str, payload: dict, timeout: float | None = None) -> tuple[int, str]:
+        """POST к API моделей. Возвращает (статус, тело ответа); пишет или воспроизводит кассету."""
+        if self.cassette and self.cassette.replaying:
+            replayed = await self.cassette.replay(endpoint, payload)
+            if replayed is None:
+                raise LookupError(f"cassette miss for {endpoint} ({payload.get('model')})")
+            return replayed
 
-    async def chat_completion(self, model: str, messages: list, temperature: float, max_tokens: int = None) -> tuple[str | None, str | None]:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        start = time.perf_counter()
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        async with self.session.post(f'{base_url}/{endpoint}', json=payload, headers=headers, timeout=request_timeout) as response:
+            body = await response.text()
+        if self.cassette and self.cassette.recording:
+            await self.cassette.record(endpoint, payload, response.status, body, time.perf_counter() - start)
+        return response.status, body
+
+    async def chat_completion(self, model: str, messages: list, temperature: float, max_tokens: int = None, timeout: float | None = None) -> tuple[str | None, str | None]:
         payload = {
             "model": model,
             "messages": messages,
@@ -19,43 +48,82 @@ class APIService:
         if max_tokens is not None:
             payload["max_tokens"] = max_tokens
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
+        start = time.perf_counter()
         try:
-            async with self.session.post(f'{self.chat_api_url}/chat/completions', json=payload, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    content = data.get("choices", [{}])[0].get("message", {}).get("content")
-                    return content, None
-                else:
-                    error_message = await response.text()
-                    return None, f"Error: {response.status} - {error_message}"
+            status, body = await self._post(self.chat_api_url, "chat/completions", payload, timeout)
+            if status == 200:
+                data = json.loads(body)
+                content = data.get("choices", [{}])[0].get("message", {}).get("content")
+                return content, None
+            else:
+                UPSTREAM_ERRORS.inc(model=model, endpoint="chat/completions", kind=str(status))
+                return None, f"Error: {status} - {body}"
         except Exception as e:
+            UPSTREAM_ERRORS.inc(model=model, endpoint="chat/completions", kind=type(e).__name__)
             return None, f"Exception: {str(e)}"
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, model=model, endpoint="chat/completions")
 
     async def generate_image(self, model: str, prompt: str, size: str = "1024x1024", response_format: str = "url") -> tuple[str | None, str | None]:
+        item, error = await self._generate_image_item(model, prompt, size, response_format)
+        if error:
+            return None, error
+        return item.get(response_format), None # DALL-E 3 returns 'url' or 'b64_json'
+
+    async def generate_image_bytes(self, model: str, prompt: str, size: str = "1024x1024", response_format: str = "b64_json",
+                                   max_bytes: int = 10 * 1024 * 1024, download_timeout: float | None = None) -> tuple[bytes | None, str | None]:
+        """Картинка сразу байтами: из b64_json или скачиванием по ссылке, если API вернул url."""
+        item, error = await self._generate_image_item(model, prompt, size, response_format)
+        if error:
+            return None, error
+        if item.get("b64_json"):
+            data = base64.b64decode(item["b64_json"])
+            if len(data) > max_bytes:
+                return None, f"Error: image is larger than {max_bytes} bytes"
+            return data, None
+        if item.get("url"):
+            return await self.download(item["url"], max_bytes, download_timeout)
+        return None, "Error: empty image response"
+
+    async def download(self, url: str, max_bytes: int, timeout: float | None = None) -> tuple[bytes | None, str | None]:
+        """Потоковое скачивание в память с ограничением размера и общего времени."""
+        buffer = bytearray()
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        try:
+            async with self.session.get(url, timeout=request_timeout) as response:
+                if response.status != 200:
+                    return None, f"Error: {response.status} - download failed"
+                if response.content_length and response.content_length > max_bytes:
+                    return None, f"Error: file is too large ({response.content_length} bytes)"
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    buffer += chunk
+                    if len(buffer) > max_bytes:
+                        return None, f"Error: file is larger than {max_bytes} bytes"
+        except asyncio.TimeoutError:
+            return None, f"Error: download timed out after {timeout} s"
+        except Exception as e:
+            return None, f"Exception: {str(e)}"
+        return bytes(buffer), None
+
+    async def _generate_image_item(self, model: str, prompt: str, size: str, response_format: str) -> tuple[dict | None, str | None]:
         payload = {
             "model": model,
             "prompt": prompt,
             "size": size,
             "response_format": response_format,
         }
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
 
+        start = time.perf_counter()
         try:
-            async with self.session.post(f'{self.image_api_url}/images/generations', json=payload, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    image_url = data.get("data", [{}])[0].get(response_format) # DALL-E 3 returns 'url' or 'b64_json'
-                    return image_url, None
-                else:
-                    error_message = await response.text()
-                    return None, f"Error: {response.status} - {error_message}"
+            status, body = await self._post(self.image_api_url, "images/generations", payload)
+            if status == 200:
+                data = json.loads(body)
+                return data.get("data", [{}])[0], None
+            else:
+                UPSTREAM_ERRORS.inc(model=model, endpoint="images/generations", kind=str(status))
+                return None, f"Error: {status} - {body}"
         except Exception as e:
+            UPSTREAM_ERRORS.inc(model=model, endpoint="images/generations", kind=type(e).__name__)
             return None, f"Exception: {str(e)}"
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, model=model, endpoint="images/generations")
@@ -0,0 +1,206 @@
+# benchmarks/db_bench.py
+"""
+Микробенчмарк слоя Database на реалистичных объемах данных.
+
+Заполняет файл SQLite пользователями и запросами (схема создается через Database.init_db,
+так что изменения схемы и индексов сразу попадают в замер), затем прогоняет публичные
+методы Database под конкурентной асинхронной нагрузкой и печатает/сохраняет отчет.
+
+Запуск:
+    python -m benchmarks.db_bench --users 1000000 --requests 20000000 --json db_report.json
+    python -m benchmarks.db_bench --db /tmp/big.db --reuse   # повторный замер без пересоздания данных
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SEED_BATCH = 50_000
+MODELS = ['gpt-4.1', 'deepseek-chat-v3-0324', 'chatgpt-4o-latest', 'grok-3-mini', 'claude-3.7-sonnet', 'gpt-image-1']
+
+def seed(db_path: str, users: int, requests: int, days: int, rng: random.Random):
+    """Быстрое заполнение синхронным sqlite3 пачками executemany."""
+    now = datetime.now()
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous=OFF')
+
+    def user_rows():
+        for user_id in range(1, users + 1):
+            roll = rng.random()
+            level = 0 if roll < 0.85 else (1 if roll < 0.96 else 2)
+            sub_end = now + timedelta(days=rng.randint(-30, 30)) if level else None
+            created_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+            yield (user_id, f"user_{user_id}" if rng.random() < 0.8 else None, level, sub_end,
+                   1 if rng.random() < 0.01 else 0, rng.choice(MODELS), created_at)
+
+    def request_rows():
+        today = now.date()
+        for _ in range(requests):
+            # Активность распределена неравномерно: небольшая доля пользователей делает большую часть запросов
+            user_id = min(users, int(rng.paretovariate(1.2))) if rng.random() < 0.5 else rng.randint(1, users)
+            yield (user_id, rng.choice(MODELS), today - timedelta(days=min(days - 1, int(rng.expovariate(1 / 7)))))
+
+    def insert(query, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= SEED_BATCH:
+                conn.executemany(query, batch)
+                batch.clear()
+        if batch:
+            conn.executemany(query, batch)
+        conn.commit()
+
+    started = time.perf_counter()
+    insert('INSERT INTO users (user_id, username, subscription_level, subscription_end, is_blocked, last_selected_model, created_at) '
+           'VALUES (?, ?, ?, ?, ?, ?, ?)', user_rows())
+    insert('INSERT INTO requests (user_id, model, request_date) VALUES (?, ?, ?)', request_rows())
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - started
+
+def build_cases(db, users: int, admin_ids: set, rng: random.Random, page_size: int,
+                deep_cursor: tuple | None = None) -> list[tuple[str, callable, int | None]]:
+    """(имя, фабрика корутины, лимит итераций - None значит по умолчанию)."""
+    uid = lambda: rng.randint(1, users)
+    week_ago = datetime.now().date() - timedelta(days=7)
+    return [
+        ('get_user_requests_today', lambda: db.get_user_requests_today(uid()), None),
+        ('check_subscription', lambda: db.check_subscription(uid()), None),
+        ('is_user_blocked', lambda: db.is_user_blocked(uid()), None),
+        ('get_user_settings', lambda: db.get_user_settings(uid()), None),
+        ('get_user_info', lambda: db.get_user_info(uid()), None),
+        ('get_last_selected_model', lambda: db.get_last_selected_model(uid()), None),
+        ('get_user_id_by_username', lambda: db.get_user_id_by_username(f"user_{uid()}"), None),
+        ('get_subscription_end', lambda: db.get_subscription_end(uid()), None),
+        ('add_request', lambda: db.add_request(uid(), rng.choice(MODELS)), None),
+        ('update_last_selected_model', lambda: db.update_last_selected_model(uid(), rng.choice(MODELS)), None),
+        ('get_user_count', lambda: db.get_user_count(), 20),
+        ('get_registration_counts', lambda: db.get_registration_counts(), 20),
+        ('get_subscription_stats', lambda: db.get_subscription_stats(), 20),
+        ('count_users[active_7d]', lambda: db.count_users(active_since=week_ago), 20),
+        ('search_users[prefix]', lambda: db.search_users('us', page_size), 20),
+        ('search_users[common]', lambda: db.search_users('user', page_size), 20),
+        ('search_users[substring]', lambda: db.search_users(f"_{uid()}"[:4], page_size), 20),
+        ('get_users_page[first]', lambda: db.get_users_page(page_size), 20),
+        ('get_users_page[deep]', lambda: db.get_users_page(page_size, deep_cursor), 20),
+        ('get_users_page[level=2,deep]', lambda: db.get_users_page(page_size, deep_cursor, level=2), 20),
+        ('get_all_user_ids', lambda: db.get_all_user_ids(), 3),
+        # Изменяющие массовые операции - последними, у них мало итераций
+        ('cleanup_expired_subscriptions', lambda: db.cleanup_expired_subscriptions(), 3),
+        ('reset_all_subscriptions', lambda: db.reset_all_subscriptions(admin_ids), 1),
+    ]
+
+async def time_case(factory, iterations: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors: list[str] = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await factory()
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(iterations)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {
+        'iterations': iterations,
+        'ops_per_s': round(iterations / elapsed, 1) if elapsed else 0,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': round(pick(0.50), 3),
+        'p95_ms': round(pick(0.95), 3),
+        'p99_ms': round(pick(0.99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'errors': len(errors),
+        'sample_error': errors[0] if errors else None,
+    }
+
+async def run(args) -> dict:
+    from database import Database
+
+    rng = random.Random(args.seed)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="db-bench-"), "bench.db")
+    db = Database(db_path)
+
+    seed_seconds = None
+    if not (args.reuse and os.path.exists(db_path)):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        await db.init_db()
+        seed_seconds = round(seed(db_path, args.users, args.requests, args.days, rng), 1)
+    else:
+        await db.init_db() # Применяет миграции схемы к существующему файлу
+
+    conn = sqlite3.connect(db_path)
+    users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    requests = conn.execute('SELECT COUNT(*) FROM requests').fetchone()[0]
+    indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")]
+    # Курсор на 90% глубины списка - аналог дальней страницы при постраничном просмотре
+    deep_cursor = conn.execute('SELECT created_at, user_id FROM users ORDER BY created_at DESC, user_id DESC LIMIT 1 OFFSET ?',
+                               (int(users * 0.9),)).fetchone()
+    conn.close()
+
+    results = {}
+    for name, factory, limit in build_cases(db, users, {1}, rng, args.page_size, deep_cursor):
+        if args.only and not any(part in name for part in args.only):
+            continue
+        iterations = min(limit, args.iterations) if limit else args.iterations
+        results[name] = await time_case(factory, iterations, args.concurrency)
+        print(f"{name:<42} p50={results[name]['p50_ms']:>9}ms p95={results[name]['p95_ms']:>9}ms "
+              f"p99={results[name]['p99_ms']:>9}ms {results[name]['ops_per_s']:>9} op/s"
+              + (f"  ошибок: {results[name]['errors']}" if results[name]['errors'] else ""))
+
+    return {
+        'sqlite_version': sqlite3.sqlite_version,
+        'db_path': db_path,
+        'db_size_mb': round(os.path.getsize(db_path) / 2**20, 1),
+        'users': users,
+        'requests': requests,
+        'indexes': indexes,
+        'seed_seconds': seed_seconds,
+        'concurrency': args.concurrency,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'methods': results,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк методов Database на больших объемах данных")
+    parser.add_argument("--db", help="путь к файлу БД (по умолчанию временный)")
+    parser.add_argument("--reuse", action="store_true", help="не пересоздавать данные, если файл уже есть")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=2_000_000, help="число строк в таблице requests")
+    parser.add_argument("--days", type=int, default=365, help="глубина истории регистраций и запросов")
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов на метод")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--only", nargs="*", help="замерять только методы, содержащие эти подстроки")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="путь для машиночитаемого отчета")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+# benchmarks/e2e_load.py
+"""
+Сквозной нагрузочный бенчмарк. Синтетические апдейты (диалог в личке, кнопки меню,
+триггер в группе, админская рассылка) подаются в настоящий Dispatcher из bot.py,
+а Bot API и API моделей подменены локальными серверами - сеть не нужна.
+
+Отчет: пропускная способность, p50/p95/p99 времени обработки апдейта и среднее
+число запросов к БД и к Bot API на апдейт по каждому сценарию.
+
+Запуск:
+    python -m benchmarks.e2e_load --users 50 --turns 5 --llm-latency 0.2 --json report.json
+    python -m benchmarks.e2e_load --cassette api_cassette.jsonl.gz --cassette-speed 0.1
+
+Если апдейтов с ошибкой (исключение или апдейт без хэндлера) больше --max-error-rate
+(по умолчанию 1%) или сценарии диалога не сделали ни одного запроса к API моделей, код выхода - 1.
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_telegram import FakeTelegramServer
+from benchmarks.openai_stub import OpenAIStub
+
+BENCH_TOKEN = "123456:BENCHMARK-TOKEN"
+ADMIN_ID = 1
+GROUP_CHAT_ID = -100500
+FIRST_USER_ID = 10_000
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1_000_000)
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"bench_user_{user_id}"}
+
+def message_update(user_id: int, text: str, chat_id: int | None = None) -> dict:
+    chat_id = chat_id or user_id
+    chat = {"id": chat_id, "type": "private"} if chat_id > 0 else {"id": chat_id, "type": "supergroup", "title": "Bench"}
+    message = {"message_id": next(_message_ids), "date": int(time.time()), "chat": chat, "from": _user(user_id), "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+def callback_update(user_id: int, data: str) -> dict:
+    message = {
+        "message_id": next(_message_ids), "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"}, "text": "menu",
+    }
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {"id": str(next(_update_ids)), "from": _user(user_id), "chat_instance": "bench", "message": message, "data": data},
+    }
+
+@functools.lru_cache(maxsize=None)
+def _catalog():
+    # Код кнопок зависит только от состава каталога, поэтому совпадает с каталогом бота
+    import config
+    from model_catalog import ModelCatalog
+    return ModelCatalog(config.MODEL_CATALOG_PATH)
+
+def model_callback_data(model: str) -> str:
+    return _catalog().model_callback(model)
+
+def scenario_private_chat(user_id: int, turns: int) -> list[dict]:
+    catalog = _catalog()
+    provider = catalog.categories_for(0)[0]
+    model = catalog.models_for(0, provider)[0]
+    updates = [
+        message_update(user_id, "/start"),
+        callback_update(user_id, "menu_models"),
+        callback_update(user_id, catalog.category_callback(provider)),
+        callback_update(user_id, model_callback_data(model)),
+    ]
+    updates += [message_update(user_id, f"Вопрос номер {turn}: объясни что-нибудь подробно.") for turn in range(turns)]
+    return updates
+
+def scenario_menu(user_id: int, turns: int) -> list[dict]:
+    updates = [message_update(user_id, "/start")]
+    for _ in range(turns):
+        updates += [callback_update(user_id, data) for data in ("menu_help", "back_main", "menu_subscription", "back_main", "menu_settings", "back_main")]
+    return updates
+
+def scenario_group(user_id: int, turns: int) -> list[dict]:
+    import config
+    updates = [message_update(user_id, "/start")]
+    updates += [message_update(user_id, f"{config.GROUP_TRIGGER} вопрос {turn}", chat_id=GROUP_CHAT_ID) for turn in range(turns)]
+    return updates
+
+def scenario_admin_broadcast(user_id: int, turns: int) -> list[dict]:
+    return [
+        message_update(user_id, "/start"),
+        callback_update(user_id, "admin_broadcast"),
+        message_update(user_id, "Бенчмарк-рассылка"),
+        callback_update(user_id, "broadcast_send"),
+    ]
+
+SCENARIOS = {
+    "private_chat": scenario_private_chat,
+    "menu": scenario_menu,
+    "group": scenario_group,
+}
+# Сценарии, которые ходят в API моделей: их пользователям нужна платная подписка (в группах бот отвечает только им)
+LLM_SCENARIOS = ("private_chat", "group")
+BENCH_SUBSCRIPTION_LEVEL = 1
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+class ScenarioStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.db_queries = 0
+        self.tg_calls = 0
+        self.errors = 0
+        self.first_errors: list[str] = []
+
+    def summary(self) -> dict:
+        count = len(self.latencies)
+        return {
+            "updates": count,
+            "errors": self.errors,
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(self.latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 2),
+            "db_queries_per_update": round(self.db_queries / count, 2) if count else 0,
+            "tg_calls_per_update": round(self.tg_calls / count, 2) if count else 0,
+            "sample_errors": self.first_errors,
+        }
+
+async def run_user(dp, bot, updates: list[dict], stats: ScenarioStats):
+    from aiogram.dispatcher.event.bases import UNHANDLED
+    from aiogram.types import Update
+    from tracing import trace
+
+    def error(text: str):
+        stats.errors += 1
+        if len(stats.first_errors) < 3:
+            stats.first_errors.append(text)
+
+    # Апдейты одного пользователя идут строго по очереди, как при long polling
+    for raw in updates:
+        update = Update.model_validate(raw, context={"bot": bot})
+        start = time.perf_counter()
+        with trace("bench.update") as root:
+            try:
+                result = await dp.feed_update(bot, update)
+            except Exception as e:
+                error(f"{type(e).__name__}: {e}")
+            else:
+                # Апдейт, который не нашел хэндлера, ничего не измерил - считаем его ошибкой
+                if result is UNHANDLED:
+                    event = update.message or update.callback_query
+                    error(f"UNHANDLED: {getattr(event, 'text', None) or getattr(event, 'data', None)!r}")
+        stats.latencies.append(time.perf_counter() - start)
+        stats.db_queries += root.count("db.")
+        stats.tg_calls += root.count("tg.")
+
+async def run_benchmark(args) -> dict:
+    telegram = FakeTelegramServer(latency=args.tg_latency, jitter=args.tg_jitter, retry_after_rate=args.tg_429_rate)
+    llm = OpenAIStub(latency=args.llm_latency, jitter=args.llm_jitter, error_rate=args.llm_error_rate)
+    telegram_url = await telegram.start()
+    llm_url = await llm.start()
+
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    # Конфиг читается при импорте, поэтому окружение готовим до импорта модулей бота
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "ADMIN_IDS": str(ADMIN_ID),
+        "API_KEY": "bench",
+        "API_URL": llm_url,
+        "DATABASE": os.path.join(workdir, "bench.db"),
+        "SLOW_UPDATE_THRESHOLD": "0",
+        "METRICS_PORT": "0",
+    })
+    if args.cassette:
+        # Ответы реальной формы из записанной кассеты вместо заглушки
+        os.environ.update({
+            "API_CASSETTE_MODE": "replay",
+            "API_CASSETTE_PATH": args.cassette,
+            "API_CASSETTE_SPEED": str(args.cassette_speed),
+            "API_CASSETTE_MATCH": "model",
+        })
+    import config
+    config.IMAGE_API_URL = llm_url
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from bot import create_bot, create_dispatcher
+
+    bot = create_bot(session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url)))
+    dp = create_dispatcher()
+    await dp["db"].init_db()
+
+    stats = {name: ScenarioStats() for name in SCENARIOS}
+    names = list(SCENARIOS)
+    jobs = []
+    for index in range(args.users):
+        name = names[index % len(names)]
+        user_id = FIRST_USER_ID + index
+        if name in LLM_SCENARIOS:
+            await dp["db"].add_user(user_id, _user(user_id)["username"])
+            await dp["db"].update_subscription(user_id, BENCH_SUBSCRIPTION_LEVEL, None)
+        jobs.append(run_user(dp, bot, SCENARIOS[name](user_id, args.turns), stats[name]))
+
+    started = time.perf_counter()
+    await asyncio.gather(*jobs)
+    if args.broadcast:
+        stats["admin_broadcast"] = ScenarioStats()
+        await run_user(dp, bot, scenario_admin_broadcast(ADMIN_ID, 1), stats["admin_broadcast"])
+    # Дожидаемся фоновых задач (рассылка, уведомления), как при штатной остановке
+    abandoned = await dp["task_supervisor"].drain(args.drain_timeout)
+    elapsed = time.perf_counter() - started
+
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await bot.session.close()
+    await telegram.stop()
+    await llm.stop()
+
+    total_updates = sum(len(s.latencies) for s in stats.values())
+    all_latencies = [latency for s in stats.values() for latency in s.latencies]
+    return {
+        "params": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "updates": total_updates,
+        "errors": sum(s.errors for s in stats.values()),
+        "throughput_ups": round(total_updates / elapsed, 2) if elapsed else 0,
+        "p50_ms": round(percentile(all_latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(all_latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(all_latencies, 99) * 1000, 2),
+        "abandoned_background_tasks": abandoned,
+        "telegram_calls": telegram.calls,
+        # В режиме кассеты заглушка не используется: запросы к API - это воспроизведенные ответы
+        "llm_requests": llm.requests + (dp["api_service"].cassette.replayed if args.cassette else 0),
+        "llm_scenarios_run": any(stats[name].latencies for name in LLM_SCENARIOS) and args.turns > 0,
+        "scenarios": {name: s.summary() for name, s in stats.items()},
+    }
+
+def print_report(report: dict):
+    print(f"Апдейтов: {report['updates']} за {report['elapsed_s']} с -> {report['throughput_ups']} апд/с")
+    print(f"Все сценарии: p50={report['p50_ms']}ms p95={report['p95_ms']}ms p99={report['p99_ms']}ms")
+    print(f"{'сценарий':<16}{'апд.':>7}{'ошиб.':>7}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'БД/апд':>9}{'TG/апд':>9}")
+    for name, s in report["scenarios"].items():
+        print(f"{name:<16}{s['updates']:>7}{s['errors']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}"
+              f"{s['db_queries_per_update']:>9}{s['tg_calls_per_update']:>9}")
+        for error in s["sample_errors"]:
+            print(f"    ! {error}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный бенчмарк бота")
+    parser.add_argument("--users", type=int, default=30, help="число виртуальных пользователей")
+    parser.add_argument("--turns", type=int, default=5, help="сообщений/итераций на пользователя")
+    parser.add_argument("--broadcast", action="store_true", help="добавить админскую рассылку по всем пользователям")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--tg-latency", type=float, default=0.0)
+    parser.add_argument("--tg-jitter", type=float, default=0.0)
+    parser.add_argument("--tg-429-rate", type=float, default=0.0)
+    parser.add_argument("--cassette", help="воспроизводить ответы API из кассеты (API_CASSETTE_MODE=record)")
+    parser.add_argument("--cassette-speed", type=float, default=0.0, help="множитель записанной задержки, 0 - без задержки")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="путь для машиночитаемого отчета")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="доля апдейтов с ошибкой, при превышении которой бенчмарк завершается с кодом 1")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    # С ошибками замеры меряют путь исключения, а не работу бота - такой прогон считается проваленным
+    error_rate = report["errors"] / report["updates"] if report["updates"] else 0.0
+    if error_rate > args.max_error_rate:
+        print(f"Доля ошибок {error_rate:.1%} больше допустимой {args.max_error_rate:.1%}", file=sys.stderr)
+        return 1
+    if report["llm_scenarios_run"] and not report["llm_requests"]:
+        print("Сценарии диалога не сделали ни одного запроса к API моделей", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# benchmarks/fake_telegram.py
+"""
+Локальный фейковый Bot API сервер для бенчмарков. Отвечает на POST /bot<token>/<method>
+правдоподобными результатами, считает вызовы и умеет добавлять задержку и 429.
+"""
+import asyncio
+import itertools
+import random
+import time
+
+from aiohttp import web
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Arima.AI", "username": "arima_bench_bot"}
+
+# Методы, которые в ответ возвращают True
+_BOOL_METHODS = {
+    "answercallbackquery", "deletemessage", "pinchatmessage", "unpinchatmessage",
+    "setmycommands", "deletewebhook", "sendchataction",
+}
+# Методы, которые возвращают отправленное/отредактированное сообщение
+_MESSAGE_METHODS = {"sendmessage", "editmessagetext", "sendphoto", "senddocument", "editmessagereplymarkup"}
+
+class FakeTelegramServer:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, retry_after_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        payload = dict(await request.post()) # aiogram шлет параметры как form-data
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1},
+            })
+        return web.json_response({"ok": True, "result": self._result(method, payload)})
+
+    def _result(self, method: str, payload: dict):
+        if method == "getme":
+            return BOT_USER
+        if method in _BOOL_METHODS:
+            return True
+        if method == "getupdates":
+            return []
+        if method == "getfile":
+            return {"file_id": payload.get("file_id", ""), "file_unique_id": "u", "file_size": 0, "file_path": "files/bench"}
+        if method in _MESSAGE_METHODS:
+            chat_id = int(payload.get("chat_id") or 0)
+            message = {
+                "message_id": int(payload.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "from": BOT_USER,
+            }
+            if method == "sendphoto":
+                message["photo"] = [{"file_id": f"bench-photo-{message['message_id']}", "file_unique_id": "p", "width": 1024, "height": 1024}]
+            elif method == "senddocument":
+                message["document"] = {"file_id": f"bench-doc-{message['message_id']}", "file_unique_id": "d"}
+            else:
+                message["text"] = payload.get("text", "")
+            return message
+        return True
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
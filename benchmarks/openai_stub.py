@@ -0,0 +1,244 @@
+# benchmarks/openai_stub.py
+"""
+Заглушка OpenAI-совместимого API для офлайн-тестов и планирования мощностей.
+
+Эндпоинты:
+    POST /v1/chat/completions     - обычный ответ и SSE-стриминг (stream: true)
+    POST /v1/images/generations   - response_format url или b64_json
+    GET  /v1/images/files/{name}  - картинка по выданной ссылке
+
+Задержка задается распределением, скорость генерации - в токенах в секунду,
+ошибки 429/5xx вносятся с заданной вероятностью, каждый запрос пишется в JSONL-лог.
+
+Запуск как отдельного сервера (config.API_URL / IMAGE_API_URL = http://127.0.0.1:8099/v1):
+    python -m benchmarks.openai_stub --port 8099 --latency lognormal:-0.5,0.6 \\
+        --tokens-per-sec 60 --rate-429 0.02 --rate-5xx 0.01 --log stub_requests.jsonl
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import math
+import random
+import time
+
+from aiohttp import web
+
+# PNG 1x1 - достаточно, чтобы клиент скачал и загрузил настоящий файл
+STUB_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+CHARS_PER_TOKEN = 4
+
+def parse_distribution(spec: str):
+    """
+    Возвращает функцию-генератор задержки в секундах по описанию:
+    fixed:X | uniform:A,B | normal:MU,SIGMA | lognormal:MU,SIGMA | exp:MEAN
+    """
+    kind, _, raw = spec.partition(":")
+    params = [float(p) for p in raw.split(",") if p]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(params[0], params[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1 / params[0]) if params[0] > 0 else 0.0
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+class OpenAIStub:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        answer_chars: int = 600,
+        latency_dist: str | None = None,
+        model_latency: dict[str, str] | None = None,
+        tokens_per_sec: float = 0.0,
+        rate_429: float = 0.0,
+        log_path: str | None = None,
+    ):
+        # Задержка до первого токена: распределение или latency + равномерный jitter
+        self._latency = parse_distribution(latency_dist) if latency_dist else (lambda: latency + random.uniform(0, jitter))
+        self._model_latency = {model: parse_distribution(spec) for model, spec in (model_latency or {}).items()}
+        self.error_rate = error_rate # Доля ответов 5xx
+        self.rate_429 = rate_429
+        self.answer_chars = answer_chars
+        self.tokens_per_sec = tokens_per_sec
+        self.log_path = log_path
+        self.requests = 0
+        self.status_counts: dict[int, int] = {}
+        self._ids = itertools.count(1)
+        self._log_file = None
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    # --- Общая логика ---
+
+    def _log(self, endpoint: str, model: str, status: int, started: float, **extra):
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if self._log_file:
+            record = {"ts": round(time.time(), 3), "endpoint": endpoint, "model": model, "status": status,
+                      "latency_ms": round((time.perf_counter() - started) * 1000, 1), **extra}
+            self._log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log_file.flush()
+
+    async def _delay_or_error(self, model: str) -> web.Response | None:
+        self.requests += 1
+        delay = self._model_latency.get(model, self._latency)()
+        if delay:
+            await asyncio.sleep(delay)
+        roll = random.random()
+        if roll < self.rate_429:
+            return web.json_response(
+                {"error": {"message": "stub: rate limit exceeded", "type": "rate_limit_error"}},
+                status=429, headers={"Retry-After": "1"}
+            )
+        if roll < self.rate_429 + self.error_rate:
+            return web.json_response({"error": {"message": "stub: injected error", "type": "server_error"}},
+                                     status=random.choice((500, 502, 503)))
+        return None
+
+    def _answer_tokens(self, payload: dict) -> list[str]:
+        text = ("Stub answer. " * (self.answer_chars // 13 + 1))[:self.answer_chars]
+        tokens = [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+        if payload.get("max_tokens"):
+            tokens = tokens[:int(payload["max_tokens"])]
+        return tokens
+
+    def _usage(self, payload: dict, completion_tokens: int) -> dict:
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+        prompt_tokens = math.ceil(prompt_chars / CHARS_PER_TOKEN)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    # --- Хэндлеры ---
+
+    async def _chat_completions(self, request: web.Request) -> web.StreamResponse:
+        started = time.perf_counter()
+        payload = await request.json()
+        model = payload.get("model", "stub")
+        stream = bool(payload.get("stream"))
+        error = await self._delay_or_error(model)
+        if error:
+            self._log("chat/completions", model, error.status, started, stream=stream)
+            return error
+
+        tokens = self._answer_tokens(payload)
+        completion_id = f"chatcmpl-stub-{next(self._ids)}"
+        created = int(time.time())
+        token_delay = 1 / self.tokens_per_sec if self.tokens_per_sec else 0.0
+
+        if not stream:
+            if token_delay:
+                await asyncio.sleep(token_delay * len(tokens))
+            self._log("chat/completions", model, 200, started, stream=False, tokens=len(tokens))
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": self._usage(payload, len(tokens)),
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(delta: dict, finish_reason: str | None = None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+
+        await send({"role": "assistant"})
+        for token in tokens:
+            if token_delay:
+                await asyncio.sleep(token_delay)
+            await send({"content": token})
+        await send({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        self._log("chat/completions", model, 200, started, stream=True, tokens=len(tokens))
+        return response
+
+    async def _images_generations(self, request: web.Request) -> web.Response:
+        started = time.perf_counter()
+        payload = await request.json()
+        model = payload.get("model", "stub")
+        error = await self._delay_or_error(model)
+        if error:
+            self._log("images/generations", model, error.status, started)
+            return error
+
+        if payload.get("response_format") == "b64_json":
+            item = {"b64_json": base64.b64encode(STUB_PNG).decode()}
+        else:
+            item = {"url": f"{self.url}/v1/images/files/stub-{next(self._ids)}.png"}
+        self._log("images/generations", model, 200, started, response_format=payload.get("response_format", "url"))
+        return web.json_response({"created": int(time.time()), "data": [item]})
+
+    async def _image_file(self, request: web.Request) -> web.Response:
+        return web.Response(body=STUB_PNG, content_type="image/png")
+
+    # --- Жизненный цикл ---
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        if self.log_path:
+            self._log_file = open(self.log_path, "a", encoding="utf-8")
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        app.router.add_post("/v1/images/generations", self._images_generations)
+        app.router.add_get("/v1/images/files/{name}", self._image_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}"
+        return f"{self.url}/v1"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+        if self._log_file:
+            self._log_file.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-совместимая заглушка для офлайн-тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", default="fixed:0.3", help="распределение задержки до первого токена")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=DIST",
+                        help="отдельное распределение для модели, можно указывать несколько раз")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="скорость генерации, 0 - мгновенно")
+    parser.add_argument("--answer-chars", type=int, default=600)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--log", help="JSONL-лог запросов")
+    return parser.parse_args(argv)
+
+async def serve(args):
+    stub = OpenAIStub(
+        latency_dist=args.latency,
+        model_latency=dict(item.split("=", 1) for item in args.model_latency),
+        tokens_per_sec=args.tokens_per_sec,
+        answer_chars=args.answer_chars,
+        rate_429=args.rate_429,
+        error_rate=args.rate_5xx,
+        log_path=args.log,
+    )
+    url = await stub.start(args.host, args.port)
+    print(f"OpenAI stub слушает {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+        print(f"Запросов: {stub.requests}, статусы: {stub.status_counts}")
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -1,52 +1,134 @@
 import asyncio
 import logging
+import signal
+import time
+from contextlib import suppress
 import aiohttp # Added
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.types import BotCommand
 
 import config
+import keyboards as kb
+from bot_identity import BotIdentity
 from database import Database
 from handlers.common_handlers import common_router
 # from handlers.user_handlers import user_router # Old user router
 from user_handlers_private import user_private_router # New user router
 from handlers.admin_handlers import admin_router
 from handlers.group_handlers import group_router
-from handlers.middleware import AccessControlMiddleware
+from handlers.middleware import AccessControlMiddleware, InFlightMiddleware, MetricsMiddleware
 from api_service import APIService # Added
+from cassette import Cassette
+from group_queue import GroupRequestQueue
+from group_threads import GroupThreadStore
+from image_queue import ImageJobQueue
+from model_catalog import ModelCatalog, reload_catalog
+from model_prober import ModelProber
 from user_service import UserService # Added
+from task_supervisor import TaskSupervisor
+from metrics import QUEUE_DEPTH, TelegramRequestMetrics, start_metrics_server
+from tracing import TracingMiddleware, TracingRequestMiddleware
 
 logging.basicConfig(level=logging.INFO)
 
 MODEL_STATUS_CACHE = {}
 
+async def warm_up(dispatcher: Dispatcher, bot: Bot):
+    """Готовит при старте то, что иначе строилось бы на первых апдейтах: данные бота, клавиатуры."""
+    bot_identity = dispatcher.get("bot_identity")
+    if bot_identity:
+        try:
+            me = await bot_identity.refresh(bot)
+            logging.info(f"Bot: @{me.username} ({me.id})")
+        except Exception:
+            logging.exception("Не удалось получить данные бота при старте, запросим при первом обращении")
+    model_catalog = dispatcher.get("model_catalog")
+    if model_catalog:
+        kb.warm_up_keyboards(model_catalog)
+
+async def on_startup(dispatcher: Dispatcher, bot: Bot):
+    await warm_up(dispatcher, bot)
+
+    metrics_port = dispatcher.get("metrics_port", config.METRICS_PORT)
+    if metrics_port:
+        dispatcher["metrics_runner"] = await start_metrics_server(config.METRICS_HOST, metrics_port)
+        logging.info(f"Metrics endpoint: http://{config.METRICS_HOST}:{metrics_port}/metrics")
+
+    model_prober = dispatcher.get("model_prober")
+    if model_prober:
+        model_prober.start()
+
+    # SIGHUP перечитывает каталог моделей без перезапуска (на Windows сигнала нет)
+    model_catalog = dispatcher.get("model_catalog")
+    if model_catalog and hasattr(signal, "SIGHUP"):
+        with suppress(NotImplementedError, RuntimeError):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: logging.info(reload_catalog(model_catalog)))
+
 # Added shutdown handler
 async def on_shutdown(dispatcher: Dispatcher):
+    model_prober = dispatcher.get("model_prober")
+    if model_prober:
+        await model_prober.stop()
+
+    # Сначала даем закончить начатые генерации и рассылки, пока сессии еще открыты.
+    # Очередь картинок и остальные задачи укладываются в один общий SHUTDOWN_DRAIN_TIMEOUT
+    deadline = time.monotonic() + config.SHUTDOWN_DRAIN_TIMEOUT
+    image_queue = dispatcher.get("image_queue")
+    if image_queue:
+        await image_queue.stop(config.SHUTDOWN_DRAIN_TIMEOUT)
+    task_supervisor = dispatcher.get("task_supervisor")
+    if task_supervisor:
+        await task_supervisor.drain(max(0.0, deadline - time.monotonic()))
+
     client_session = dispatcher.get("client_session")
     if client_session and not client_session.closed:
         await client_session.close()
         logging.info("Aiohttp client session closed.")
 
-async def main():
-    if not config.BOT_TOKEN:
-        logging.critical("Ошибка: BOT_TOKEN не найден. Проверьте .env файл.")
-        return
+    metrics_runner = dispatcher.get("metrics_runner")
+    if metrics_runner:
+        await metrics_runner.cleanup()
 
-    db = Database(config.DATABASE_PATH)
-    await db.init_db()
+def create_bot(session: AiohttpSession | None = None) -> Bot:
+    bot = Bot(token=config.BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    bot.session.middleware(TelegramRequestMetrics())
+    bot.session.middleware(TracingRequestMiddleware())
+    return bot
+
+def create_dispatcher(worker_index: int = 0) -> Dispatcher:
+    """
+    Создает сервисы и собирает диспетчер. Вызывается один раз на процесс (роутеры - синглтоны).
+    worker_index - номер процесса-воркера в режиме нескольких процессов: фоновую проверку моделей ведет только нулевой.
+    """
+    db = Database(config.DATABASE_PATH, busy_timeout=config.DB_BUSY_TIMEOUT, count_cache_ttl=config.USER_COUNT_CACHE_TTL,
+                  image_cache_ttl=config.IMAGE_CACHE_TTL, image_cache_max_rows=config.IMAGE_CACHE_MAX_ROWS)
 
     # Instantiate aiohttp.ClientSession and services
     client_session = aiohttp.ClientSession()
+    cassette = None
+    if config.API_CASSETTE_MODE:
+        cassette = Cassette(config.API_CASSETTE_PATH, config.API_CASSETTE_MODE, config.API_CASSETTE_SPEED, config.API_CASSETTE_MATCH)
+        logging.info(f"APIService cassette: {config.API_CASSETTE_MODE} {config.API_CASSETTE_PATH}")
     # Ensure API_KEY, API_URL, IMAGE_API_URL are in config and .env
     api_service = APIService(
         api_key=getattr(config, "API_KEY", "YOUR_DEFAULT_API_KEY_IF_NOT_SET"),
         chat_api_url=getattr(config, "API_URL", "YOUR_DEFAULT_CHAT_API_URL_IF_NOT_SET"),
         image_api_url=getattr(config, "IMAGE_API_URL", "YOUR_DEFAULT_IMAGE_API_URL_IF_NOT_SET"),
-        session=client_session
+        session=client_session,
+        cassette=cassette
     )
     user_service = UserService(db=db)
+    task_supervisor = TaskSupervisor()
+    if cassette:
+        task_supervisor.add_flush_hook("cassette", cassette.close)
+    model_catalog = ModelCatalog(config.MODEL_CATALOG_PATH)
+    model_prober = ModelProber(api_service, MODEL_STATUS_CACHE, model_catalog, db=db, leader=worker_index == 0)
+    # IMAGE_WORKERS - лимит на весь бот: в режиме нескольких процессов он делится между ними
+    # (но не меньше одного воркера на процесс, иначе пользователи этого процесса не дождутся генерации)
+    image_queue = ImageJobQueue(task_supervisor, workers=max(1, config.IMAGE_WORKERS // config.WORKER_PROCESSES))
 
-    bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
     dp = Dispatcher()
 
     dp["model_status_cache"] = MODEL_STATUS_CACHE
@@ -55,6 +137,28 @@ async def main():
     dp["api_service"] = api_service
     dp["user_service"] = user_service
     dp["client_session"] = client_session
+    dp["task_supervisor"] = task_supervisor
+    dp["model_catalog"] = model_catalog
+    dp["model_prober"] = model_prober
+    dp["model_latency"] = model_prober.latency
+    dp["image_queue"] = image_queue
+    dp["group_threads"] = GroupThreadStore()
+    group_queue = GroupRequestQueue(task_supervisor)
+    dp["group_queue"] = group_queue
+    dp["bot_identity"] = BotIdentity()
+
+    # Учет апдейтов в обработке для корректной остановки (SIGTERM)
+    dp.update.outer_middleware(InFlightMiddleware(task_supervisor))
+    dp.update.outer_middleware(TracingMiddleware(config.SLOW_UPDATE_THRESHOLD, config.TRACE_SAMPLE_RATE))
+    # Время обработки по хэндлерам (внутренние мидлвари диспетчера действуют на все вложенные роутеры)
+    dp.message.middleware(MetricsMiddleware("message"))
+    dp.callback_query.middleware(MetricsMiddleware("callback_query"))
+    QUEUE_DEPTH.set_function(lambda: task_supervisor.in_flight_count, queue="updates_in_flight")
+    QUEUE_DEPTH.set_function(lambda: task_supervisor.background_count, queue="background_tasks")
+    QUEUE_DEPTH.set_function(lambda: image_queue.size, queue="image_jobs")
+    QUEUE_DEPTH.set_function(lambda: image_queue.running, queue="image_jobs_running")
+    QUEUE_DEPTH.set_function(lambda: group_queue.queued, queue="group_requests")
+    QUEUE_DEPTH.set_function(lambda: group_queue.running, queue="group_requests_running")
 
     # Создаем и регистрируем мидлварь для контроля доступа
     access_middleware = AccessControlMiddleware(user_service=user_service) # Changed: pass user_service
@@ -62,21 +166,42 @@ async def main():
     user_private_router.callback_query.middleware(access_middleware) # Apply to new router
     group_router.message.middleware(access_middleware)
 
-    commands = [
-        BotCommand(command="start", description="Главное меню"),
-        BotCommand(command="new", description="Начать новый диалог")
-    ]
-    await bot.set_my_commands(commands)
-
     dp.include_router(common_router)
     dp.include_router(admin_router)
     dp.include_router(group_router)
     dp.include_router(user_private_router) # Include new router
 
-    # Register shutdown handler
+    # Register startup/shutdown handlers
+    dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
+    return dp
 
+async def prepare_bot(bot: Bot):
+    commands = [
+        BotCommand(command="start", description="Главное меню"),
+        BotCommand(command="new", description="Начать новый диалог")
+    ]
+    await bot.set_my_commands(commands)
     await bot.delete_webhook(drop_pending_updates=True)
+
+async def main():
+    if not config.BOT_TOKEN:
+        logging.critical("Ошибка: BOT_TOKEN не найден. Проверьте .env файл.")
+        return
+
+    if config.WORKER_PROCESSES > 1:
+        # Схему БД создает супервизор до старта воркеров, чтобы они не гонялись за DDL
+        await Database(config.DATABASE_PATH, busy_timeout=config.DB_BUSY_TIMEOUT, image_cache_ttl=config.IMAGE_CACHE_TTL,
+                       image_cache_max_rows=config.IMAGE_CACHE_MAX_ROWS).init_db()
+        from sharding import run_supervisor
+        await run_supervisor(config.WORKER_PROCESSES)
+        return
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    await dp["db"].init_db()
+
+    await prepare_bot(bot)
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+# bot_identity.py
+"""
+Данные бота (getMe) и все, что из них строится. Запрашиваются один раз при старте
+(bot.warm_up) и обновляются не чаще раза в BOT_IDENTITY_REFRESH секунд, чтобы частые
+хэндлеры (например, /start в группе) не ходили в Bot API за username.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.types import User
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class BotIdentity:
+    def __init__(self, refresh_interval: float = config.BOT_IDENTITY_REFRESH):
+        self.refresh_interval = refresh_interval
+        self.user: User | None = None
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, bot: Bot) -> User:
+        self.user = await bot.get_me()
+        self._fetched_at = time.monotonic()
+        return self.user
+
+    async def get(self, bot: Bot) -> User:
+        """Закэшированный getMe. Если обновить не удалось, остаемся на прежних данных."""
+        if self.user is not None and time.monotonic() - self._fetched_at < self.refresh_interval:
+            return self.user
+        async with self._lock: # Одновременные вызовы ждут один запрос
+            if self.user is not None and time.monotonic() - self._fetched_at < self.refresh_interval:
+                return self.user
+            try:
+                return await self.refresh(bot)
+            except Exception:
+                if self.user is None:
+                    raise
+                logger.warning("Не удалось обновить данные бота, используются прежние", exc_info=True)
+                self._fetched_at = time.monotonic()
+                return self.user
+
+    def deep_link(self, payload: str) -> str:
+        return f"https://t.me/{self.user.username}?start={payload}"
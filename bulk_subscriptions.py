@@ -0,0 +1,119 @@
+# bulk_subscriptions.py
+"""
+Массовая выдача и снятие подписок из CSV: строки `id_или_username,уровень,дней`.
+Пустое поле дней - подписка без срока, уровень 0 - снять подписку.
+
+Файл разбирается построчно csv.reader'ом в пуле потоков, пользователи находятся
+пакетными запросами (Database.resolve_users), изменения применяются одной транзакцией
+(Database.bulk_update_subscriptions). Уведомления пользователям рассылает фоновая задача
+(admin_handlers.notify_subscription_changes).
+"""
+import asyncio
+import csv
+import io
+import re
+from datetime import datetime
+
+import config
+from database import Database
+
+_USERNAME_RE = re.compile(r'[A-Za-z0-9_]{1,32}')
+_NUMBER_RE = re.compile(r'[0-9]+')
+
+class BulkRow:
+    __slots__ = ("line", "target", "level", "days")
+
+    def __init__(self, line: int, target: int | str, level: int, days: int | None):
+        self.line = line
+        self.target = target # user_id или username без @
+        self.level = level
+        self.days = days
+
+class BulkResult:
+    __slots__ = ("changes", "notices", "not_found", "skipped")
+
+    def __init__(self):
+        self.changes: list[tuple[int, int, int | None]] = [] # (user_id, уровень, дней)
+        self.notices: list[tuple[int, int, datetime | None]] = [] # (user_id, уровень, срок из базы) - кого уведомить
+        self.not_found: list[str] = []
+        self.skipped: list[str] = []
+
+def _parse_row(line: int, fields: list[str]) -> BulkRow:
+    if len(fields) not in (2, 3):
+        raise ValueError("ожидается id_или_username,уровень,дней")
+    target, level_str, days_str = (fields + [''])[:3]
+    if not _NUMBER_RE.fullmatch(level_str) or int(level_str) not in config.SUB_LEVEL_MAP:
+        raise ValueError(f"неизвестный уровень «{level_str}»")
+    if days_str and (not _NUMBER_RE.fullmatch(days_str) or int(days_str) == 0):
+        raise ValueError(f"число дней «{days_str}» должно быть целым положительным")
+    level, days = int(level_str), int(days_str) if days_str else None
+    if _NUMBER_RE.fullmatch(target):
+        return BulkRow(line, int(target), level, days)
+    username = target.lstrip('@')
+    if not _USERNAME_RE.fullmatch(username):
+        raise ValueError(f"некорректный id или username «{target}»")
+    return BulkRow(line, username, level, days)
+
+def _parse_stream(stream: io.TextIOBase, max_rows: int) -> tuple[list[BulkRow], list[str]]:
+    first_line = stream.readline()
+    stream.seek(0)
+    # Excel с русской локалью сохраняет CSV через ";"
+    delimiter = max(',;\t', key=first_line.count)
+
+    rows: list[BulkRow] = []
+    errors: list[str] = []
+    reader = csv.reader(stream, delimiter=delimiter)
+    for fields in reader:
+        fields = [field.strip() for field in fields]
+        if not any(fields) or fields[0].startswith('#'):
+            continue
+        if len(rows) >= max_rows:
+            errors.append(f"строка {reader.line_num}: больше {max_rows} строк, остальные пропущены")
+            break
+        try:
+            rows.append(_parse_row(reader.line_num, fields))
+        except ValueError as e:
+            if reader.line_num == 1 and len(fields) > 1 and not _NUMBER_RE.fullmatch(fields[1]):
+                continue # Заголовок
+            errors.append(f"строка {reader.line_num}: {e}")
+    return rows, errors
+
+def parse_subscription_csv(data: bytes, max_rows: int = config.BULK_SUBSCRIPTION_MAX_ROWS) -> tuple[list[BulkRow], list[str]]:
+    """Строки для применения и описания ошибок разбора. Выполняется в пуле потоков."""
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            return _parse_stream(io.TextIOWrapper(io.BytesIO(data), encoding=encoding, newline=''), max_rows)
+        except UnicodeDecodeError:
+            continue
+    return _parse_stream(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace', newline=''), max_rows)
+
+async def prepare_subscription_csv(data: bytes) -> tuple[list[BulkRow], list[str]]:
+    return await asyncio.get_running_loop().run_in_executor(None, parse_subscription_csv, data)
+
+async def apply_bulk_subscriptions(db: Database, rows: list[BulkRow]) -> BulkResult:
+    """Находит пользователей одним пакетом и применяет изменения одной транзакцией. Повторы - по последней строке."""
+    found_ids, by_username = await db.resolve_users(
+        [row.target for row in rows if isinstance(row.target, int)],
+        [row.target for row in rows if isinstance(row.target, str)],
+    )
+    result = BulkResult()
+    updates: dict[int, tuple[int, int | None]] = {}
+    for row in rows:
+        if isinstance(row.target, int):
+            user_id = row.target if row.target in found_ids else None
+        else:
+            user_id = by_username.get(row.target.lower())
+        if user_id is None:
+            result.not_found.append(f"строка {row.line}: {row.target}")
+        elif row.level == 0 and user_id in config.ADMIN_IDS:
+            result.skipped.append(f"строка {row.line}: нельзя забрать подписку у администратора")
+        else:
+            updates.pop(user_id, None) # Повтор переносится в конец, чтобы порядок уведомлений совпадал с файлом
+            updates[user_id] = (row.level, row.days)
+
+    result.changes = [(user_id, level, days) for user_id, (level, days) in updates.items()]
+    if result.changes:
+        applied = await db.bulk_update_subscriptions(result.changes)
+        # Снятие подписки у того, кто и так на Free, - не новость для пользователя
+        result.notices = [(user_id, level, end) for user_id, level, end, previous in applied if level or previous]
+    return result
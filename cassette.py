@@ -0,0 +1,123 @@
+# cassette.py
+"""
+Запись и воспроизведение трафика APIService ("кассета").
+
+В режиме record каждая пара запрос/ответ сохраняется в сжатый JSONL-файл: хэш payload,
+эндпоинт, модель, статус, тело ответа и время ответа. Записи копятся в памяти и дописываются
+пачкой (отдельным gzip-member) в пуле потоков; остаток сбрасывает close() при остановке.
+В режиме replay ответы отдаются
+из файла без сети - с исходной задержкой или ускоренно (speed < 1), что позволяет
+детерминированно гонять весь конвейер чата на ответах реальной формы.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+def payload_key(endpoint: str, payload: dict) -> str:
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{endpoint}\n{canonical}".encode()).hexdigest()[:24]
+
+class Cassette:
+    def __init__(self, path: str, mode: str, speed: float = 1.0, match: str = "exact", flush_every: int = 100):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Неизвестный режим кассеты: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed # Множитель исходной задержки: 1 - как было, 0 - без задержки
+        self.match = match # exact - только точный payload; model - иначе любой ответ той же модели
+        self._by_key: dict[str, list[dict]] = {}
+        self._by_model: dict[tuple[str, str], list[dict]] = {}
+        self._cursor: dict[str, int] = {}
+        self.replayed = 0 # Сколько ответов отдано из кассеты
+        self._warned_fallback: set[tuple[str, str]] = set()
+        self.flush_every = flush_every
+        self._buffer: list[str] = []
+        self._write_lock = asyncio.Lock() # Пачки дописываются в файл по очереди
+        if mode == "replay":
+            self._load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.warning("Кассета %s не найдена, воспроизводить нечего", self.path)
+            return
+        count = 0
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._by_key.setdefault(entry["key"], []).append(entry)
+                self._by_model.setdefault((entry["endpoint"], entry["model"]), []).append(entry)
+                count += 1
+        logger.info("Кассета %s: загружено %s записей", self.path, count)
+
+    async def record(self, endpoint: str, payload: dict, status: int, body: str, elapsed: float):
+        entry = {
+            "key": payload_key(endpoint, payload),
+            "endpoint": endpoint,
+            "model": payload.get("model", ""),
+            "status": status,
+            "elapsed": round(elapsed, 4),
+            "body": body,
+        }
+        self._buffer.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        if len(self._buffer) >= self.flush_every:
+            await self.flush()
+
+    def _write(self, lines: list[str]):
+        # Каждая пачка - отдельный gzip-member: файл остается валидным даже при аварийной остановке
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    async def flush(self):
+        """Дописывает накопленные записи в файл, не блокируя цикл событий."""
+        async with self._write_lock:
+            lines, self._buffer = self._buffer, []
+            if lines:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+
+    async def close(self):
+        if self.recording:
+            await self.flush()
+
+    def _find(self, endpoint: str, payload: dict) -> dict | None:
+        key = payload_key(endpoint, payload)
+        entries = self._by_key.get(key)
+        if not entries and self.match == "model":
+            key = f"{endpoint}:{payload.get('model', '')}"
+            entries = self._by_model.get((endpoint, payload.get("model", "")))
+            if not entries: # Модель не записана - берем любой ответ того же эндпоинта
+                key = endpoint
+                entries = [e for (ep, _), items in self._by_model.items() if ep == endpoint for e in items]
+                model = payload.get("model", "")
+                if entries and (endpoint, model) not in self._warned_fallback:
+                    self._warned_fallback.add((endpoint, model))
+                    logger.warning("Кассета: нет записей %s для модели %s, отдаем ответы других моделей", endpoint, model)
+        if not entries:
+            return None
+        # Повторные одинаковые запросы получают записанные ответы по кругу, в исходном порядке
+        index = self._cursor.get(key, 0)
+        self._cursor[key] = index + 1
+        return entries[index % len(entries)]
+
+    async def replay(self, endpoint: str, payload: dict) -> tuple[int, str] | None:
+        entry = self._find(endpoint, payload)
+        if entry is None:
+            return None
+        self.replayed += 1
+        if self.speed > 0:
+            await asyncio.sleep(entry["elapsed"] * self.speed)
+        return entry["status"], entry["body"]
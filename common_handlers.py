@@ -1,12 +1,12 @@
 # handlers/common_handlers.py
-import asyncio
 from aiogram import Router, types, F, Bot
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from datetime import datetime, timezone, timedelta
 
 import keyboards as kb
-# from database import Database # Удалено: Глобальный экземпляр db больше не используется
+from task_supervisor import TaskSupervisor
+from database import Database
 import config
 # from .user_handlers import get_user_level # Удалено: Больше не существует и не используется
 
@@ -30,19 +30,17 @@ async def notify_admins_new_user(bot: Bot, user: types.User):
 
 @common_router.message(Command('start'), StateFilter("*"), F.chat.type == 'private')
 @common_router.callback_query(F.data == 'back_main', StateFilter("*"))
-async def universal_start_handler(event: types.Message | types.CallbackQuery, state: FSMContext, bot: Bot, model_status_cache: dict):
+async def universal_start_handler(event: types.Message | types.CallbackQuery, state: FSMContext, bot: Bot, db: Database, model_status_cache: dict, task_supervisor: TaskSupervisor):
     if await state.get_state() is not None:
         await state.clear()
         message_source = event.message if isinstance(event, types.CallbackQuery) else event
         await message_source.answer("Действие отменено.")
 
     user = event.from_user
-    # Используем bot["db"] для доступа к базе данных
-    db_instance = bot["db"] 
-    is_new_user = await db_instance.add_user(user.id, user.username)
+    is_new_user = await db.add_user(user.id, user.username)
 
     if is_new_user and user.id not in config.ADMIN_IDS:
-        asyncio.create_task(notify_admins_new_user(bot, user))
+        task_supervisor.spawn(notify_admins_new_user(bot, user), name=f"notify_admins_new_user {user.id}")
     
     time_str = datetime.now(timezone(timedelta(hours=3))).strftime("%H:%M МСК")
     welcome_text = 'Привет, я Arima.AI\n\nТекущее время: ' + time_str + '\n\nВыберите действие:'
@@ -60,7 +58,7 @@ async def universal_start_handler(event: types.Message | types.CallbackQuery, st
         await event.answer()
 
 @common_router.callback_query(F.data == 'cancel_action', StateFilter("*"))
-async def cancel_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, model_status_cache: dict):
+async def cancel_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, model_status_cache: dict, task_supervisor: TaskSupervisor):
     current_state = await state.get_state()
     await state.clear()
     await callback.message.edit_text("Действие отменено.")
@@ -69,4 +67,4 @@ async def cancel_handler(callback: types.CallbackQuery, state: FSMContext, bot:
     if current_state and current_state.startswith("AdminActions"):
         await callback.message.answer("Админ-панель:", reply_markup=kb.get_admin_menu())
     else:
-        await universal_start_handler(callback, state, bot, model_status_cache)
+        await universal_start_handler(callback, state, bot, model_status_cache, task_supervisor)
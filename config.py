@@ -22,14 +22,106 @@ API_URL = os.getenv('API_URL')
 
 IMAGE_API_URL = "https://nustjourney.mirandasite.online/v1"
 IMAGE_MODEL = "gpt-image-1"
+IMAGE_SIZE = "1024x1024"
+IMAGE_RESPONSE_FORMAT = os.getenv('IMAGE_RESPONSE_FORMAT', 'b64_json') # b64_json или url (тогда картинка скачивается ботом)
+IMAGE_MAX_BYTES = 10 * 1024 * 1024 # Предел Telegram для send_photo
+IMAGE_DOWNLOAD_TIMEOUT = 60 # Секунд на скачивание картинки, если API вернул url
+IMAGE_CACHE_TTL = 30 * 24 * 3600 # Сколько секунд хранить file_id сгенерированной картинки
+IMAGE_CACHE_MAX_ROWS = 10000 # Сверх этого числа удаляются самые старые записи кэша
+# Одновременных генераций картинок на весь бот. При WORKER_PROCESSES > 1 делится между процессами,
+# но каждый получает хотя бы одного воркера: фактический предел - max(1, IMAGE_WORKERS // WORKER_PROCESSES) * WORKER_PROCESSES
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+IMAGE_MAX_PENDING_PER_USER = 2 # Задач одного пользователя в очереди и в работе
+IMAGE_QUEUE_LIMIT = int(os.getenv('IMAGE_QUEUE_LIMIT', '100'))
+
+# Картинки от пользователя для vision-моделей
+VISION_MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024
+VISION_MAX_SIDE = 1568 # Большая сторона после уменьшения, px
+VISION_JPEG_QUALITY = 85
+VISION_MAX_IMAGE_BYTES = 4 * 1024 * 1024 # Без Pillow картинка больше этого размера не отправляется
+FILE_DOWNLOAD_TIMEOUT = 60
+
+# Текстовые файлы в чате
+DOCUMENT_MAX_BYTES = 5 * 1024 * 1024
+DOCUMENT_CONTEXT_SHARE = 0.5 # Доля контекстного окна модели под текст файла
+DOCUMENT_MAX_TOKENS = int(os.getenv('DOCUMENT_MAX_TOKENS', '32000'))
+DOCUMENT_CHUNK_CHARS = 2000
+DOCUMENT_CHARS_PER_TOKEN = 3 # Грубая оценка для смеси русского и английского текста
+
+# Фоновая проверка моделей (model_prober.py). MODEL_PROBE_INTERVAL = 0 - выключена.
+MODEL_PROBE_INTERVAL = int(os.getenv('MODEL_PROBE_INTERVAL', '600'))
+MODEL_PROBE_CONCURRENCY = 3
+MODEL_PROBE_TIMEOUT = 30
+# Проверка image-модели - платная генерация, поэтому включается явно (MODEL_PROBE_IMAGE=1)
+MODEL_PROBE_IMAGE = os.getenv('MODEL_PROBE_IMAGE', '0') == '1'
+MODEL_PROBE_IMAGE_EVERY = 6 # Image-модель проверяется раз в N циклов
+MODEL_STATUS_SYNC_INTERVAL = 60 # Как часто процессы без проверки читают статусы моделей из БД, сек.
+MODEL_PROBE_FAILS_TO_DISABLE = 2 # Сколько ошибок подряд, чтобы пометить модель недоступной
+MODEL_PROBE_OKS_TO_ENABLE = 2 # Сколько успехов подряд, чтобы вернуть модель
+MODEL_LATENCY_EWMA_ALPHA = 0.3
+MODEL_SLOW_LATENCY = 15 # Начиная с этой задержки (сек.) модель помечается медленной в меню
+
+# Ручной тест моделей из админки
+ADMIN_TEST_CONCURRENCY = int(os.getenv('ADMIN_TEST_CONCURRENCY', '4'))
+ADMIN_TEST_TIMEOUT = int(os.getenv('ADMIN_TEST_TIMEOUT', '45'))
+ADMIN_TEST_EDIT_INTERVAL = 2 # Не чаще раза в N секунд обновляем сообщение с прогрессом
+ADMIN_USERS_PER_PAGE = 10
+
+# Массовая выдача подписок из CSV (bulk_subscriptions.py)
+BULK_SUBSCRIPTION_MAX_BYTES = 1024 * 1024
+BULK_SUBSCRIPTION_MAX_ROWS = 10000
+BULK_REPORT_DETAILS = 10 # Сколько ошибок и ненайденных пользователей показать в отчете
+
+# Темп отправки сообщений (utils.send_long_message): общий лимит в секунду и интервал в одном чате, сек.
+SEND_GLOBAL_PER_SECOND = 25
+SEND_PRIVATE_INTERVAL = 0.35
+SEND_GROUP_INTERVAL = 3.0
 
 GROUP_TRIGGER = ".mini"
 DEFAULT_GROUP_MODEL = "gpt-4.1"
+GROUP_THREAD_MAX_CHATS = 1000 # Чатов в хранилище цепочек ответов (LRU)
+GROUP_THREAD_MESSAGES_PER_CHAT = 200
+GROUP_THREAD_NODE_CHARS = 4000 # Реплика хранится обрезанной до этой длины
+GROUP_THREAD_MAX_MESSAGES = 10 # Реплик в истории, отправляемой модели
+GROUP_THREAD_MAX_CHARS = 12000
+GROUP_MAX_CONCURRENT_PER_CHAT = int(os.getenv('GROUP_MAX_CONCURRENT_PER_CHAT', '2')) # Одновременных генераций в одной группе
+GROUP_MAX_PENDING_PER_USER = 3 # Запросов одного пользователя в очереди группы
+GROUP_DEDUP_WINDOW = 60 # Секунд, в течение которых повтор вопроса получает ссылку на готовый ответ
+GROUP_STATUS_INTERVAL = SEND_GROUP_INTERVAL # Не чаще раза в N секунд обновляем статус очереди в группе
+BOT_IDENTITY_REFRESH = 6 * 3600 # Как часто перезапрашивать getMe, сек.
 
 DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant."
 DEFAULT_TEMPERATURE = 0.7
 
 DATABASE_PATH = os.getenv('DATABASE', 'bot_database.db')
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '30'))
+USER_COUNT_CACHE_TTL = 60 # Сколько секунд держать в кэше число пользователей для админки
+
+# Количество процессов-воркеров. При значении больше 1 бот запускается в режиме супервизора:
+# апдейты получает один процесс и раздает их воркерам по user_id.
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+WORKER_RESTART_DELAY = 5
+
+# Сколько секунд при остановке ждать завершения генераций, рассылок и других фоновых задач
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '25'))
+WORKER_SHUTDOWN_MARGIN = 10 # Секунд сверх SHUTDOWN_DRAIN_TIMEOUT, после которых супервизор принудительно завершает воркера
+
+# Эндпоинт /metrics в формате Prometheus. 0 - выключен.
+# В режиме супервизора воркер с индексом i слушает порт METRICS_PORT + i + 1.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Трассировка: апдейты дольше порога (сек.) пишутся в лог деревом спанов. 0 - выключено.
+SLOW_UPDATE_THRESHOLD = float(os.getenv('SLOW_UPDATE_THRESHOLD', '0'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0')) # Доля трассируемых апдейтов
+
+# Кассета APIService: record - записывать ответы API, replay - воспроизводить без сети, пусто - выключено.
+# API_CASSETTE_SPEED - множитель исходной задержки при воспроизведении (0 - мгновенно).
+# API_CASSETTE_MATCH: exact - только тот же payload, model - иначе любой записанный ответ той же модели.
+API_CASSETTE_MODE = os.getenv('API_CASSETTE_MODE', '')
+API_CASSETTE_PATH = os.getenv('API_CASSETTE_PATH', 'api_cassette.jsonl.gz')
+API_CASSETTE_SPEED = float(os.getenv('API_CASSETTE_SPEED', '1.0'))
+API_CASSETTE_MATCH = os.getenv('API_CASSETTE_MATCH', 'exact')
 
 SUB_LEVEL_MAP = {
     0: 'free',
@@ -87,6 +179,29 @@ SUBSCRIPTION_MODELS = {
     }
 }
 
+# Метаданные моделей для каталога (model_catalog.py). Чего нет - берется из значений по умолчанию.
+DEFAULT_MODEL_CONTEXT_WINDOW = 32000 # В токенах
+DEFAULT_MODEL_TIMEOUT = 120 # Секунд на ответ модели
+MODEL_METADATA = {
+    'gpt-4.5-preview': {'context_window': 128000, 'vision': True},
+    'gpt-4.1': {'context_window': 1000000, 'vision': True},
+    'o1-pro': {'context_window': 200000, 'timeout': 300, 'vision': True},
+    'o4-mini': {'context_window': 200000, 'vision': True},
+    'chatgpt-4o-latest': {'context_window': 128000, 'vision': True},
+    'deepseek-chat-v3-0324': {'context_window': 64000},
+    'deepseek-r1-0528': {'context_window': 64000, 'timeout': 240},
+    'qwen3-235b-a22b': {'context_window': 32000},
+    'gemini-2.5-pro-exp-03-25': {'context_window': 1000000, 'timeout': 180, 'vision': True},
+    'phi-4-reasoning-plus': {'context_window': 32000, 'timeout': 180},
+    'grok-3': {'context_window': 131072},
+    'grok-3-mini': {'context_window': 131072},
+    'claude-3.7-sonnet': {'context_window': 200000, 'vision': True},
+}
+
+# Файл каталога моделей (JSON или YAML). Если пусто - каталог строится из настроек выше.
+# Перечитывается без перезапуска по SIGHUP или команде /reload_models.
+MODEL_CATALOG_PATH = os.getenv('MODEL_CATALOG_PATH', '')
+
 LIMITS = {
     0: 3,
     1: 40,
@@ -1,27 +1,57 @@
+import time
+from datetime import date, datetime, timedelta
+
 import aiosqlite
-from datetime import datetime, timedelta
 
+from metrics import DB_QUERY_SECONDS, instrument_methods
+from tracing import trace_methods
+
+@trace_methods("db")
+@instrument_methods(DB_QUERY_SECONDS)
 class Database:
-    def __init__(self, db_path):
+    _IMAGE_CACHE_CLEANUP_EVERY = 100 # Чистка кэша картинок - раз на столько сохранений
+
+    def __init__(self, db_path, busy_timeout: float = 30.0, count_cache_ttl: float = 60.0,
+                 image_cache_ttl: float = 30 * 24 * 3600, image_cache_max_rows: int = 10000):
         self.db_path = db_path
+        # Сколько секунд ждать снятия блокировки, если в файл пишет другой процесс-воркер
+        self.busy_timeout = busy_timeout
+        # Кэш COUNT(*) по пользователям: фильтры -> (до какого момента актуален, число).
+        # В своем процессе сбрасывается при изменениях, TTL покрывает записи других воркеров
+        self.count_cache_ttl = count_cache_ttl
+        self._user_counts: dict[tuple, tuple[float, int]] = {}
+        # Есть ли в файле FTS5-индекс по username. Воркеры не вызывают init_db, поэтому проверяется лениво
+        self._username_fts: bool | None = None
+        # file_id сгенерированных картинок: сколько секунд считаются действительными и сколько строк держать
+        self.image_cache_ttl = image_cache_ttl
+        self.image_cache_max_rows = image_cache_max_rows
+        self._image_cache_saves = 0
+
+    def _connect(self):
+        return aiosqlite.connect(self.db_path, timeout=self.busy_timeout)
 
     async def _execute(self, query, params=None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute(query, params or ())
             await db.commit()
             return cursor
 
     async def _fetchone(self, query, params=None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(query, params or ()) as cursor:
                 return await cursor.fetchone()
 
     async def _fetchall(self, query, params=None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(query, params or ()) as cursor:
                 return await cursor.fetchall()
 
+    def _invalidate_user_counts(self):
+        self._user_counts.clear()
+
     async def init_db(self):
+        # WAL позволяет нескольким процессам читать параллельно с записью; режим сохраняется в файле БД
+        await self._fetchone('PRAGMA journal_mode=WAL')
         await self._execute('''
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -60,8 +90,28 @@ class Database:
                 FOREIGN KEY (broadcast_id) REFERENCES broadcasts (broadcast_id)
             )
         ''')
-        
-        async with aiosqlite.connect(self.db_path) as db:
+        await self._execute('''
+            CREATE TABLE IF NOT EXISTS model_tests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model TEXT,
+                status TEXT,
+                latency_ms INTEGER,
+                tested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await self._execute('CREATE INDEX IF NOT EXISTS idx_model_tests_model ON model_tests (model, tested_at)')
+        # Текущие статусы моделей от фоновой проверки: ее ведет один процесс, остальные читают отсюда
+        await self._execute('''
+            CREATE TABLE IF NOT EXISTS model_status (
+                model TEXT PRIMARY KEY,
+                available INTEGER NOT NULL,
+                status TEXT,
+                latency REAL,
+                updated_at TIMESTAMP
+            )
+        ''')
+        # Старые базы: недостающие колонки users добавляются до индексов, которые на них ссылаются
+        async with self._connect() as db:
             cursor = await db.execute('PRAGMA table_info(users)')
             columns = [row[1] for row in await cursor.fetchall()]
             if 'last_selected_model' not in columns:
@@ -71,8 +121,70 @@ class Database:
             if 'temperature' not in columns:
                 await db.execute('ALTER TABLE users ADD COLUMN temperature REAL')
             if 'created_at' not in columns:
-                await db.execute('ALTER TABLE users ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+                # SQLite не добавляет колонку с DEFAULT CURRENT_TIMESTAMP в непустую таблицу - заполняем отдельно
+                await db.execute('ALTER TABLE users ADD COLUMN created_at TIMESTAMP')
+                await db.execute('UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL')
+            await db.commit()
+        # Постраничный список пользователей (по курсору) и его фильтры
+        await self._execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, user_id)')
+        await self._execute('CREATE INDEX IF NOT EXISTS idx_users_level_created ON users (subscription_level, created_at, user_id)')
+        await self._execute('CREATE INDEX IF NOT EXISTS idx_requests_user_date ON requests (user_id, request_date)')
+        # Поиск пользователей: точный и префиксный - по индексу без учета регистра, подстрока - через FTS5
+        await self._execute('CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)')
+        self._username_fts = await self._init_username_fts()
+        await self._execute('''
+            CREATE TABLE IF NOT EXISTS image_cache (
+                model TEXT,
+                prompt_hash TEXT,
+                size TEXT,
+                file_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (model, prompt_hash, size)
+            )
+        ''')
+        await self._execute('CREATE INDEX IF NOT EXISTS idx_image_cache_created ON image_cache (created_at)')
+        await self.cleanup_image_cache()
+
+    async def _init_username_fts(self) -> bool:
+        """
+        FTS5-таблица с trigram-токенизатором поверх users.username, синхронизируется триггерами.
+        Если SQLite собран без FTS5 или старше 3.34 (нет trigram), поиск работает через LIKE.
+        """
+        async with self._connect() as db:
+            async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'") as cursor:
+                existed = await cursor.fetchone() is not None
+            try:
+                await db.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts "
+                    "USING fts5(username, content='users', content_rowid='user_id', tokenize='trigram')"
+                )
+            except aiosqlite.OperationalError:
+                return False
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users WHEN new.username IS NOT NULL BEGIN
+                    INSERT INTO users_fts (rowid, username) VALUES (new.user_id, new.username);
+                END
+            ''')
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users WHEN old.username IS NOT NULL BEGIN
+                    INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.user_id, old.username);
+                END
+            ''')
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users BEGIN
+                    INSERT INTO users_fts (users_fts, rowid, username) SELECT 'delete', old.user_id, old.username WHERE old.username IS NOT NULL;
+                    INSERT INTO users_fts (rowid, username) SELECT new.user_id, new.username WHERE new.username IS NOT NULL;
+                END
+            ''')
+            if not existed: # Индекс по уже существующим пользователям
+                await db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
             await db.commit()
+        return True
+
+    async def _has_username_fts(self) -> bool:
+        if self._username_fts is None:
+            self._username_fts = await self._fetchone("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'") is not None
+        return self._username_fts
 
     async def add_user(self, user_id: int, username: str) -> bool:
         user = await self._fetchone('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
@@ -84,6 +196,7 @@ class Database:
                 'INSERT INTO users (user_id, username, created_at) VALUES (?, ?, ?)',
                 (user_id, username, datetime.now())
             )
+            self._invalidate_user_counts()
             return True
 
     async def get_registration_counts(self) -> dict:
@@ -121,7 +234,7 @@ class Database:
             await self._execute('UPDATE users SET temperature = ? WHERE user_id = ?', (temp, user_id))
 
     async def add_broadcast(self, message_text: str) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute('INSERT INTO broadcasts (message_text) VALUES (?)', (message_text,))
             await db.commit()
             return cursor.lastrowid
@@ -142,10 +255,123 @@ class Database:
         await self._execute('DELETE FROM sent_broadcast_messages WHERE broadcast_id = ?', (broadcast_id,))
         await self._execute('DELETE FROM broadcasts WHERE broadcast_id = ?', (broadcast_id,))
 
-    async def get_all_users_paginated(self, page: int, page_size: int = 1):
-        offset = (page - 1) * page_size
-        query = f"SELECT * FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?"
-        return await self._fetchall(query, (page_size, offset))
+    async def add_model_test_results(self, results: list[dict]):
+        if not results:
+            return
+        tested_at = datetime.now()
+        async with self._connect() as db:
+            await db.executemany(
+                'INSERT INTO model_tests (model, status, latency_ms, tested_at) VALUES (?, ?, ?, ?)',
+                [(r['model'], r['status'], int(r['latency'] * 1000), tested_at) for r in results]
+            )
+            await db.commit()
+
+    async def save_model_statuses(self, statuses: list[tuple[str, bool, str | None, float | None]]):
+        """(модель, доступна, последний статус, EWMA задержки) - перезаписывает текущие статусы."""
+        updated_at = datetime.now()
+        async with self._connect() as db:
+            await db.executemany(
+                'INSERT INTO model_status (model, available, status, latency, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (model) DO UPDATE SET available = excluded.available, status = excluded.status, '
+                'latency = excluded.latency, updated_at = excluded.updated_at',
+                [(model, 1 if available else 0, status, latency, updated_at) for model, available, status, latency in statuses]
+            )
+            await db.commit()
+
+    async def get_model_statuses(self):
+        return await self._fetchall('SELECT model, available, status, latency FROM model_status')
+
+    async def get_model_test_history(self, model: str, limit: int = 20):
+        return await self._fetchall(
+            'SELECT status, latency_ms, tested_at FROM model_tests WHERE model = ? ORDER BY tested_at DESC LIMIT ?',
+            (model, limit)
+        )
+
+    async def get_cached_image(self, model: str, prompt_hash: str, size: str) -> str | None:
+        row = await self._fetchone(
+            'SELECT file_id FROM image_cache WHERE model = ? AND prompt_hash = ? AND size = ? AND created_at >= ?',
+            (model, prompt_hash, size, datetime.now() - timedelta(seconds=self.image_cache_ttl))
+        )
+        return row[0] if row else None
+
+    async def save_cached_image(self, model: str, prompt_hash: str, size: str, file_id: str):
+        await self._execute(
+            'INSERT OR REPLACE INTO image_cache (model, prompt_hash, size, file_id, created_at) VALUES (?, ?, ?, ?, ?)',
+            (model, prompt_hash, size, file_id, datetime.now())
+        )
+        self._image_cache_saves += 1
+        if self._image_cache_saves % self._IMAGE_CACHE_CLEANUP_EVERY == 0:
+            await self.cleanup_image_cache()
+
+    async def cleanup_image_cache(self) -> int:
+        """Удаляет записи старше image_cache_ttl и самые старые сверх image_cache_max_rows. Возвращает число удаленных."""
+        async with self._connect() as db:
+            cursor = await db.execute('DELETE FROM image_cache WHERE created_at < ?',
+                                      (datetime.now() - timedelta(seconds=self.image_cache_ttl),))
+            removed = cursor.rowcount
+            cursor = await db.execute(
+                'DELETE FROM image_cache WHERE rowid IN (SELECT rowid FROM image_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.image_cache_max_rows,)
+            )
+            removed += cursor.rowcount
+            await db.commit()
+        return removed
+
+    async def delete_cached_image(self, model: str, prompt_hash: str, size: str):
+        await self._execute(
+            'DELETE FROM image_cache WHERE model = ? AND prompt_hash = ? AND size = ?',
+            (model, prompt_hash, size)
+        )
+
+    @staticmethod
+    def _users_filter(level: int | None, blocked: bool | None, active_since: date | None) -> tuple[list[str], list]:
+        conditions, params = [], []
+        if level is not None:
+            conditions.append('subscription_level = ?')
+            params.append(level)
+        if blocked is not None:
+            conditions.append('is_blocked = ?')
+            params.append(1 if blocked else 0)
+        if active_since is not None:
+            conditions.append('EXISTS (SELECT 1 FROM requests r WHERE r.user_id = users.user_id AND r.request_date >= ?)')
+            params.append(active_since)
+        return conditions, params
+
+    async def get_users_page(self, limit: int, cursor: tuple[str, int] | None = None, backward: bool = False,
+                             level: int | None = None, blocked: bool | None = None, active_since: date | None = None) -> tuple[list, bool]:
+        """
+        Страница пользователей от новых к старым по курсору (created_at, user_id) вместо OFFSET:
+        время не зависит от глубины страницы. cursor - граничная строка предыдущей страницы,
+        backward - листать к более новым. Возвращает строки
+        (user_id, username, subscription_level, subscription_end, is_blocked, created_at)
+        и признак, что в этом направлении есть еще.
+        """
+        conditions, params = self._users_filter(level, blocked, active_since)
+        if cursor is not None:
+            conditions.append('(created_at, user_id) > (?, ?)' if backward else '(created_at, user_id) < (?, ?)')
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = 'ASC' if backward else 'DESC'
+        query = (f'SELECT user_id, username, subscription_level, subscription_end, is_blocked, created_at FROM users {where} '
+                 f'ORDER BY created_at {order}, user_id {order} LIMIT ?')
+        rows = await self._fetchall(query, (*params, limit + 1))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+
+    async def count_users(self, level: int | None = None, blocked: bool | None = None, active_since: date | None = None) -> int:
+        key = (level, blocked, active_since)
+        cached = self._user_counts.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        conditions, params = self._users_filter(level, blocked, active_since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        result = await self._fetchone(f'SELECT COUNT(*) FROM users {where}', params)
+        count = result[0] if result else 0
+        self._user_counts[key] = (time.monotonic() + self.count_cache_ttl, count)
+        return count
 
     async def update_last_selected_model(self, user_id: int, model_name: str):
         await self._execute('UPDATE users SET last_selected_model = ? WHERE user_id = ?', (model_name, user_id))
@@ -155,20 +381,100 @@ class Database:
         return result[0] if result and result[0] else None
 
     async def get_user_id_by_username(self, username):
-        return await self._fetchone('SELECT user_id FROM users WHERE username = ?', (username,))
+        # username в Telegram не зависит от регистра
+        return await self._fetchone('SELECT user_id FROM users WHERE username = ? COLLATE NOCASE', (username,))
+
+    async def search_users(self, query: str, limit: int, offset: int = 0, max_matches: int = 500) -> tuple[list, bool]:
+        """
+        Поиск по username без учета регистра. Запрос короче 3 символов ищет только по префиксу
+        в алфавитном порядке по индексу. Более длинный - по подстроке (через FTS5, без него -
+        полным просмотром): сначала точное совпадение, затем начинающиеся с query, затем
+        остальные, внутри группы - более короткие. Ранжируется не больше max_matches
+        кандидатов каждого вида, чтобы слишком общий запрос не сортировал всю таблицу.
+        Возвращает строки как get_users_page и признак, что есть еще.
+        """
+        query = query.lstrip('@')
+        prefix = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        columns = 'user_id, username, subscription_level, subscription_end, is_blocked, created_at'
+        if len(query) < 3: # Совпадений может быть очень много - сортировка по индексу, без ранжирования
+            sql = f"SELECT {columns} FROM users WHERE username LIKE ? ESCAPE '\\' ORDER BY username COLLATE NOCASE LIMIT ? OFFSET ?"
+            params = (prefix,)
+        else:
+            if await self._has_username_fts():
+                substring, match = 'SELECT rowid FROM users_fts WHERE users_fts MATCH ?', '"' + query.replace('"', '""') + '"'
+            else:
+                substring, match = "SELECT user_id FROM users WHERE username LIKE ? ESCAPE '\\'", '%' + prefix
+            # Начинающиеся с query берутся по индексу отдельно, чтобы не потеряться за лимитом подстрок
+            candidates = (f"SELECT user_id FROM (SELECT user_id FROM users WHERE username LIKE ? ESCAPE '\\' "
+                          f"ORDER BY username COLLATE NOCASE LIMIT ?) UNION SELECT * FROM ({substring} LIMIT ?)")
+            rank = "CASE WHEN username = ? COLLATE NOCASE THEN 0 WHEN username LIKE ? ESCAPE '\\' THEN 1 ELSE 2 END"
+            sql = f'SELECT {columns} FROM users WHERE user_id IN ({candidates}) ORDER BY {rank}, length(username), user_id LIMIT ? OFFSET ?'
+            params = (prefix, max_matches, match, max_matches, query, prefix)
+        rows = await self._fetchall(sql, (*params, limit + 1, offset))
+        return rows[:limit], len(rows) > limit
 
     async def get_user_info(self, user_id):
         return await self._fetchone('SELECT * FROM users WHERE user_id = ?', (user_id,))
 
-    async def update_subscription(self, user_id, level):
-        end_date = datetime.now() + timedelta(days=30) if level > 0 else None
+    @staticmethod
+    def _subscription_end(level: int, days: int | None) -> datetime | None:
+        return datetime.now() + timedelta(days=days) if level > 0 and days else None
+
+    async def update_subscription(self, user_id, level, days: int | None = 30):
+        """days=None - подписка без срока окончания."""
         await self._execute(
             'UPDATE users SET subscription_level = ?, subscription_end = ? WHERE user_id = ?',
-            (level, end_date, user_id)
+            (level, self._subscription_end(level, days), user_id)
         )
+        self._invalidate_user_counts()
+
+    async def resolve_users(self, user_ids: list[int], usernames: list[str], batch_size: int = 500) -> tuple[set[int], dict[str, int]]:
+        """
+        Какие из user_ids есть в базе и id пользователей по usernames (ключи в нижнем регистре).
+        Запросы пакетами по batch_size параметров в одном соединении вместо запроса на каждого.
+        """
+        user_ids = list(set(user_ids))
+        usernames = list({name.lower() for name in usernames})
+        found_ids: set[int] = set()
+        by_username: dict[str, int] = {}
+        async with self._connect() as db:
+            for i in range(0, len(user_ids), batch_size):
+                batch = user_ids[i:i + batch_size]
+                async with db.execute(f'SELECT user_id FROM users WHERE user_id IN ({",".join("?" * len(batch))})', batch) as cursor:
+                    found_ids.update(row[0] for row in await cursor.fetchall())
+            for i in range(0, len(usernames), batch_size):
+                batch = usernames[i:i + batch_size]
+                query = f'SELECT user_id, username FROM users WHERE username COLLATE NOCASE IN ({",".join("?" * len(batch))})'
+                async with db.execute(query, batch) as cursor:
+                    by_username.update((username.lower(), user_id) for user_id, username in await cursor.fetchall())
+        return found_ids, by_username
+
+    async def bulk_update_subscriptions(self, updates: list[tuple[int, int, int | None]],
+                                        batch_size: int = 500) -> list[tuple[int, int, datetime | None, int]]:
+        """
+        Применяет (user_id, уровень, дней) одной транзакцией. Срок считается как в update_subscription.
+        Возвращает (user_id, уровень, записанный срок, уровень до изменения); истекшая подписка считается Free.
+        """
+        params = [(level, self._subscription_end(level, days), user_id) for user_id, level, days in updates]
+        user_ids = [user_id for user_id, _, _ in updates]
+        previous: dict[int, int] = {}
+        now = datetime.now()
+        async with self._connect() as db:
+            for i in range(0, len(user_ids), batch_size):
+                batch = user_ids[i:i + batch_size]
+                query = f'SELECT user_id, subscription_level, subscription_end FROM users WHERE user_id IN ({",".join("?" * len(batch))})'
+                async with db.execute(query, batch) as cursor:
+                    for user_id, level, end_str in await cursor.fetchall():
+                        expired = level > 0 and end_str and datetime.fromisoformat(end_str) < now
+                        previous[user_id] = 0 if expired else level
+            await db.executemany('UPDATE users SET subscription_level = ?, subscription_end = ? WHERE user_id = ?', params)
+            await db.commit()
+        self._invalidate_user_counts()
+        return [(user_id, level, end, previous.get(user_id, 0)) for level, end, user_id in params]
 
     async def block_user(self, user_id, block=True):
         await self._execute('UPDATE users SET is_blocked = ? WHERE user_id = ?', (1 if block else 0, user_id))
+        self._invalidate_user_counts()
 
     async def is_user_blocked(self, user_id):
         result = await self._fetchone('SELECT is_blocked FROM users WHERE user_id = ?', (user_id,))
@@ -206,6 +512,8 @@ class Database:
     async def cleanup_expired_subscriptions(self) -> int:
         """Деактивирует истекшие подписки и возвращает количество затронутых пользователей."""
         cursor = await self._execute("UPDATE users SET subscription_level = 0, subscription_end = NULL WHERE subscription_end < ?", (datetime.now(),))
+        if cursor.rowcount:
+            self._invalidate_user_counts()
         return cursor.rowcount
 
     async def get_subscription_end(self, user_id):
@@ -214,8 +522,7 @@ class Database:
         return None
 
     async def get_user_count(self):
-        result = await self._fetchone('SELECT COUNT(*) FROM users')
-        return result[0] if result else 0
+        return await self.count_users()
 
     async def get_subscription_stats(self):
         query = 'SELECT subscription_level, COUNT(*) FROM users GROUP BY subscription_level'
@@ -234,4 +541,5 @@ class Database:
         query = f'UPDATE users SET subscription_level = 0, subscription_end = NULL WHERE user_id NOT IN ({placeholders})'
         
         cursor = await self._execute(query, tuple(admin_ids))
+        self._invalidate_user_counts()
         return cursor.rowcount
\ No newline at end of file
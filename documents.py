@@ -0,0 +1,159 @@
+# documents.py
+"""
+Текстовые файлы в режиме чата (txt, md, csv, json, код).
+
+Файл скачивается кусками с ограничением размера (media.iter_file_chunks) и декодируется
+по мере загрузки, бинарный файл отсекается по первым килобайтам, не дожидаясь конца скачивания.
+Нарезка и отбор фрагментов идут в пуле потоков. Если текст помещается в бюджет токенов
+модели, он передается целиком, иначе - самые релевантные вопросу фрагменты в исходном порядке.
+Текст файла уходит только в текущий запрос к модели, в историю диалога попадает лишь вопрос.
+"""
+import asyncio
+import codecs
+import math
+import os
+import re
+from collections import Counter
+from contextlib import aclosing
+
+from aiogram import Bot
+from aiogram.types import Document
+
+import config
+from media import iter_file_chunks
+
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.markdown', '.rst', '.csv', '.tsv', '.json', '.jsonl', '.yaml', '.yml', '.toml', '.ini', '.cfg',
+    '.xml', '.html', '.htm', '.log', '.sql', '.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.kt', '.go', '.rs', '.c',
+    '.h', '.cpp', '.hpp', '.cs', '.php', '.rb', '.swift', '.sh', '.ps1', '.css', '.scss', '.vue',
+}
+TEXT_MIME_TYPES = {'application/json', 'application/xml', 'application/x-yaml', 'application/sql', 'application/x-sh'}
+
+_WORD_RE = re.compile(r'\w{3,}')
+_BINARY_PROBE_BYTES = 8192
+
+class DocumentNotText(ValueError):
+    pass
+
+def is_text_document(document: Document) -> bool:
+    mime = document.mime_type or ''
+    if mime.startswith('text/') or mime in TEXT_MIME_TYPES:
+        return True
+    return os.path.splitext(document.file_name or '')[1].lower() in TEXT_EXTENSIONS
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / config.DOCUMENT_CHARS_PER_TOKEN)
+
+def decode_text(data: bytes) -> str:
+    if b'\x00' in data[:_BINARY_PROBE_BYTES]:
+        raise DocumentNotText("binary file")
+    for encoding in ('utf-8-sig', 'cp1251'): # Русские файлы из Windows часто в cp1251
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+class IncrementalTextDecoder:
+    """Декодирует файл кусками по мере скачивания как UTF-8; при первой ошибке весь файл в конце перечитывается через decode_text."""
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._raw = bytearray() # Нужны для запасного cp1251
+        self._parts: list[str] = []
+        self._utf8 = True
+
+    def feed(self, chunk: bytes):
+        probe = _BINARY_PROBE_BYTES - len(self._raw)
+        if probe > 0 and b'\x00' in chunk[:probe]:
+            raise DocumentNotText("binary file")
+        self._raw.extend(chunk)
+        if self._utf8:
+            try:
+                self._parts.append(self._decoder.decode(chunk))
+            except UnicodeDecodeError:
+                self._utf8, self._parts = False, []
+
+    def finish(self) -> str:
+        if self._utf8:
+            try:
+                self._parts.append(self._decoder.decode(b'', final=True))
+                return ''.join(self._parts)
+            except UnicodeDecodeError:
+                pass
+        return decode_text(bytes(self._raw))
+
+def split_chunks(text: str, size: int) -> list[str]:
+    """Режет текст на куски около size символов по границам строк (длинные строки - по size)."""
+    chunks: list[str] = []
+    current: list[str] = []
+    length = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > size:
+            if current:
+                chunks.append(''.join(current))
+                current, length = [], 0
+            chunks.append(line[:size])
+            line = line[size:]
+        if length + len(line) > size and current:
+            chunks.append(''.join(current))
+            current, length = [], 0
+        current.append(line)
+        length += len(line)
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+def select_chunks(chunks: list[str], question: str, budget_tokens: int) -> list[int]:
+    """Индексы фрагментов, которые влезают в бюджет: по убыванию TF-IDF-сходства с вопросом, без вопроса - с начала."""
+    terms = set(_WORD_RE.findall(question.lower()))
+    if terms:
+        chunk_terms = [Counter(_WORD_RE.findall(chunk.lower())) for chunk in chunks]
+        document_frequency = Counter(term for counts in chunk_terms for term in terms if term in counts)
+        idf = {term: math.log((len(chunks) + 1) / (document_frequency[term] + 0.5)) for term in terms}
+        scores = [sum(idf[term] * (1 + math.log(counts[term])) for term in terms if counts[term]) for counts in chunk_terms]
+        # При равном счете (в том числе нулевом) выигрывает более ранний фрагмент
+        order = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+    else:
+        order = list(range(len(chunks)))
+
+    selected, used = [], 0
+    for index in order:
+        cost = estimate_tokens(chunks[index])
+        if used + cost > budget_tokens:
+            continue
+        selected.append(index)
+        used += cost
+    return sorted(selected)
+
+def extract_document_context(text: str, question: str, budget_tokens: int) -> tuple[str, bool]:
+    """Текст для контекста модели и флаг, был ли он сокращен. Выполняется в пуле потоков."""
+    text = text.replace('\r\n', '\n')
+    if estimate_tokens(text) <= budget_tokens:
+        return text, False
+    chunks = split_chunks(text, config.DOCUMENT_CHUNK_CHARS)
+    selected = select_chunks(chunks, question, budget_tokens)
+    parts, previous = [], -1
+    for index in selected:
+        if index != previous + 1:
+            parts.append('[...]\n')
+        parts.append(chunks[index])
+        previous = index
+    if previous != len(chunks) - 1:
+        parts.append('\n[...]')
+    return ''.join(parts), True
+
+def document_budget(context_window: int) -> int:
+    """Сколько токенов отдать под файл: часть окна модели, но не больше DOCUMENT_MAX_TOKENS."""
+    return min(int(context_window * config.DOCUMENT_CONTEXT_SHARE), config.DOCUMENT_MAX_TOKENS)
+
+async def download_document_text(bot: Bot, file_id: str, max_bytes: int) -> str:
+    decoder = IncrementalTextDecoder()
+    # aclosing: бинарный файл прерывает скачивание сразу, не оставляя соединение открытым
+    async with aclosing(iter_file_chunks(bot, file_id, max_bytes)) as chunks:
+        async for chunk in chunks:
+            decoder.feed(chunk)
+    # Запасное декодирование всего файла и склейка кусков - в пуле потоков
+    return await asyncio.get_running_loop().run_in_executor(None, decoder.finish)
+
+async def prepare_document(text: str, question: str, budget_tokens: int) -> tuple[str, bool]:
+    return await asyncio.get_running_loop().run_in_executor(None, extract_document_context, text, question, budget_tokens)
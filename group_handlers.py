@@ -2,10 +2,15 @@
 # import aiohttp # Removed
 from aiogram import Router, types, F, Bot
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 import config
-# from database import Database # db accessed via bot["db"]
+import keyboards as kb
+from api_service import APIService
+from bot_identity import BotIdentity
+from database import Database
+from group_queue import GroupRequestQueue, dedup_key
+from group_threads import GroupThreadStore
+from markdown_render import render_markdown
 from utils import send_long_message # Changed from api_helpers to utils
 # from api_helpers import execute_chat_request # Removed, using APIService
 
@@ -13,36 +18,51 @@ group_router = Router()
 
 group_router.message.filter(F.chat.type.in_({'group', 'supergroup'}))
 
+# Ответы без параметров собираются один раз при импорте
+SUBSCRIPTION_REQUIRED_TEXT = (
+    "Взаимодействие с ботом в группах доступно только для пользователей с подпиской. "
+    "Пожалуйста, оформите подписку в личном чате с ботом."
+)
+REDIRECT_TEXT = (
+    "Для использования меню и персональных команд, пожалуйста, "
+    "перейдите в личный чат со мной. В группах я отвечаю только на запросы "
+    f"через триггер <code>{config.GROUP_TRIGGER}</code>."
+)
+HELP_TEXT = (
+    f"Я отвечаю на запросы по триггеру <code>{config.GROUP_TRIGGER}</code>.\n\n"
+    "Для просмотра всех команд, смены модели или настроек, "
+    "пожалуйста, напишите мне в личном чате."
+)
+
 @group_router.message(Command('start', 'new'))
-async def group_start_redirect(message: types.Message, bot: Bot, user_level: int): # user_level from middleware
+async def group_start_redirect(message: types.Message, bot: Bot, user_level: int, bot_identity: BotIdentity): # user_level from middleware
     if user_level == 0:
-        await message.reply(
-            "Взаимодействие с ботом в группах доступно только для пользователей с подпиской. "
-            "Пожалуйста, оформите подписку в личном чате с ботом."
-        )
+        await message.reply(SUBSCRIPTION_REQUIRED_TEXT)
         return
 
-    bot_info = await bot.get_me()
-    bot_username = bot_info.username
-    url = f"https://t.me/{bot_username}?start=group_interaction" # Added a payload for context if needed
-
-    text = (
-        "Для использования меню и персональных команд, пожалуйста, "
-        "перейдите в личный чат со мной. В группах я отвечаю только на запросы "
-        f"через триггер `{config.GROUP_TRIGGER}`."
-    )
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🚀 Перейти в личный чат", url=url)]
-    ])
-
-    await message.reply(text, reply_markup=keyboard)
-
+    await bot_identity.get(bot) # Без запроса к Bot API, если данные получены при старте
+    url = bot_identity.deep_link("group_interaction") # Added a payload for context if needed
+    await message.reply(REDIRECT_TEXT, reply_markup=kb.get_group_redirect_keyboard(url))
+
+
+def reply_thread(message: types.Message, bot: Bot, group_threads: GroupThreadStore) -> tuple[list[dict], int | None]:
+    """История цепочки, если триггер - ответ на сообщение бота, и id родителя для новой реплики."""
+    parent = message.reply_to_message
+    if not parent or not parent.from_user or parent.from_user.id != bot.id:
+        return [], None
+    if (message.chat.id, parent.message_id) in group_threads:
+        return group_threads.thread(message.chat.id, parent.message_id), parent.message_id
+    # Цепочка вытеснена или начата до перезапуска - берем хотя бы текст ответа, на который ответили
+    text = parent.text or parent.caption
+    if not text:
+        return [], None
+    group_threads.add(message.chat.id, [parent.message_id], 'assistant', text)
+    return group_threads.thread(message.chat.id, parent.message_id), parent.message_id
 
 @group_router.message(F.text.startswith(config.GROUP_TRIGGER))
-async def handle_group_trigger(message: types.Message, bot: Bot, user_level: int): # user_level from middleware
-    db = bot["db"] # Get db from bot context
-    api_service = bot["api_service"] # Get APIService from bot context
+async def handle_group_trigger(message: types.Message, bot: Bot, user_level: int, # user_level from middleware
+                               db: Database, api_service: APIService, group_threads: GroupThreadStore,
+                               group_queue: GroupRequestQueue):
 
     if user_level == 0:
         await message.reply(
@@ -71,40 +91,44 @@ async def handle_group_trigger(message: types.Message, bot: Bot, user_level: int
 
     notification = ""
     if not last_selected_model: # Check if a model was explicitly selected by user before
-        notification = f"Вы еще не выбирали модель в личном чате. Использую модель по умолчанию: `{model_name}`\n\n"
+        notification = f"Вы еще не выбирали модель в личном чате. Использую модель по умолчанию: <code>{model_name}</code>\n\n"
 
-    msg = await message.reply("🧠 Думаю...")
+    # Payload for APIService: при ответе на сообщение бота добавляем предыдущие реплики цепочки
+    history, parent_id = reply_thread(message, bot, group_threads)
+    messages_payload = history + [{'role': 'user', 'content': prompt}]
 
-    # Payload for APIService
-    messages_payload = [{'role': 'user', 'content': prompt}]
+    key = dedup_key(model_name, prompt, parent_id)
 
-    # Call APIService's chat_completion method
-    answer_text, api_error = await api_service.chat_completion(
-        model=model_name,
-        messages=messages_payload,
-        temperature=config.DEFAULT_TEMPERATURE
-        # max_tokens can be added if needed by APIService
-    )
+    async def generate() -> int | None:
+        # Call APIService's chat_completion method
+        answer_text, api_error = await api_service.chat_completion(
+            model=model_name,
+            messages=messages_payload,
+            temperature=config.DEFAULT_TEMPERATURE
+            # max_tokens can be added if needed by APIService
+        )
 
-    await msg.delete()
+        if answer_text:
+            if user_id not in config.ADMIN_IDS: # Use db from bot context
+                await db.add_request(user_id, model_name)
 
-    if answer_text:
-        if user_id not in config.ADMIN_IDS: # Use db from bot context
-            await db.add_request(user_id, model_name)
+            final_text = f"{notification}<b>Модель: {model_name}</b>\n\n{render_markdown(answer_text)}"
+            # Use send_long_message from utils
+            sent = await send_long_message(bot, message.chat.id, final_text, parse_mode="HTML", reply_to_message_id=message.message_id)
+            group_threads.add(message.chat.id, [message.message_id], 'user', prompt, parent_id)
+            group_threads.add(message.chat.id, [part.message_id for part in sent], 'assistant', answer_text, message.message_id)
+            return sent[0].message_id
+        else:
+            error_text = f"❌ Ошибка для админа: {api_error}" if user_id in config.ADMIN_IDS else "❌ Произошла непредвиденная ошибка. Попробуйте позже."
+            await message.reply(error_text)
+            return None
 
-        final_text = f"{notification}<b>Модель: {model_name}</b>\n\n{answer_text}"
-        # Use send_long_message from utils
-        await send_long_message(bot, message.chat.id, final_text, reply_to_message_id=message.message_id)
-    else:
-        error_text = f"❌ Ошибка для админа: {api_error}" if user_id in config.ADMIN_IDS else "❌ Произошла непредвиденная ошибка. Попробуйте позже."
-        await message.reply(error_text)
+    # Генерации в чате ограничены и чередуются между пользователями, статус общий на чат.
+    # Повтор недавнего или выполняющегося вопроса получит ссылку на ответ от очереди
+    if group_queue.submit(bot, message.chat.id, user_id, message.message_id, key, generate) == 'limit':
+        await message.reply("⏳ Ваши предыдущие вопросы еще в очереди. Дождитесь ответа на них.")
 
 
 @group_router.message(Command('help'))
 async def group_help(message: types.Message):
-    text = (
-        f"Я отвечаю на запросы по триггеру `{config.GROUP_TRIGGER}`.\n\n"
-        "Для просмотра всех команд, смены модели или настроек, "
-        "пожалуйста, напишите мне в личном чате."
-    )
-    await message.reply(text)
+    await message.reply(HELP_TEXT)
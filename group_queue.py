@@ -0,0 +1,235 @@
+# group_queue.py
+"""
+Очередь запросов по триггеру в группах. В каждом чате одновременно выполняется не больше
+GROUP_MAX_CONCURRENT_PER_CHAT генераций, следующая задача берется по кругу между
+пользователями, чтобы один активный участник не занимал очередь.
+
+Одинаковые вопросы (та же модель, тот же текст, та же цепочка) объединяются: пока первый
+ждет или выполняется, повторы к нему присоединяются, а в течение GROUP_DEDUP_WINDOW
+после ответа повтор сразу получает ссылку на готовый ответ. Ссылки отправляет та же задача,
+что ведет статус: повторы одного ответа, накопившиеся за круг, получают одно сообщение.
+Вместо "🧠 Думаю..." на каждый запрос в чате одно сообщение о статусе очереди, которое
+обновляется не чаще раза в GROUP_STATUS_INTERVAL секунд и удаляется, когда очередь пуста.
+
+Задачи запускаются через TaskSupervisor, поэтому при остановке очередь дорабатывается.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+import config
+from task_supervisor import TaskSupervisor
+from utils import send_long_message
+
+logger = logging.getLogger(__name__)
+
+class GroupJob:
+    __slots__ = ("user_id", "key", "run", "followers")
+
+    def __init__(self, user_id: int, key: tuple, run: Callable[[], Awaitable[int | None]]):
+        self.user_id = user_id
+        self.key = key
+        self.run = run # Возвращает id сообщения с ответом или None при ошибке
+        self.followers: list[int] = [] # id сообщений-повторов, присоединенных к запросу
+
+class _ChatQueue:
+    __slots__ = ("bot", "running", "merged", "users", "running_by_user", "served", "turns", "pointers",
+                 "status", "status_text", "status_task")
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.running = 0
+        self.merged = 0 # Повторов, присоединенных к запросам в работе
+        self.users: dict[int, deque[GroupJob]] = {} # Очереди пользователей, ждущих генерации
+        self.running_by_user: dict[int, int] = {}
+        self.served: dict[int, int] = {} # Пользователь -> номер последнего запуска его запроса
+        self.turns = itertools.count()
+        self.pointers: dict[int, list[int]] = {} # id ответа -> id повторов, которым нужно прислать ссылку на него
+        self.status: Message | None = None
+        self.status_text = ""
+        self.status_task: asyncio.Task | None = None
+
+    @property
+    def queued(self) -> int:
+        return sum(len(jobs) for jobs in self.users.values())
+
+    def pop_next(self) -> GroupJob:
+        # Меньше всего запросов в работе, при равенстве - кого дольше не обслуживали
+        user_id = min(self.users, key=lambda user: (self.running_by_user.get(user, 0), self.served.get(user, -1)))
+        jobs = self.users[user_id]
+        job = jobs.popleft()
+        if not jobs:
+            del self.users[user_id]
+        self.served[user_id] = next(self.turns)
+        return job
+
+def dedup_key(model: str, prompt: str, parent_id: int | None) -> tuple:
+    return model, " ".join(prompt.lower().split()), parent_id
+
+def message_link(chat_id: int, message_id: int) -> str | None:
+    """Ссылка на сообщение в супергруппе; у обычных групп ссылок на сообщения нет."""
+    chat = str(chat_id)
+    return f"https://t.me/c/{chat[4:]}/{message_id}" if chat.startswith("-100") else None
+
+class GroupRequestQueue:
+    def __init__(self, task_supervisor: TaskSupervisor, per_chat: int = config.GROUP_MAX_CONCURRENT_PER_CHAT,
+                 max_pending_per_user: int = config.GROUP_MAX_PENDING_PER_USER, dedup_window: float = config.GROUP_DEDUP_WINDOW):
+        self.task_supervisor = task_supervisor
+        self.per_chat = per_chat
+        self.max_pending_per_user = max_pending_per_user
+        self.dedup_window = dedup_window
+        self._chats: dict[int, _ChatQueue] = {}
+        self._active: dict[tuple, GroupJob] = {} # (chat_id, *dedup_key) -> задача в очереди или в работе
+        self._answered: dict[tuple, tuple[float, int]] = {} # (chat_id, *dedup_key) -> (время ответа, id ответа)
+
+    @property
+    def queued(self) -> int:
+        return sum(chat.queued for chat in self._chats.values())
+
+    @property
+    def running(self) -> int:
+        return sum(chat.running for chat in self._chats.values())
+
+    def pending_for(self, chat_id: int, user_id: int) -> int:
+        chat = self._chats.get(chat_id)
+        return len(chat.users.get(user_id, ())) if chat else 0
+
+    def answered_recently(self, chat_id: int, key: tuple) -> int | None:
+        """id недавнего ответа на такой же вопрос, если он еще в окне дедупликации."""
+        now = time.monotonic()
+        if len(self._answered) > 1000:
+            self._answered = {k: v for k, v in self._answered.items() if v[0] > now}
+        entry = self._answered.get((chat_id, *key))
+        return entry[1] if entry and entry[0] > now else None
+
+    def submit(self, bot: Bot, chat_id: int, user_id: int, message_id: int, key: tuple,
+               run: Callable[[], Awaitable[int | None]]) -> str:
+        """
+        Ставит запрос из сообщения message_id в очередь чата. Возвращает 'queued', 'merged'
+        (присоединен к такому же запросу, ссылка на ответ придет после генерации), 'answered'
+        (такой же вопрос недавно получил ответ, ссылка придет со следующим кругом статуса)
+        или 'limit' (у пользователя уже слишком много запросов в этом чате).
+        """
+        chat = self._chats.get(chat_id)
+        active = self._active.get((chat_id, *key))
+        if active is not None:
+            active.followers.append(message_id)
+            chat.merged += 1
+            self._ensure_status(chat_id, chat)
+            return 'merged'
+        answer_id = self.answered_recently(chat_id, key)
+        if answer_id is not None:
+            if chat is None:
+                chat = self._chats[chat_id] = _ChatQueue(bot)
+            chat.pointers.setdefault(answer_id, []).append(message_id)
+            self._ensure_status(chat_id, chat)
+            return 'answered'
+        if self.pending_for(chat_id, user_id) >= self.max_pending_per_user:
+            return 'limit'
+
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(bot)
+        job = GroupJob(user_id, key, run)
+        chat.users.setdefault(user_id, deque()).append(job)
+        self._active[(chat_id, *key)] = job
+        self._pump(chat_id, chat)
+        self._ensure_status(chat_id, chat)
+        return 'queued'
+
+    def _pump(self, chat_id: int, chat: _ChatQueue):
+        while chat.running < self.per_chat and chat.users:
+            job = chat.pop_next()
+            chat.running += 1
+            chat.running_by_user[job.user_id] = chat.running_by_user.get(job.user_id, 0) + 1
+            self.task_supervisor.spawn(self._run(chat_id, chat, job), f"group {chat_id}")
+
+    async def _run(self, chat_id: int, chat: _ChatQueue, job: GroupJob):
+        answer_id = None
+        try:
+            answer_id = await job.run()
+        except Exception:
+            logger.exception("Ошибка запроса в группе %s", chat_id)
+        finally:
+            chat.running -= 1
+            if chat.running_by_user[job.user_id] > 1:
+                chat.running_by_user[job.user_id] -= 1
+            else:
+                del chat.running_by_user[job.user_id]
+            self._active.pop((chat_id, *job.key), None)
+            if answer_id is not None:
+                self._answered[(chat_id, *job.key)] = (time.monotonic() + self.dedup_window, answer_id)
+                if job.followers:
+                    chat.pointers.setdefault(answer_id, []).extend(job.followers)
+            self._pump(chat_id, chat)
+            self._ensure_status(chat_id, chat)
+
+    @staticmethod
+    def _render_status(chat: _ChatQueue) -> str:
+        text = f"🧠 Думаю... В работе: {chat.running}"
+        if chat.queued:
+            text += f", в очереди: {chat.queued}"
+        if chat.merged:
+            text += f", повторов объединено: {chat.merged}"
+        return text
+
+    def _ensure_status(self, chat_id: int, chat: _ChatQueue):
+        # Одна задача на чат ведет сообщение статуса, пока в чате есть запросы
+        if chat.status_task is None or chat.status_task.done():
+            chat.status_task = self.task_supervisor.spawn(self._status_loop(chat_id, chat), f"group status {chat_id}")
+
+    @staticmethod
+    async def _send_pointers(chat_id: int, chat: _ChatQueue):
+        # Одно сообщение на ответ: в ответ на последний повтор, с числом повторов, если их несколько
+        pointers, chat.pointers = chat.pointers, {}
+        for answer_id, message_ids in pointers.items():
+            link = message_link(chat_id, answer_id)
+            if link:
+                text = f'☝️ Этот вопрос только что задавали, <a href="{link}">ответ здесь</a>.'
+                reply_to = message_ids[-1]
+            else:
+                text = "☝️ Этот вопрос только что задавали, ответ здесь."
+                reply_to = answer_id
+            if len(message_ids) > 1:
+                text += f" Повторов: {len(message_ids)}."
+            try:
+                await send_long_message(chat.bot, chat_id, text, parse_mode="HTML", reply_to_message_id=reply_to)
+            except (TelegramBadRequest, TelegramRetryAfter):
+                pass # Ссылка не критична, повторять не будем
+
+    async def _status_loop(self, chat_id: int, chat: _ChatQueue):
+        while True:
+            while chat.running or chat.users or chat.pointers:
+                if chat.pointers:
+                    await self._send_pointers(chat_id, chat)
+                text = self._render_status(chat) if chat.running or chat.users else chat.status_text
+                if text != chat.status_text:
+                    try:
+                        if chat.status is None:
+                            chat.status = (await send_long_message(chat.bot, chat_id, text))[0]
+                        else:
+                            await chat.status.edit_text(text)
+                        chat.status_text = text
+                    except (TelegramBadRequest, TelegramRetryAfter):
+                        pass # Статус обновится на следующем круге
+                # Повторы, пришедшие за паузу, получат одну общую ссылку на следующем круге
+                await asyncio.sleep(config.GROUP_STATUS_INTERVAL)
+
+            if chat.status is not None:
+                try:
+                    await chat.status.delete()
+                except TelegramBadRequest:
+                    pass
+                chat.status = None
+                chat.status_text = ""
+            chat.merged = 0
+            # Пока удаляли статус, могли прийти новые запросы - тогда продолжаем с новым сообщением
+            if not chat.running and not chat.users and not chat.pointers:
+                self._chats.pop(chat_id, None)
+                return
@@ -0,0 +1,64 @@
+# group_threads.py
+"""
+Цепочки ответов в группах. Для каждого сообщения с триггером и каждого ответа бота
+запоминается (роль, текст, id родителя), чтобы по reply на ответ бота восстановить
+предыдущие реплики и отправить их модели как историю.
+
+Хранилище ограничено: не больше GROUP_THREAD_MESSAGES_PER_CHAT сообщений на чат
+(старые вытесняются первыми) и не больше GROUP_THREAD_MAX_CHATS чатов (вытесняется
+давно неактивный). Тексты хранятся обрезанными до GROUP_THREAD_NODE_CHARS, история для модели -
+не длиннее GROUP_THREAD_MAX_MESSAGES реплик и GROUP_THREAD_MAX_CHARS символов.
+"""
+from collections import OrderedDict
+
+import config
+
+class ThreadNode:
+    __slots__ = ("role", "content", "parent_id")
+
+    def __init__(self, role: str, content: str, parent_id: int | None):
+        self.role = role
+        self.content = content
+        self.parent_id = parent_id
+
+class GroupThreadStore:
+    def __init__(self, max_chats: int = config.GROUP_THREAD_MAX_CHATS, per_chat: int = config.GROUP_THREAD_MESSAGES_PER_CHAT):
+        self.max_chats = max_chats
+        self.per_chat = per_chat
+        self._chats: OrderedDict[int, OrderedDict[int, ThreadNode]] = OrderedDict()
+
+    def __contains__(self, key: tuple[int, int]) -> bool:
+        chat_id, message_id = key
+        return message_id in self._chats.get(chat_id, ())
+
+    def add(self, chat_id: int, message_ids: list[int], role: str, content: str, parent_id: int | None = None):
+        """Запоминает реплику. Ответ бота из нескольких сообщений регистрируется под всеми их id."""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = OrderedDict()
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        node = ThreadNode(role, content[:config.GROUP_THREAD_NODE_CHARS], parent_id)
+        for message_id in message_ids:
+            chat[message_id] = node
+        while len(chat) > self.per_chat:
+            chat.popitem(last=False)
+
+    def thread(self, chat_id: int, message_id: int, max_messages: int = config.GROUP_THREAD_MAX_MESSAGES,
+               max_chars: int = config.GROUP_THREAD_MAX_CHARS) -> list[dict]:
+        """История до сообщения message_id включительно в формате messages API, от старых к новым."""
+        chat = self._chats.get(chat_id)
+        if not chat:
+            return []
+        self._chats.move_to_end(chat_id)
+        history: list[dict] = []
+        used = 0
+        node = chat.get(message_id)
+        while node is not None and len(history) < max_messages and used + len(node.content) <= max_chars:
+            history.append({'role': node.role, 'content': node.content})
+            used += len(node.content)
+            node = chat.get(node.parent_id) if node.parent_id is not None else None
+        history.reverse()
+        return history
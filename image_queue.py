@@ -0,0 +1,176 @@
+# image_queue.py
+"""
+Очередь генерации картинок. Запросы к IMAGE_MODEL выполняет фиксированное число воркеров,
+поэтому всплеск генераций не упирается в лимиты провайдера и не занимает хэндлеры на минуту.
+
+Задачи упорядочены по уровню подписки (старший уровень раньше), внутри уровня - по времени
+постановки. У пользователя может быть не больше IMAGE_MAX_PENDING_PER_USER задач сразу.
+Сообщение-заглушка каждой ожидающей задачи показывает ее место в очереди и обновляется,
+когда очередь продвигается.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+import config
+from task_supervisor import TaskSupervisor
+
+logger = logging.getLogger(__name__)
+
+class ImageJob:
+    __slots__ = ("user_id", "priority", "seq", "placeholder", "run", "shown_position")
+
+    def __init__(self, user_id: int, priority: int, seq: int, placeholder: Message, run: Callable[[Message], Awaitable[None]]):
+        self.user_id = user_id
+        self.priority = priority
+        self.seq = seq
+        self.placeholder = placeholder # Сообщение, которое показывает позицию и потом заменяется результатом
+        self.run = run
+        self.shown_position = 0
+
+    def __lt__(self, other: "ImageJob") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+STARTED_TEXT = "🎨 Создаю шедевр... Это может занять до минуты."
+CLOSED_TEXT = "⚠️ Бот перезапускается. Попробуйте еще раз через минуту."
+
+def format_queue_position(position: int) -> str:
+    return f"⏳ Ваш запрос в очереди на генерацию, место: {position}. Сообщение обновится, когда подойдет очередь."
+
+class ImageJobQueue:
+    def __init__(self, task_supervisor: TaskSupervisor, workers: int = config.IMAGE_WORKERS,
+                 max_pending_per_user: int = config.IMAGE_MAX_PENDING_PER_USER, max_size: int = config.IMAGE_QUEUE_LIMIT):
+        self.task_supervisor = task_supervisor
+        self.workers = workers
+        self.max_pending_per_user = max_pending_per_user
+        self.max_size = max_size
+        self.running = 0
+        self._heap: list[ImageJob] = []
+        self._seq = itertools.count()
+        self._pending: dict[int, int] = {} # Пользователь -> задач в очереди и в работе
+        self._not_empty = asyncio.Condition()
+        self._workers: list[asyncio.Task] = []
+        self._refresh_task: asyncio.Task | None = None
+        self._refresh_again = False
+        self._closed = False # После stop() задачи не принимаются, иначе воркеры запустились бы заново
+
+    @property
+    def size(self) -> int:
+        return len(self._heap)
+
+    def pending_for(self, user_id: int) -> int:
+        return self._pending.get(user_id, 0)
+
+    def can_submit(self, user_id: int) -> str | None:
+        """None, если задачу можно поставить, иначе текст отказа для пользователя."""
+        if self._closed:
+            return CLOSED_TEXT
+        if self.pending_for(user_id) >= self.max_pending_per_user:
+            return f"⚠️ У вас уже {self.pending_for(user_id)} запрос(а) на генерацию. Дождитесь, пока они выполнятся."
+        if len(self._heap) >= self.max_size:
+            return "⚠️ Сейчас слишком много запросов на генерацию. Попробуйте через несколько минут."
+        return None
+
+    def expected_position(self, level: int) -> int:
+        """Место, которое получит новая задача этого уровня, или 0, если она сразу уйдет свободному воркеру."""
+        if self.running + len(self._heap) < self.workers:
+            return 0
+        return 1 + sum(1 for job in self._heap if job.priority <= -level)
+
+    def placeholder_text(self, level: int) -> str:
+        position = self.expected_position(level)
+        return format_queue_position(position) if position else STARTED_TEXT
+
+    async def submit(self, user_id: int, level: int, placeholder: Message, run: Callable[[Message], Awaitable[None]]) -> bool:
+        """
+        Ставит задачу в очередь. placeholder должен быть отправлен с текстом placeholder_text(level),
+        лимиты проверяются заранее через can_submit. run получает placeholder, когда подходит очередь.
+        Возвращает False, если очередь уже остановлена (задача не принята).
+        """
+        if self._closed:
+            return False
+        self.start()
+        job = ImageJob(user_id, -level, next(self._seq), placeholder, run)
+        job.shown_position = self.expected_position(level)
+        async with self._not_empty:
+            heapq.heappush(self._heap, job)
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+            self._not_empty.notify()
+        # Задача старшего уровня могла обогнать уже ждущих
+        self._schedule_refresh()
+        return True
+
+    def _release(self, user_id: int):
+        left = self._pending.get(user_id, 0) - 1
+        if left > 0:
+            self._pending[user_id] = left
+        else:
+            self._pending.pop(user_id, None)
+
+    async def _worker(self):
+        while True:
+            async with self._not_empty:
+                while not self._heap:
+                    await self._not_empty.wait()
+                job = heapq.heappop(self._heap)
+            self.running += 1
+            self._schedule_refresh()
+            try:
+                if job.shown_position:
+                    job.shown_position = 0
+                    try:
+                        await job.placeholder.edit_text(STARTED_TEXT)
+                    except (TelegramBadRequest, TelegramRetryAfter):
+                        pass
+                await job.run(job.placeholder)
+            except Exception:
+                logger.exception("Ошибка генерации картинки для пользователя %s", job.user_id)
+            finally:
+                self.running -= 1
+                self._release(job.user_id)
+
+    def _schedule_refresh(self):
+        # Одна задача обновления на всю очередь: если она уже идет, просто пройдет еще круг
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_again = True
+            return
+        self._refresh_task = self.task_supervisor.spawn(self._refresh_positions(), "image queue positions")
+
+    async def _refresh_positions(self):
+        self._refresh_again = True
+        while self._refresh_again:
+            self._refresh_again = False
+            for position, job in enumerate(sorted(self._heap), start=1):
+                if job.shown_position == position or job not in self._heap: # Могла уже уйти воркеру
+                    continue
+                job.shown_position = position
+                try:
+                    await job.placeholder.edit_text(format_queue_position(position))
+                except (TelegramBadRequest, TelegramRetryAfter):
+                    pass # Позиция обновится при следующем продвижении очереди
+                except Exception:
+                    logger.exception("Не удалось обновить место в очереди")
+
+    def start(self):
+        while len(self._workers) < self.workers:
+            self._workers.append(self.task_supervisor.spawn(self._worker(), f"image worker {len(self._workers)}"))
+
+    async def stop(self, timeout: float):
+        """Перестает принимать задачи, дает закончить очередь не дольше timeout секунд, затем останавливает воркеров."""
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        while (self._heap or self.running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._heap or self.running:
+            logger.warning("Остановка: брошено задач генерации картинок - %s в очереди, %s в работе", len(self._heap), self.running)
+        for task in self._workers + ([self._refresh_task] if self._refresh_task else []):
+            task.cancel()
+        await asyncio.gather(*self._workers, *([self._refresh_task] if self._refresh_task else []), return_exceptions=True)
+        self._workers = []
+        self._refresh_task = None
@@ -1,14 +1,89 @@
 # keyboards.py
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+import functools
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.filters import Filter
 from aiogram.filters.callback_data import CallbackData
 import config
+from metrics import record_cache
+from model_catalog import CATEGORY_CALLBACK_PREFIX, MODEL_CALLBACK_PREFIX, ModelCatalog
 
-class ModelCallback(CallbackData, prefix="model"):
-    model_name: str
+class CatalogCallback(Filter):
+    """
+    Фильтр кнопок каталога ("m:<token>:<индекс>" / "c:<token>:<индекс>"). Передает в хэндлер
+    catalog_item - имя модели или категории, либо None, если кнопка устарела.
+    """
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._start = f"{prefix}:"
 
-class Paginator(CallbackData, prefix="pag"):
-    action: str
+    async def __call__(self, callback: CallbackQuery, model_catalog: ModelCatalog) -> bool | dict:
+        if not callback.data or not callback.data.startswith(self._start):
+            return False
+        return {"catalog_item": model_catalog.decode_callback(self.prefix, callback.data)}
+
+MODEL_BUTTON = CatalogCallback(MODEL_CALLBACK_PREFIX)
+CATEGORY_BUTTON = CatalogCallback(CATEGORY_CALLBACK_PREFIX)
+
+class UsersPage(CallbackData, prefix="up"):
+    """Страница списка пользователей: курсор - граничная строка соседней страницы, direction - 'n' (дальше) или 'p' (назад)."""
     page: int
+    direction: str = ""
+    cursor: str = ""
+    filters: str = ""
+
+class UserSearch(CallbackData, prefix="us"):
+    """Страница результатов поиска. В query только символы username: без ':' и не длиннее 32, чтобы влезть в callback_data."""
+    query: str
+    offset: int = 0
+
+# --- Курсор и фильтры списка пользователей (должны помещаться в 64 байта callback_data) ---
+
+_EPOCH = datetime(1970, 1, 1)
+_FILTER_RE = re.compile(r'([lba])(\d+)')
+USER_ACTIVE_PERIODS = (7, 30) # Варианты фильтра "активны за N дней"
+
+def encode_user_cursor(created_at: str | None, user_id: int) -> str:
+    """(created_at, user_id) -> "<микросекунды base36>.<user_id base36>". created_at в том виде, в каком его хранит sqlite3."""
+    if not created_at:
+        return ""
+    micros = (datetime.fromisoformat(created_at) - _EPOCH) // timedelta(microseconds=1)
+    return f"{_base36(micros)}.{_base36(user_id)}"
+
+def decode_user_cursor(cursor: str) -> tuple[str, int] | None:
+    try:
+        micros, user_id = cursor.split(".")
+        return (_EPOCH + timedelta(microseconds=int(micros, 36))).isoformat(" "), int(user_id, 36)
+    except ValueError:
+        return None
+
+def _base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        number, rest = divmod(number, 36)
+        text = digits[rest] + text
+        if not number:
+            return text
+
+def parse_user_filters(filters: str) -> dict:
+    """"l1b0a7" -> {'level': 1, 'blocked': False, 'active_days': 7}; отсутствующий фильтр - None."""
+    values = {key: int(value) for key, value in _FILTER_RE.findall(filters)}
+    return {
+        'level': values.get('l'),
+        'blocked': bool(values['b']) if 'b' in values else None,
+        'active_days': values.get('a'),
+    }
+
+def format_user_filters(level: int | None, blocked: bool | None, active_days: int | None) -> str:
+    return (f"l{level}" if level is not None else "") + (f"b{int(blocked)}" if blocked is not None else "") + \
+        (f"a{active_days}" if active_days else "")
+
+def _next_option(options: tuple, current):
+    return options[(options.index(current) + 1) % len(options)]
 
 class BroadcastCallback(CallbackData, prefix="brd"):
     action: str
@@ -17,8 +92,53 @@ class BroadcastCallback(CallbackData, prefix="brd"):
 class SubDetailCallback(CallbackData, prefix="show_sub"):
     level: int
 
+# --- Кэш готовых клавиатур ---
+# Разметка зависит от нескольких входов (админ ли, уровень, недоступные модели, категория, версия каталога),
+# поэтому одинаковые клавиатуры строим один раз. Все входы - часть ключа: смена статуса моделей
+# или перезагрузка каталога сама дает промах. Готовые объекты общие, их нельзя менять после возврата.
+
+KEYBOARD_CACHE_SIZE = 1024
+_keyboard_cache: OrderedDict[tuple, InlineKeyboardMarkup] = OrderedDict()
+_catalog_version = 0
+
+def invalidate_keyboards():
+    _keyboard_cache.clear()
+
+def _cached(key: tuple, build, catalog: ModelCatalog | None = None) -> InlineKeyboardMarkup:
+    global _catalog_version
+    if catalog is not None and catalog.version != _catalog_version:
+        # Клавиатуры старой версии каталога больше не понадобятся
+        _catalog_version = catalog.version
+        invalidate_keyboards()
+    markup = _keyboard_cache.get(key)
+    record_cache("keyboards", markup is not None)
+    if markup is not None:
+        _keyboard_cache.move_to_end(key)
+        return markup
+    markup = build()
+    _keyboard_cache[key] = markup
+    if len(_keyboard_cache) > KEYBOARD_CACHE_SIZE:
+        _keyboard_cache.popitem(last=False)
+    return markup
+
+def get_group_redirect_keyboard(url: str) -> InlineKeyboardMarkup:
+    return _cached(("group_redirect", url), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🚀 Перейти в личный чат", url=url)]
+    ]))
+
+def _static_keyboard(func):
+    """Для клавиатур без параметров: строится один раз."""
+    @functools.wraps(func)
+    def wrapper() -> InlineKeyboardMarkup:
+        return _cached((func.__name__,), func)
+    return wrapper
+
 def get_main_menu(user_id: int, model_status_cache: dict) -> InlineKeyboardMarkup:
+    is_admin = user_id in config.ADMIN_IDS
     is_image_model_disabled = config.IMAGE_MODEL in model_status_cache and not model_status_cache[config.IMAGE_MODEL]
+    return _cached(("main", is_admin, is_image_model_disabled), lambda: _build_main_menu(is_admin, is_image_model_disabled))
+
+def _build_main_menu(is_admin: bool, is_image_model_disabled: bool) -> InlineKeyboardMarkup:
     image_gen_text = "⚠️ Генерация изображений" if is_image_model_disabled else "🖼️ Генерация изображений"
     
     buttons = [
@@ -29,10 +149,11 @@ def get_main_menu(user_id: int, model_status_cache: dict) -> InlineKeyboardMarku
         [InlineKeyboardButton(text='👨‍💻 Поддержка', url=f'https://t.me/{config.SUPPORT_USERNAME}')],
         [InlineKeyboardButton(text='❓ Помощь', callback_data='menu_help')]
     ]
-    if user_id in config.ADMIN_IDS:
+    if is_admin:
         buttons.insert(5, [InlineKeyboardButton(text='👑 Админ-панель', callback_data='menu_admin')])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_static_keyboard
 def get_admin_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text='📊 Статистика', callback_data='admin_stats')],
@@ -44,27 +165,58 @@ def get_admin_menu() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text='↩️ Назад', callback_data='back_main')]
     ])
 
+@_static_keyboard
 def get_admin_users_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text='📋 Список пользователей', callback_data='admin_list_users_1')],
         [InlineKeyboardButton(text='🔍 Найти пользователя', callback_data='admin_search')],
         [InlineKeyboardButton(text='✅ Выдать подписку', callback_data='admin_grant')],
         [InlineKeyboardButton(text='💔 Забрать подписку', callback_data='admin_revoke')],
+        [InlineKeyboardButton(text='📥 Подписки из CSV', callback_data='admin_bulk_subscriptions')],
         [InlineKeyboardButton(text='🚫 Блокировка', callback_data='admin_block')],
         [InlineKeyboardButton(text='🟢 Разблокировка', callback_data='admin_unblock')],
         [InlineKeyboardButton(text='↩️ Назад', callback_data='admin_back')]
     ])
 
-def get_paginated_users_keyboard(page: int, total_pages: int) -> InlineKeyboardMarkup:
-    buttons = []
+def get_users_page_keyboard(page: int, total_pages: int, prev_cursor: str | None, next_cursor: str | None, filters: str) -> InlineKeyboardMarkup:
     nav_buttons = []
-    if page > 1:
-        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=Paginator(action="prev", page=page).pack()))
+    if prev_cursor:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=UsersPage(page=page - 1, direction="p", cursor=prev_cursor, filters=filters).pack()))
     nav_buttons.append(InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="noop"))
-    if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=Paginator(action="next", page=page).pack()))
-    
-    buttons.append(nav_buttons)
+    if next_cursor:
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=UsersPage(page=page + 1, direction="n", cursor=next_cursor, filters=filters).pack()))
+
+    # Кнопки фильтров перебирают значения по кругу и возвращают на первую страницу
+    current = parse_user_filters(filters)
+    level, blocked, active_days = current['level'], current['blocked'], current['active_days']
+    level_name = config.SUB_LEVEL_MAP.get(level, "все").capitalize() if level is not None else "все"
+    blocked_name = {None: "все", False: "нет", True: "да"}[blocked]
+    active_name = f"{active_days} дн." if active_days else "все"
+    next_level = _next_option((None, *config.SUB_LEVEL_MAP), level)
+    next_blocked = _next_option((None, False, True), blocked)
+    next_active = _next_option((None, *USER_ACTIVE_PERIODS), active_days)
+    filter_buttons = [
+        InlineKeyboardButton(text=f"Уровень: {level_name}",
+                             callback_data=UsersPage(page=1, filters=format_user_filters(next_level, blocked, active_days)).pack()),
+        InlineKeyboardButton(text=f"Блок: {blocked_name}",
+                             callback_data=UsersPage(page=1, filters=format_user_filters(level, next_blocked, active_days)).pack()),
+        InlineKeyboardButton(text=f"Активны: {active_name}",
+                             callback_data=UsersPage(page=1, filters=format_user_filters(level, blocked, next_active)).pack()),
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[
+        nav_buttons,
+        filter_buttons,
+        [InlineKeyboardButton(text="↩️ В админ-панель", callback_data="admin_back")],
+    ])
+
+def get_user_search_keyboard(query: str, offset: int, per_page: int, has_more: bool) -> InlineKeyboardMarkup:
+    nav_buttons = []
+    if offset > 0:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=UserSearch(query=query, offset=max(0, offset - per_page)).pack()))
+    if has_more:
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=UserSearch(query=query, offset=offset + per_page).pack()))
+    buttons = [nav_buttons] if nav_buttons else []
+    buttons.append([InlineKeyboardButton(text="🔍 Новый поиск", callback_data="admin_search")])
     buttons.append([InlineKeyboardButton(text="↩️ В админ-панель", callback_data="admin_back")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
@@ -86,22 +238,30 @@ def get_broadcast_manage_keyboard(broadcast_id: int) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def get_category_models_menu(category: str, user_sub_level: int, disabled_models: set) -> InlineKeyboardMarkup:
-    sub_name = config.SUB_LEVEL_MAP.get(user_sub_level, 'free')
-    sub_info = config.SUBSCRIPTION_MODELS[sub_name]
-    
-    available_for_sub = sub_info['models']
-    category_models = config.ALL_MODELS.get(category, [])
-    
+def format_model_button(model: str, disabled_models: set, model_latency: dict | None = None) -> str:
+    if model in disabled_models:
+        return f"⚠️ {model}"
+    latency = (model_latency or {}).get(model)
+    if latency is None:
+        return model
+    slow_mark = "🐢 " if latency >= config.MODEL_SLOW_LATENCY else ""
+    return f"{slow_mark}{model} · {latency:.1f}с"
+
+def get_category_models_menu(catalog: ModelCatalog, category: str, user_sub_level: int, disabled_models: set, model_latency: dict | None = None) -> InlineKeyboardMarkup:
+    models = catalog.models_for(user_sub_level, category)
+    # Ключ - только то, что видно в этом меню: подписи кнопок и список моделей
+    labels = tuple(format_model_button(model, disabled_models, model_latency) for model in models)
+    return _cached(("models", catalog.version, category, labels), lambda: _build_category_models_menu(catalog, models, labels), catalog)
+
+def _build_category_models_menu(catalog: ModelCatalog, models: list[str], labels: tuple[str, ...]) -> InlineKeyboardMarkup:
     buttons = []
-    for model in category_models:
-        if model in available_for_sub:
-            text = f"⚠️ {model}" if model in disabled_models else model
-            buttons.append([InlineKeyboardButton(text=text, callback_data=ModelCallback(model_name=model).pack())])
+    for model, text in zip(models, labels):
+        buttons.append([InlineKeyboardButton(text=text, callback_data=catalog.model_callback(model))])
             
     buttons.append([InlineKeyboardButton(text='↩️ Назад', callback_data='menu_models')])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_static_keyboard
 def get_chat_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text='🔄 Сменить модель', callback_data='menu_models')],
@@ -109,36 +269,39 @@ def get_chat_menu() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text='↩️ Главное меню', callback_data='back_main')]
     ])
 
-def get_models_categories_menu(user_sub_level: int) -> InlineKeyboardMarkup:
-    sub_name = config.SUB_LEVEL_MAP.get(user_sub_level, 'free')
-    sub_info = config.SUBSCRIPTION_MODELS[sub_name]
-    available_for_sub = sub_info['models']
+def get_models_categories_menu(catalog: ModelCatalog, user_sub_level: int) -> InlineKeyboardMarkup:
+    categories = catalog.categories_for(user_sub_level)
+    return _cached(("categories", catalog.version, tuple(categories)), lambda: _build_models_categories_menu(catalog, categories), catalog)
 
+def _build_models_categories_menu(catalog: ModelCatalog, categories: list[str]) -> InlineKeyboardMarkup:
     buttons = []
-    for provider, models in config.ALL_MODELS.items():
-        if any(model in available_for_sub for model in models):
-            buttons.append([InlineKeyboardButton(text=provider, callback_data=f'cat_{provider}')])
+    for provider in categories:
+        buttons.append([InlineKeyboardButton(text=provider, callback_data=catalog.category_callback(provider))])
 
     buttons.append([InlineKeyboardButton(text='↩️ Назад', callback_data='back_main')])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def get_subscription_menu() -> InlineKeyboardMarkup:
+def get_subscription_menu(catalog: ModelCatalog) -> InlineKeyboardMarkup:
+    return _cached(("subscriptions", catalog.version), lambda: _build_subscription_menu(catalog), catalog)
+
+def _build_subscription_menu(catalog: ModelCatalog) -> InlineKeyboardMarkup:
     buttons = []
-    for sub_name, sub_info in config.SUBSCRIPTION_MODELS.items():
-        if sub_info['price'] > 0:
-            buttons.append([
-                InlineKeyboardButton(
-                    text=f"Подробнее о {sub_info['name']} - {sub_info['price']}₽",
-                    callback_data=SubDetailCallback(level=sub_info['level']).pack()
-                )
-            ])
+    for sub_info in catalog.paid_tiers():
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"Подробнее о {sub_info['name']} - {sub_info['price']}₽",
+                callback_data=SubDetailCallback(level=sub_info['level']).pack()
+            )
+        ])
     buttons.append([InlineKeyboardButton(text='↩️ Назад', callback_data='back_main')])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def get_subscription_details_keyboard(level: int) -> InlineKeyboardMarkup:
+def get_subscription_details_keyboard(catalog: ModelCatalog, level: int) -> InlineKeyboardMarkup:
     """Создает клавиатуру для экрана с деталями подписки."""
-    sub_name = config.SUB_LEVEL_MAP.get(level)
-    sub_info = config.SUBSCRIPTION_MODELS[sub_name]
+    return _cached(("subscription_details", catalog.version, level), lambda: _build_subscription_details_keyboard(catalog, level), catalog)
+
+def _build_subscription_details_keyboard(catalog: ModelCatalog, level: int) -> InlineKeyboardMarkup:
+    sub_info = catalog.tier(level)
     
     buttons = [
         [InlineKeyboardButton(
@@ -149,15 +312,23 @@ def get_subscription_details_keyboard(level: int) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_static_keyboard
 def get_back_to_main_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='↩️ Назад', callback_data='back_main')]])
 
+@_static_keyboard
 def get_admin_back_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='↩️ Назад', callback_data='admin_back')]])
 
+@_static_keyboard
 def get_cancel_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_action')]])
 
+@_static_keyboard
+def get_model_test_cancel_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='⏹ Остановить тест', callback_data='admin_test_cancel')]])
+
+@_static_keyboard
 def get_broadcast_confirmation_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text='✅ Отправить всем', callback_data='broadcast_send')],
@@ -165,8 +336,23 @@ def get_broadcast_confirmation_keyboard() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_action')]
     ])
 
+@_static_keyboard
 def get_reset_all_subs_confirmation_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text='✅ Да, сбросить все', callback_data='confirm_reset_all_subs')],
         [InlineKeyboardButton(text='❌ Отмена', callback_data='admin_back')]
-    ])
\ No newline at end of file
+    ])
+
+def warm_up_keyboards(catalog: ModelCatalog):
+    """Строит заранее клавиатуры, которые не зависят от пользователя, чтобы первые запросы не платили за сборку."""
+    # Сначала клавиатуры каталога: при смене его версии кэш очищается целиком
+    for tier in catalog.tiers():
+        get_models_categories_menu(catalog, tier["level"])
+    get_subscription_menu(catalog)
+    for is_admin in (False, True):
+        for is_image_model_disabled in (False, True):
+            _cached(("main", is_admin, is_image_model_disabled), lambda: _build_main_menu(is_admin, is_image_model_disabled))
+    for keyboard in (get_admin_menu, get_admin_users_menu, get_chat_menu, get_back_to_main_menu, get_admin_back_menu,
+                     get_cancel_keyboard, get_model_test_cancel_keyboard, get_broadcast_confirmation_keyboard,
+                     get_reset_all_subs_confirmation_keyboard):
+        keyboard()
@@ -0,0 +1,189 @@
+# markdown_render.py
+"""
+Перевод Markdown из ответов моделей в HTML, который понимает Telegram (parse_mode="HTML").
+
+Поддерживаются блоки кода ```lang, `инлайн-код`, **жирный**, *курсив*, ~~зачеркнутый~~,
+[ссылки](url), заголовки (как жирный текст), списки и цитаты. Весь остальной текст
+экранируется, поэтому "<" и "&" в ответе больше не ломают отправку.
+
+Рендер построчный и умеет работать потоково: MarkdownRenderer.feed() принимает куски
+ответа по мере генерации и возвращает HTML для завершенных строк, finish() дописывает
+остаток и закрывает незакрытые блоки. Результат можно резать utils.split_html_message.
+"""
+import html
+import re
+
+_FENCE_RE = re.compile(r'^\s*(```|~~~)\s*([\w+#.-]*)\s*$')
+_HEADING_RE = re.compile(r'^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$')
+_BULLET_RE = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+_QUOTE_RE = re.compile(r'^\s{0,3}>\s?(.*)$')
+_RULE_RE = re.compile(r'^\s{0,3}([-*_])(\s*\1){2,}\s*$')
+
+_INLINE_CODE_RE = re.compile(r'(`+)(.+?)\1')
+_LINK_RE = re.compile(r'\[([^\]\n]+)\]\(([^)\s]+)\)')
+_BOLD_STAR_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*')
+# "_" и "__" - только на границах слов; __слово__ без пробелов считаем именем вроде __init__, а не жирным
+_BOLD_UNDERSCORE_RE = re.compile(r'(?<![\w_])__(?=[^\s_])(?!\w+__(?![\w_]))(.+?)(?<=[^\s_])__(?![\w_])')
+_ITALIC_STAR_RE = re.compile(r'(?<![\w*])\*(?=\S)(.+?)(?<=\S)\*(?![\w*])')
+_ITALIC_UNDERSCORE_RE = re.compile(r'(?<![\w_])_(?=[^\s_])(.+?)(?<=[^\s_])_(?![\w_])')
+_STRIKE_RE = re.compile(r'~~(?=\S)(.+?)(?<=\S)~~')
+_PLACEHOLDER_RE = re.compile(r'\x00(\d+)\x00')
+_EMPHASIS_TAG_RE = re.compile(r'<(/?)([bis])>')
+
+def _escape(text: str) -> str:
+    return html.escape(text, quote=False)
+
+def _balance(text: str) -> str:
+    """
+    Выправляет вложенность тегов выделения: при закрытии внешнего тега открытые внутри него
+    закрываются и открываются заново после, так что **a _b** c_ дает <b>a <i>b</i></b><i> c</i>.
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    pos = 0
+    for m in _EMPHASIS_TAG_RE.finditer(text):
+        out.append(text[pos:m.start()])
+        pos = m.end()
+        closing, tag = m.groups()
+        if not closing:
+            stack.append(tag)
+            out.append(m.group())
+            continue
+        reopen = []
+        while stack[-1] != tag:
+            reopen.append(stack.pop())
+            out.append(f'</{reopen[-1]}>')
+        stack.pop()
+        out.append(m.group())
+        for inner in reversed(reopen):
+            stack.append(inner)
+            out.append(f'<{inner}>')
+    out.append(text[pos:])
+    return ''.join(out)
+
+def render_inline(text: str) -> str:
+    """Инлайн-разметка одной строки. Код и ссылки прячутся в плейсхолдеры, чтобы внутри них не искать **."""
+    protected: list[str] = []
+
+    def protect(fragment: str) -> str:
+        protected.append(fragment)
+        return f'\x00{len(protected) - 1}\x00'
+
+    text = text.replace('\x00', '')
+    text = _INLINE_CODE_RE.sub(lambda m: protect(f'<code>{_escape(m.group(2).strip())}</code>'), text)
+    text = _LINK_RE.sub(
+        lambda m: protect(f'<a href="{html.escape(m.group(2), quote=True)}">{_escape(m.group(1))}</a>'), text
+    )
+    text = _escape(text)
+    text = _BOLD_STAR_RE.sub(r'<b>\1</b>', text)
+    text = _BOLD_UNDERSCORE_RE.sub(r'<b>\1</b>', text)
+    text = _STRIKE_RE.sub(r'<s>\1</s>', text)
+    text = _ITALIC_STAR_RE.sub(r'<i>\1</i>', text)
+    text = _ITALIC_UNDERSCORE_RE.sub(r'<i>\1</i>', text)
+    text = _balance(text)
+    if protected:
+        text = _PLACEHOLDER_RE.sub(lambda m: protected[int(m.group(1))], text)
+    return text
+
+class MarkdownRenderer:
+    def __init__(self):
+        self._pending: list[str] = [] # Куски незавершенной последней строки
+        self._started = False # Выведена ли уже хоть одна строка
+        self._open_tags = '' # Открывающие теги блока, которые допишутся перед следующей строкой
+        self._in_code = False
+        self._fence = ''
+        self._code_in_quote = False # Блок кода открыт внутри цитаты: его строки тоже начинаются с ">"
+        self._in_quote = False
+
+    def _emit(self, content: str) -> str:
+        # Перевод строки ставится перед строкой, а не после, чтобы закрывающий тег блока
+        # можно было дописать сразу за уже отданной последней строкой
+        out = ('\n' if self._started else '') + self._open_tags + content
+        self._started = True
+        self._open_tags = ''
+        return out
+
+    def _close(self, tag: str) -> str:
+        # Если блок пустой, его открывающие теги еще не выведены
+        return (self._emit('') if self._open_tags else '') + tag
+
+    def _open_code(self, fence: re.Match):
+        self._in_code = True
+        self._fence = fence.group(1)
+        language = fence.group(2)
+        self._open_tags += f'<pre><code class="language-{_escape(language)}">' if language else '<pre><code>'
+
+    def _code_line(self, line: str) -> str:
+        fence = _FENCE_RE.match(line)
+        if fence and fence.group(1) == self._fence and not fence.group(2):
+            self._in_code = self._code_in_quote = False
+            return self._close('</code></pre>')
+        return self._emit(_escape(line))
+
+    def _line(self, line: str) -> str:
+        if self._in_code:
+            if not self._code_in_quote:
+                return self._code_line(line)
+            quote = _QUOTE_RE.match(line)
+            if quote:
+                return self._code_line(quote.group(1))
+            # Цитата кончилась раньше закрывающего ``` - закрываем код и разбираем строку заново
+            self._in_code = self._code_in_quote = False
+            return self._close('</code></pre>') + self._line(line)
+
+        out = ''
+        quote = _QUOTE_RE.match(line)
+        if self._in_quote and not quote:
+            self._in_quote = False
+            out += self._close('</blockquote>')
+
+        fence = _FENCE_RE.match(line)
+        if fence:
+            self._open_code(fence)
+            return out
+        if quote:
+            if not self._in_quote:
+                self._in_quote = True
+                self._open_tags += '<blockquote>'
+            quote_fence = _FENCE_RE.match(quote.group(1))
+            if quote_fence:
+                self._open_code(quote_fence)
+                self._code_in_quote = True
+                return out
+            return out + self._emit(render_inline(quote.group(1)))
+
+        heading = _HEADING_RE.match(line)
+        if heading:
+            return out + self._emit(f'<b>{render_inline(heading.group(1))}</b>')
+        if _RULE_RE.match(line):
+            return out + self._emit('——————')
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            return out + self._emit(f'{bullet.group(1)}• {render_inline(bullet.group(2))}')
+        return out + self._emit(render_inline(line))
+
+    def feed(self, chunk: str) -> str:
+        """Принимает очередной кусок Markdown и возвращает HTML для строк, которые уже завершены."""
+        if '\n' not in chunk: # Копим без склейки, чтобы длинная строка не собиралась за квадрат
+            self._pending.append(chunk)
+            return ''
+        self._pending.append(chunk)
+        lines = ''.join(self._pending).split('\n')
+        self._pending = [lines.pop()]
+        return ''.join(self._line(line) for line in lines)
+
+    def finish(self) -> str:
+        tail = ''.join(self._pending)
+        out = self._line(tail) if tail else ''
+        self._pending = []
+        if self._in_code:
+            self._in_code = self._code_in_quote = False
+            out += self._close('</code></pre>')
+        if self._in_quote:
+            self._in_quote = False
+            out += self._close('</blockquote>')
+        return out
+
+def render_markdown(text: str) -> str:
+    renderer = MarkdownRenderer()
+    return renderer.feed(text) + renderer.finish()
@@ -0,0 +1,117 @@
+# media.py
+"""
+Файлы от пользователей: потоковое скачивание через Bot API с ограничением размера
+и подготовка картинок для vision-моделей.
+
+Картинка уменьшается до VISION_MAX_SIDE по большей стороне и пережимается в JPEG в пуле
+потоков, чтобы не блокировать event loop. Pillow необязателен: без него картинка
+передается как есть, если формат поддерживается и она не больше VISION_MAX_IMAGE_BYTES.
+"""
+import asyncio
+import base64
+import io
+from typing import AsyncIterator
+
+from aiogram import Bot
+from aiogram.types import PhotoSize
+
+import config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow нужен только для уменьшения картинок
+    Image = None
+
+class FileTooLarge(ValueError):
+    """Файл больше допустимого; limit - сработавший предел в байтах, его и показываем пользователю."""
+    def __init__(self, limit: int, message: str | None = None):
+        super().__init__(message or f"file is larger than {limit} bytes")
+        self.limit = limit
+
+class UnsupportedImage(ValueError):
+    pass
+
+_IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+def sniff_image_type(data: bytes) -> str | None:
+    for signature, mime in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def _read_local(path: str, max_bytes: int) -> bytes:
+    with open(path, 'rb') as f:
+        data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise FileTooLarge(max_bytes)
+    return data
+
+async def iter_file_chunks(bot: Bot, file_id: str, max_bytes: int) -> AsyncIterator[bytes]:
+    """Отдает файл кусками по мере скачивания и прерывает загрузку, как только размер превысил max_bytes."""
+    file = await bot.get_file(file_id)
+    if file.file_size and file.file_size > max_bytes:
+        raise FileTooLarge(max_bytes)
+    if bot.session.api.is_local: # Локальный Bot API сервер отдает путь к файлу на диске
+        yield await asyncio.get_running_loop().run_in_executor(None, _read_local, file.file_path, max_bytes)
+        return
+
+    size = 0
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url, timeout=config.FILE_DOWNLOAD_TIMEOUT):
+        size += len(chunk)
+        if size > max_bytes:
+            raise FileTooLarge(max_bytes)
+        yield chunk
+
+async def download_file(bot: Bot, file_id: str, max_bytes: int) -> bytes:
+    """Скачивает файл целиком с ограничением размера."""
+    data = bytearray()
+    async for chunk in iter_file_chunks(bot, file_id, max_bytes):
+        data.extend(chunk)
+    return bytes(data)
+
+def pick_photo_size(sizes: list[PhotoSize], max_side: int) -> PhotoSize:
+    """Наименьший вариант фото, которого хватает на max_side, - нет смысла качать оригинал, чтобы потом уменьшать."""
+    for size in sorted(sizes, key=lambda s: s.width * s.height):
+        if max(size.width, size.height) >= max_side:
+            return size
+    return max(sizes, key=lambda s: s.width * s.height)
+
+def _fit_image(data: bytes, max_side: int, quality: int) -> tuple[bytes, str]:
+    mime = sniff_image_type(data)
+    if Image is None:
+        if mime is None:
+            raise UnsupportedImage("unknown image format")
+        if len(data) > config.VISION_MAX_IMAGE_BYTES:
+            raise FileTooLarge(config.VISION_MAX_IMAGE_BYTES, "image is too large to send without resizing (Pillow is not installed)")
+        return data, mime
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_side = max(image.size)
+        image.draft('RGB', (max_side, max_side)) # JPEG декодируется сразу в уменьшенном размере
+        image = ImageOps.exif_transpose(image)
+    except Exception as e:
+        raise UnsupportedImage(str(e)) from e
+    if original_side <= max_side and mime in ('image/jpeg', 'image/png') and len(data) <= config.VISION_MAX_IMAGE_BYTES:
+        return data, mime # Уже подходит, не пережимаем
+    image.thumbnail((max_side, max_side))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue(), 'image/jpeg'
+
+async def prepare_vision_image(data: bytes) -> str:
+    """Уменьшает картинку в пуле потоков и возвращает data URL для image_url в запросе к модели."""
+    fitted, mime = await asyncio.get_running_loop().run_in_executor(
+        None, _fit_image, data, config.VISION_MAX_SIDE, config.VISION_JPEG_QUALITY
+    )
+    return f"data:{mime};base64,{base64.b64encode(fitted).decode()}"
@@ -0,0 +1,214 @@
+# metrics.py
+"""
+Минимальный реестр метрик в текстовом формате Prometheus и HTTP-эндпоинт /metrics.
+Внешних зависимостей нет: сервер поднимается на aiohttp, который уже используется ботом.
+"""
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in self._values.items()]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+        self._callbacks: dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, func: Callable[[], float], **labels):
+        """Значение вычисляется в момент опроса /metrics (например, длина очереди)."""
+        self._callbacks[self._key(labels)] = func
+
+    def _samples(self):
+        values = dict(self._values)
+        for key, func in self._callbacks.items():
+            try:
+                values[key] = func()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {} # key -> [счетчики по бакетам..., +Inf, сумма]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        for key, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets=buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATE_SECONDS = REGISTRY.histogram("bot_update_handling_seconds", "Время обработки апдейта хэндлером", ("handler", "event"))
+UPSTREAM_SECONDS = REGISTRY.histogram("bot_upstream_request_seconds", "Время запроса к API моделей", ("model", "endpoint"))
+UPSTREAM_ERRORS = REGISTRY.counter("bot_upstream_errors_total", "Ошибки запросов к API моделей", ("model", "endpoint", "kind"))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "bot_db_query_seconds", "Время выполнения методов Database", ("method",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+CACHE_REQUESTS = REGISTRY.counter("bot_cache_requests_total", "Обращения к кэшам (result=hit|miss)", ("cache", "result"))
+QUEUE_DEPTH = REGISTRY.gauge("bot_queue_depth", "Текущая длина очередей и число задач в работе", ("queue",))
+TELEGRAM_REQUESTS = REGISTRY.counter("bot_telegram_requests_total", "Вызовы Bot API", ("method", "status"))
+TELEGRAM_SECONDS = REGISTRY.histogram("bot_telegram_request_seconds", "Время вызовов Bot API", ("method",))
+TELEGRAM_RETRY_AFTER = REGISTRY.counter("bot_telegram_retry_after_total", "Ответы 429 (Flood control) от Bot API", ("method",))
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+def instrument_methods(histogram: Histogram, label: str = "method"):
+    """Декоратор класса: замеряет время всех публичных корутин-методов."""
+    def decorator(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not asyncio.iscoroutinefunction(method):
+                continue
+
+            def wrap(func, method_name):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with histogram.time(**{label: method_name}):
+                        return await func(*args, **kwargs)
+                return wrapper
+
+            setattr(cls, name, wrap(method, name))
+        return cls
+    return decorator
+
+
+class TelegramRequestMetrics(BaseRequestMiddleware):
+    """Мидлварь сессии бота: частота и время вызовов Bot API, счетчик 429."""
+    async def __call__(self, make_request, bot: Bot, method):
+        method_name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except TelegramRetryAfter:
+            TELEGRAM_RETRY_AFTER.inc(method=method_name)
+            TELEGRAM_REQUESTS.inc(method=method_name, status="429")
+            raise
+        except Exception:
+            TELEGRAM_REQUESTS.inc(method=method_name, status="error")
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - start, method=method_name)
+        TELEGRAM_REQUESTS.inc(method=method_name, status="ok")
+        return response
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
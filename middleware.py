@@ -6,6 +6,42 @@ from aiogram.types import TelegramObject, Message, CallbackQuery, User
 # from database import Database # No longer directly needed by middleware
 # from api_helpers import get_user_level, get_user_limit # These are now in UserService
 from user_service import UserService # Import UserService
+from task_supervisor import TaskSupervisor
+from metrics import UPDATE_SECONDS
+from tracing import annotate
+
+class InFlightMiddleware(BaseMiddleware):
+    """Внешняя мидлварь апдейтов: учитывает обработку в TaskSupervisor и отбрасывает апдейты во время остановки."""
+    def __init__(self, task_supervisor: TaskSupervisor):
+        self.task_supervisor = task_supervisor
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not self.task_supervisor.accepting:
+            return # Бот останавливается, новые апдейты не берем
+        with self.task_supervisor.track_current(f"update {getattr(event, 'update_id', '?')} ({getattr(event, 'event_type', '?')})"):
+            return await handler(event, data)
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внутренняя мидлварь: время обработки апдейта с разбивкой по хэндлерам."""
+    def __init__(self, event_name: str):
+        self.event_name = event_name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        handler_name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        annotate(handler=handler_name)
+        with UPDATE_SECONDS.time(handler=handler_name, event=self.event_name):
+            return await handler(event, data)
 
 class AccessControlMiddleware(BaseMiddleware):
     def __init__(self, user_service: UserService): # Changed constructor
@@ -61,7 +97,7 @@ class AccessControlMiddleware(BaseMiddleware):
         # 4. Передаем полезные данные в хэндлер
         data['user_level'] = user_level
         data['limit'] = limit
-        # data['db'] is not passed from here; handlers should use bot['db']
+        # data['db'] is not passed from here; handlers get it from the dispatcher (dp["db"])
         # data['user_service'] can be passed if needed: data['user_service'] = self.user_service
 
         return await handler(event, data)
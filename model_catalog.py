@@ -0,0 +1,203 @@
+# model_catalog.py
+"""
+Каталог моделей: индекс "модель -> уровень подписки", "уровень -> категории -> модели"
+и метаданные моделей (контекстное окно, таймаут, поддержка картинок).
+
+Индексы строятся один раз при загрузке, хэндлеры и клавиатуры только читают готовые списки.
+Источник - config.py или файл MODEL_CATALOG_PATH (JSON или YAML). Файл можно перечитать
+без перезапуска (SIGHUP или /reload_models), при каждой перезагрузке растет version.
+
+Формат файла:
+    {
+      "tiers": [{"level": 0, "key": "free", "name": "Free", "price": 0, "description": "..."}, ...],
+      "models": [{"name": "gpt-4.1", "category": "🤖 OpenAI", "tier": "free",
+                  "context_window": 128000, "timeout": 120, "vision": true}, ...]
+    }
+"tiers" можно не указывать - тогда берутся из config.SUBSCRIPTION_MODELS. "tier" модели -
+ключ или номер уровня, начиная с которого она доступна.
+
+Кнопки выбора модели и категории несут не имя, а короткий код "m:<token>:<индекс>".
+token - хэш состава каталога: он одинаков у всех воркеров и после перезапуска, а после
+изменения каталога старые кнопки распознаются по таблицам нескольких прошлых версий.
+"""
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+import config
+
+try:
+    import yaml
+except ImportError: # PyYAML нужен только для каталога в формате YAML
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_CALLBACK_PREFIX = "m"
+CATEGORY_CALLBACK_PREFIX = "c"
+KEEP_CALLBACK_TABLES = 5 # Сколько прошлых версий каталога понимают старые кнопки
+# Длина token в hex-символах: 32 бита, чтобы случайное совпадение хэшей разных каталогов было маловероятным.
+# "m:<8 символов>:<индекс>" остается далеко в пределах 64 байт callback_data
+CALLBACK_TOKEN_LENGTH = 8
+
+class ModelInfo:
+    __slots__ = ("name", "category", "tier", "context_window", "timeout", "vision")
+
+    def __init__(self, name: str, category: str, tier: int, context_window: int, timeout: float, vision: bool):
+        self.name = name
+        self.category = category
+        self.tier = tier # Минимальный уровень подписки
+        self.context_window = context_window
+        self.timeout = timeout
+        self.vision = vision
+
+def _source_from_config() -> dict:
+    tiers = [
+        {"level": info["level"], "key": key, "name": info["name"], "price": info["price"], "description": info["description"]}
+        for key, info in config.SUBSCRIPTION_MODELS.items()
+    ]
+    models = []
+    for category, names in config.ALL_MODELS.items():
+        for name in names:
+            levels = [info["level"] for info in config.SUBSCRIPTION_MODELS.values() if name in info["models"]]
+            if not levels:
+                logger.warning("Модель %s не входит ни в одну подписку и пропущена", name)
+                continue
+            models.append({"name": name, "category": category, "tier": min(levels), **config.MODEL_METADATA.get(name, {})})
+    return {"tiers": tiers, "models": models}
+
+class ModelCatalog:
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.version = 0
+        self.token = ""
+        # token -> {префикс: список имен по индексу} для декодирования кнопок
+        self._callback_tables: OrderedDict[str, dict[str, list[str]]] = OrderedDict()
+        self.reload()
+
+    def _load_source(self) -> dict:
+        if not self.path:
+            return _source_from_config()
+        with open(self.path, encoding="utf-8") as f:
+            if self.path.endswith((".yaml", ".yml")):
+                if yaml is None:
+                    raise RuntimeError("Для каталога в YAML нужен пакет PyYAML")
+                source = yaml.safe_load(f)
+            else:
+                source = json.load(f)
+        source.setdefault("tiers", _source_from_config()["tiers"])
+        return source
+
+    def reload(self) -> int:
+        """Перечитывает источник и атомарно подменяет индексы. При ошибке старый каталог остается в силе."""
+        source = self._load_source()
+
+        tiers = {int(t["level"]): dict(t) for t in source["tiers"]}
+        levels_by_key = {t.get("key"): level for level, t in tiers.items()}
+        models: dict[str, ModelInfo] = {}
+        for item in source["models"]:
+            tier = item.get("tier", 0)
+            tier = levels_by_key[tier] if isinstance(tier, str) else int(tier)
+            models[item["name"]] = ModelInfo(
+                name=item["name"],
+                category=item["category"],
+                tier=tier,
+                context_window=int(item.get("context_window", config.DEFAULT_MODEL_CONTEXT_WINDOW)),
+                timeout=float(item.get("timeout", config.DEFAULT_MODEL_TIMEOUT)),
+                vision=bool(item.get("vision", False)),
+            )
+
+        # Уровень -> категория -> модели, в порядке из источника
+        by_level: dict[int, dict[str, list[str]]] = {}
+        for level in sorted(tiers):
+            categories: dict[str, list[str]] = {}
+            for info in models.values():
+                if info.tier <= level:
+                    categories.setdefault(info.category, []).append(info.name)
+            by_level[level] = categories
+        for level, tier in tiers.items():
+            tier["models"] = [name for names in by_level[level].values() for name in names]
+
+        model_names = list(models)
+        category_names = list(dict.fromkeys(info.category for info in models.values()))
+        token = hashlib.sha1("\n".join(model_names + ["#"] + category_names).encode()).hexdigest()[:CALLBACK_TOKEN_LENGTH]
+        model_callbacks = {name: f"{MODEL_CALLBACK_PREFIX}:{token}:{i}" for i, name in enumerate(model_names)}
+        category_callbacks = {name: f"{CATEGORY_CALLBACK_PREFIX}:{token}:{i}" for i, name in enumerate(category_names)}
+
+        self._tiers = tiers
+        self._models = models
+        self._by_level = by_level
+        self._model_callbacks = model_callbacks
+        self._category_callbacks = category_callbacks
+        self._callback_tables[token] = {MODEL_CALLBACK_PREFIX: model_names, CATEGORY_CALLBACK_PREFIX: category_names}
+        self._callback_tables.move_to_end(token)
+        while len(self._callback_tables) > KEEP_CALLBACK_TABLES:
+            self._callback_tables.popitem(last=False)
+        self.token = token
+        self.version += 1
+        logger.info("Каталог моделей загружен (версия %s): %s моделей", self.version, len(models))
+        return len(models)
+
+    def _effective_level(self, level: int) -> int:
+        # Админы (уровень выше максимального) видят все, неизвестный уровень считаем минимальным
+        suitable = [tier_level for tier_level in self._by_level if tier_level <= level]
+        return max(suitable) if suitable else min(self._by_level)
+
+    def get(self, model: str) -> ModelInfo | None:
+        return self._models.get(model)
+
+    def all_models(self) -> list[str]:
+        return list(self._models)
+
+    def categories_for(self, level: int) -> list[str]:
+        return list(self._by_level[self._effective_level(level)])
+
+    def models_for(self, level: int, category: str) -> list[str]:
+        return self._by_level[self._effective_level(level)].get(category, [])
+
+    def models_by_category(self, level: int) -> dict[str, list[str]]:
+        return self._by_level[self._effective_level(level)]
+
+    def is_available(self, model: str, level: int) -> bool:
+        info = self._models.get(model)
+        return info is not None and info.tier <= level
+
+    def tier(self, level: int) -> dict:
+        return self._tiers[self._effective_level(level)]
+
+    def has_tier(self, level: int) -> bool:
+        return level in self._tiers
+
+    def tiers(self) -> list[dict]:
+        return [self._tiers[level] for level in sorted(self._tiers)]
+
+    def paid_tiers(self) -> list[dict]:
+        return [tier for tier in self.tiers() if tier["price"] > 0]
+
+    def model_callback(self, model: str) -> str:
+        return self._model_callbacks[model]
+
+    def category_callback(self, category: str) -> str:
+        return self._category_callbacks[category]
+
+    def decode_callback(self, prefix: str, data: str) -> str | None:
+        """Имя модели/категории по коду кнопки или None, если кнопка от неизвестной версии каталога."""
+        parts = data.split(":")
+        if len(parts) != 3 or parts[0] != prefix or not parts[2].isdigit():
+            return None
+        table = self._callback_tables.get(parts[1])
+        if table is None:
+            return None
+        names = table[prefix]
+        index = int(parts[2])
+        return names[index] if index < len(names) else None
+
+def reload_catalog(catalog: ModelCatalog) -> str:
+    """Перезагрузка для SIGHUP и админской команды. Возвращает текст для лога/ответа."""
+    try:
+        count = catalog.reload()
+    except Exception as e:
+        logger.exception("Не удалось перезагрузить каталог моделей")
+        return f"Ошибка перезагрузки каталога, оставлена версия {catalog.version}: {e}"
+    return f"Каталог моделей перезагружен: версия {catalog.version}, моделей {count}."
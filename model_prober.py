@@ -0,0 +1,153 @@
+# model_prober.py
+"""
+Фоновая проверка доступности моделей. Периодически пингует все модели из каталога
+(и IMAGE_MODEL, если MODEL_PROBE_IMAGE) с ограничением параллельности и таймаутом, ведет
+скользящее среднее (EWMA) задержки и обновляет MODEL_STATUS_CACHE с гистерезисом, чтобы
+статус не "мигал".
+
+При нескольких процессах-воркерах проверяет только один (leader) и сохраняет статусы в БД,
+остальные раз в MODEL_STATUS_SYNC_INTERVAL читают их оттуда - запросы к провайдеру не
+умножаются на число процессов, а кэш статусов у всех одинаковый.
+"""
+import asyncio
+import logging
+import time
+
+import config
+from api_service import APIService
+from database import Database
+from model_catalog import ModelCatalog
+
+logger = logging.getLogger(__name__)
+
+def classify_error(error: str | None) -> str:
+    """Короткий статус для отчета по тексту ошибки APIService."""
+    if not error:
+        return 'Unknown Error'
+    lowered = error.lower()
+    if "timed out" in lowered or "timeout" in lowered:
+        return 'Timeout'
+    if error.startswith("Error: ") and " - " in error:
+        status_code_str = error.split(" ")[1]
+        if status_code_str.isdigit():
+            return f'Error {status_code_str}'
+    if "invalid json" in lowered:
+        return 'Invalid JSON'
+    if "connection" in lowered:
+        return 'Connection Error'
+    return f'Error: {error[:50]}'
+
+async def probe_model(api_service: APIService, model: str, timeout: float) -> dict:
+    """Один пробный запрос к модели. Возвращает {'model', 'status', 'latency'}; status == 'OK' при успехе."""
+    start = time.monotonic()
+    try:
+        if model == config.IMAGE_MODEL:
+            result, error = await asyncio.wait_for(api_service.generate_image(model=model, prompt="Test"), timeout)
+        else:
+            result, error = await asyncio.wait_for(
+                api_service.chat_completion(model=model, messages=[{'role': 'user', 'content': 'Test'}], temperature=0.7, max_tokens=10),
+                timeout
+            )
+    except asyncio.TimeoutError:
+        return {'model': model, 'status': 'Timeout', 'latency': time.monotonic() - start}
+    latency = time.monotonic() - start
+    if result and not error:
+        return {'model': model, 'status': 'OK', 'latency': latency}
+    return {'model': model, 'status': classify_error(error), 'latency': latency}
+
+class ModelProber:
+    def __init__(self, api_service: APIService, status_cache: dict, catalog: ModelCatalog, db: Database | None = None,
+                 leader: bool = True, interval: float = config.MODEL_PROBE_INTERVAL,
+                 concurrency: int = config.MODEL_PROBE_CONCURRENCY, timeout: float = config.MODEL_PROBE_TIMEOUT):
+        self.api_service = api_service
+        self.status_cache = status_cache # Общий MODEL_STATUS_CACHE: модель -> доступна ли
+        self.catalog = catalog
+        self.db = db
+        self.leader = leader # Проверяет модели сам; иначе только читает статусы из БД
+        self.interval = interval
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.latency: dict[str, float] = {} # EWMA задержки успешных ответов, сек.
+        self.last_status: dict[str, str] = {}
+        self._streaks: dict[str, int] = {} # >0 - подряд успехов, <0 - подряд ошибок
+        self._cycle = 0
+        self._task: asyncio.Task | None = None
+
+    def models(self, include_image: bool = True) -> list[str]:
+        models = sorted(self.catalog.all_models())
+        if include_image and config.IMAGE_MODEL:
+            models.append(config.IMAGE_MODEL)
+        return models
+
+    def record(self, result: dict):
+        """Учитывает результат проверки (в том числе ручной из админки)."""
+        model, ok = result['model'], result['status'] == 'OK'
+        self.last_status[model] = result['status']
+        if ok:
+            previous = self.latency.get(model)
+            alpha = config.MODEL_LATENCY_EWMA_ALPHA
+            self.latency[model] = result['latency'] if previous is None else alpha * result['latency'] + (1 - alpha) * previous
+
+        streak = self._streaks.get(model, 0)
+        streak = max(streak, 0) + 1 if ok else min(streak, 0) - 1
+        self._streaks[model] = streak
+
+        current = self.status_cache.get(model)
+        if current is None:
+            self.status_cache[model] = ok # Первое наблюдение принимаем сразу
+        elif current and streak <= -config.MODEL_PROBE_FAILS_TO_DISABLE:
+            self.status_cache[model] = False
+            logger.warning("Модель %s помечена недоступной: %s", model, result['status'])
+        elif not current and streak >= config.MODEL_PROBE_OKS_TO_ENABLE:
+            self.status_cache[model] = True
+            logger.info("Модель %s снова доступна", model)
+
+    async def run_once(self) -> list[dict]:
+        # Генерация картинок платная: image-модель проверяется только если включено, и не на каждом цикле
+        include_image = config.MODEL_PROBE_IMAGE and self._cycle % max(1, config.MODEL_PROBE_IMAGE_EVERY) == 0
+        self._cycle += 1
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(model: str) -> dict:
+            async with semaphore:
+                result = await probe_model(self.api_service, model, self.timeout)
+            self.record(result)
+            return result
+
+        results = await asyncio.gather(*(bounded(model) for model in self.models(include_image)))
+        if self.db:
+            await self.db.save_model_statuses([
+                (model, available, self.last_status.get(model), self.latency.get(model))
+                for model, available in self.status_cache.items()
+            ])
+        return results
+
+    async def sync(self):
+        """Статусы, сохраненные проверяющим процессом."""
+        for model, available, status, latency in await self.db.get_model_statuses():
+            self.status_cache[model] = bool(available)
+            if status:
+                self.last_status[model] = status
+            if latency is not None:
+                self.latency[model] = latency
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await (self.run_once() if self.leader else self.sync())
+            except Exception:
+                logger.exception("Ошибка фоновой проверки моделей")
+            await asyncio.sleep(self.interval if self.leader else min(self.interval, config.MODEL_STATUS_SYNC_INTERVAL))
+
+    def start(self):
+        if self.interval > 0 and self._task is None and (self.leader or self.db):
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,256 @@
+# sharding.py
+"""
+Режим супервизора: один процесс получает апдейты через long polling и раздает их
+N процессам-воркерам. Шард выбирается по user_id, поэтому все апдейты одного
+пользователя обрабатываются одним воркером по порядку и его FSM-состояние
+(MemoryStorage) живет в одном процессе. Сообщения из групп распределяются по id чата,
+чтобы состояние группы (цепочки ответов) было в одном воркере; порядок внутри
+воркера по-прежнему соблюдается по пользователю. Хэндлер с долгой работой (генерация
+ответа) отпускает очередь пользователя через release_update_order(), чтобы меню и
+кнопки не ждали конца генерации.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from contextlib import suppress
+from contextvars import ContextVar
+from typing import Awaitable, Callable
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Ключи апдейта, в которых Telegram передает объект с полем 'from'
+_USER_UPDATE_KEYS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'my_chat_member', 'chat_member', 'chat_join_request',
+)
+
+def extract_shard_key(update: dict) -> int:
+    """Возвращает user_id автора апдейта, а если его нет - id чата (или 0)."""
+    for key in _USER_UPDATE_KEYS:
+        obj = update.get(key)
+        if not obj:
+            continue
+        user = obj.get('from')
+        if user:
+            return user['id']
+        chat = obj.get('chat')
+        if chat:
+            return chat['id']
+    for key in ('channel_post', 'edited_channel_post'):
+        obj = update.get(key)
+        if obj:
+            return obj['chat']['id']
+    return 0
+
+def extract_route_key(update: dict) -> int:
+    """Ключ выбора воркера: id чата для сообщений из групп, иначе тот же ключ, что у extract_shard_key."""
+    message = update.get('message') or update.get('edited_message')
+    if message and message.get('chat', {}).get('type') in ('group', 'supergroup'):
+        return message['chat']['id']
+    return extract_shard_key(update)
+
+def shard_for(key: int, workers: int) -> int:
+    return abs(key) % workers
+
+_release_order: ContextVar[Callable[[], None] | None] = ContextVar("release_order", default=None)
+
+def release_update_order():
+    """
+    Разрешает следующим апдейтам того же пользователя начать обработку, пока текущий
+    продолжает работу. Вызывать после того, как хэндлер записал все нужное в FSM.
+    Вне воркера (обычный polling) ничего не делает.
+    """
+    release = _release_order.get()
+    if release is not None:
+        release()
+
+
+class UpdateOrder:
+    """
+    Апдейты с одним ключом (пользователем) выполняются по очереди, с разными - параллельно.
+    asyncio.Lock отдает владение в порядке ожидания, поэтому порядок прихода сохраняется.
+    """
+    def __init__(self):
+        self._locks: dict[int, list] = {} # ключ -> [lock, число ожидающих апдейтов]
+
+    async def run(self, key: int, handle: Callable[[], Awaitable]):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        lock = entry[0]
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                lock.release()
+
+        try:
+            await lock.acquire()
+            token = _release_order.set(release)
+            try:
+                return await handle()
+            finally:
+                _release_order.reset(token)
+                release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+# --- Воркер ---
+
+async def _worker_loop(index: int, queue: multiprocessing.Queue):
+    from bot import create_bot, create_dispatcher # Импорт внутри процесса-воркера
+
+    bot = create_bot()
+    dp = create_dispatcher(worker_index=index)
+    if config.METRICS_PORT:
+        dp["metrics_port"] = config.METRICS_PORT + index + 1
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    loop = asyncio.get_running_loop()
+    order = UpdateOrder()
+    tasks: set[asyncio.Task] = set()
+
+    async def process(key: int, update: dict):
+        try:
+            await order.run(key, lambda: dp.feed_raw_update(bot, update))
+        except Exception:
+            logger.exception("Воркер %s: ошибка обработки апдейта %s", index, update.get('update_id'))
+
+    logger.info("Воркер %s запущен", index)
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None: # Сигнал остановки от супервизора
+                break
+            key, update = item
+            task = asyncio.create_task(process(key, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        # Начатые апдейты и фоновые задачи дожидается on_shutdown (TaskSupervisor.drain) в пределах
+        # SHUTDOWN_DRAIN_TIMEOUT; апдейты, еще ждущие своей очереди, после этого уже не принимаются
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await bot.session.close()
+        logger.info("Воркер %s остановлен", index)
+
+def _worker_main(index: int, queue: multiprocessing.Queue):
+    logging.basicConfig(level=logging.INFO)
+    # Остановкой управляет супервизор через очередь, сигналы терминала игнорируем
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN) # До on_startup, где ставится обработчик перезагрузки каталога
+    asyncio.run(_worker_loop(index, queue))
+
+
+# --- Супервизор ---
+
+class WorkerPool:
+    def __init__(self, workers: int):
+        self._ctx = multiprocessing.get_context('spawn')
+        self.queues = [self._ctx.Queue() for _ in range(workers)]
+        self.processes: list[multiprocessing.Process | None] = [None] * workers
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=_worker_main, args=(index, self.queues[index]), name=f"bot-worker-{index}")
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._spawn(index)
+
+    def restart_dead(self):
+        """Перезапускает упавших воркеров. Их очередь сохраняется, так что апдейты не теряются."""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.warning("Воркер %s завершился с кодом %s, перезапускаю", index, process.exitcode)
+                self._spawn(index)
+
+    def broadcast_signal(self, sig: int):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, sig)
+
+    def dispatch(self, update: dict):
+        key = extract_shard_key(update)
+        self.queues[shard_for(extract_route_key(update), len(self.queues))].put((key, update))
+
+    def stop(self, timeout: float):
+        """Останавливает воркеров; timeout - общий срок для всех, они останавливаются параллельно."""
+        for queue in self.queues:
+            queue.put(None)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Воркер %s не завершился за %s сек., принудительная остановка", index, timeout)
+                process.terminate()
+                process.join()
+
+async def run_supervisor(workers: int, polling_timeout: int = 10):
+    from bot import create_bot, prepare_bot
+
+    bot = create_bot()
+    await prepare_bot(bot)
+
+    pool = WorkerPool(workers)
+    pool.start()
+    logger.info("Супервизор запущен, воркеров: %s", workers)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+    if hasattr(signal, "SIGHUP"):
+        # Перезагрузку каталога моделей пересылаем всем воркерам
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(signal.SIGHUP, pool.broadcast_signal, signal.SIGHUP)
+
+    offset = None
+    try:
+        while not stop_event.is_set():
+            pool.restart_dead()
+            poll = asyncio.create_task(bot.get_updates(offset=offset, timeout=polling_timeout))
+            stopper = asyncio.create_task(stop_event.wait())
+            done, _ = await asyncio.wait({poll, stopper}, return_when=asyncio.FIRST_COMPLETED)
+            if poll not in done:
+                poll.cancel()
+                with suppress(asyncio.CancelledError):
+                    await poll
+                break
+            stopper.cancel()
+            try:
+                updates = poll.result()
+            except Exception as e:
+                logger.error("Ошибка получения апдейтов: %s", e)
+                await asyncio.sleep(config.WORKER_RESTART_DELAY)
+                continue
+            for update in updates:
+                pool.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+    finally:
+        # Подтверждаем последний offset, чтобы после рестарта не получить те же апдейты повторно
+        if offset is not None:
+            with suppress(Exception):
+                await bot.get_updates(offset=offset, timeout=0, limit=1)
+        # Воркер тратит на остановку до SHUTDOWN_DRAIN_TIMEOUT плюс закрытие сессий и flush-хуки
+        await loop.run_in_executor(None, pool.stop, config.SHUTDOWN_DRAIN_TIMEOUT + config.WORKER_SHUTDOWN_MARGIN)
+        await bot.session.close()
+        logger.info("Супервизор остановлен")
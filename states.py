@@ -9,6 +9,7 @@ class AdminActions(StatesGroup):
     waiting_for_broadcast_confirmation = State()
     waiting_for_search_user = State()
     waiting_for_revoke_user = State() # <<< НОВОЕ СОСТОЯНИЕ
+    waiting_for_bulk_subscriptions = State()
 
 class ImageGeneration(StatesGroup):
     waiting_for_prompt = State()
@@ -0,0 +1,92 @@
+# task_supervisor.py
+"""
+Учет фоновых задач и апдейтов в обработке, чтобы при остановке бота дождаться их
+завершения (с ограничением по времени), а не обрывать на середине.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Coroutine
+
+logger = logging.getLogger(__name__)
+
+class TaskSupervisor:
+    def __init__(self):
+        self._tasks: dict[asyncio.Task, str] = {} # Фоновые задачи: задача -> описание
+        self._in_flight: dict[asyncio.Task, str] = {} # Апдейты в обработке
+        self._flush_hooks: list[tuple[str, Callable[[], Awaitable[None]]]] = []
+        self.accepting = True
+
+    @property
+    def background_count(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    def spawn(self, coro: Coroutine, name: str) -> asyncio.Task:
+        """Замена asyncio.create_task: задача попадет в отчет и будет дождана при остановке."""
+        if not self.accepting:
+            logger.warning("Фоновая задача '%s' запущена во время остановки", name)
+        task = asyncio.create_task(coro)
+        self._tasks[task] = name
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task: asyncio.Task):
+        name = self._tasks.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Фоновая задача '%s' завершилась с ошибкой", name, exc_info=task.exception())
+
+    @contextmanager
+    def track_current(self, name: str):
+        """Помечает текущую задачу (обработку апдейта) как выполняющуюся."""
+        task = asyncio.current_task()
+        self._in_flight[task] = name
+        try:
+            yield
+        finally:
+            self._in_flight.pop(task, None)
+
+    def add_flush_hook(self, name: str, hook: Callable[[], Awaitable[None]]):
+        """Регистрирует корутину, сбрасывающую буферы (например, отложенные записи в БД) при остановке."""
+        self._flush_hooks.append((name, hook))
+
+    async def drain(self, timeout: float) -> list[str]:
+        """
+        Прекращает прием новых апдейтов, ждет не дольше timeout секунд завершения
+        обработки и фоновых задач, отменяет оставшиеся и вызывает flush-хуки.
+        Возвращает описания брошенных задач.
+        """
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        pending = set(self._in_flight) | set(self._tasks)
+        logger.info("Остановка: в обработке %s апдейтов, фоновых задач %s", len(self._in_flight), len(self._tasks))
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.wait(pending, timeout=remaining)
+            # Пока ждали, обработчики могли запустить новые фоновые задачи
+            pending = {t for t in set(self._in_flight) | set(self._tasks) if not t.done()}
+
+        abandoned = [self._in_flight.get(t) or self._tasks.get(t, "unknown") for t in pending]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending, timeout=1)
+
+        for name, hook in self._flush_hooks:
+            try:
+                await hook()
+            except Exception:
+                logger.exception("Ошибка flush-хука '%s'", name)
+
+        if abandoned:
+            logger.warning("Остановка: прервано задач - %s: %s", len(abandoned), ", ".join(abandoned))
+        else:
+            logger.info("Остановка: все задачи завершены")
+        return abandoned
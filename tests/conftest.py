@@ -0,0 +1,6 @@
+import os
+import sys
+
+# config.py требует ADMIN_IDS при импорте
+os.environ.setdefault('ADMIN_IDS', '1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,51 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import SendMessage
+
+import admin_handlers
+from bulk_subscriptions import BulkRow, apply_bulk_subscriptions
+from database import Database
+
+
+async def _database(tmp_path) -> Database:
+    db = Database(str(tmp_path / 'bot.db'))
+    await db.init_db()
+    for user_id, username in ((10, 'free'), (11, 'paid'), (12, 'expired')):
+        await db.add_user(user_id, username)
+    await db.update_subscription(11, 2, None)
+    await db.update_subscription(12, 1, 30)
+    await db._execute('UPDATE users SET subscription_end = ? WHERE user_id = 12', (datetime.now() - timedelta(days=1),))
+    return db
+
+
+def test_notices_use_stored_end_and_skip_free_users(tmp_path):
+    async def scenario():
+        db = await _database(tmp_path)
+        rows = [BulkRow(1, 10, 0, None), BulkRow(2, 'paid', 0, None), BulkRow(3, 12, 0, None), BulkRow(4, 10, 1, 30)]
+        result = await apply_bulk_subscriptions(db, rows)
+        return db, result
+
+    db, result = asyncio.run(scenario())
+    # Повтор для 10 переносится в конец; снятие у 12 с истекшей подпиской не уведомляется
+    assert [(user_id, level) for user_id, level, _ in result.notices] == [(11, 0), (10, 1)]
+    stored = asyncio.run(db._fetchone('SELECT subscription_end FROM users WHERE user_id = 10'))[0]
+    assert result.notices[1][2] == datetime.fromisoformat(stored)
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id == 13:
+            raise TelegramNetworkError(SendMessage(chat_id=chat_id, text=text), 'timeout')
+        self.sent.append((chat_id, text))
+
+
+def test_notify_counts_api_errors_and_reports():
+    bot = _Bot()
+    asyncio.run(admin_handlers.notify_subscription_changes(bot, [(13, 1, None), (14, 2, None)], initiator_id=1))
+    assert [chat_id for chat_id, _ in bot.sent] == [14, 1]
+    assert 'доставлено 1, не доставлено 1' in bot.sent[-1][1]
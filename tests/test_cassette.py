@@ -0,0 +1,41 @@
+import asyncio
+import gzip
+import logging
+
+from cassette import Cassette
+
+
+def test_records_are_buffered_and_flushed_in_batches(tmp_path):
+    path = str(tmp_path / 'cassette.jsonl.gz')
+
+    async def scenario():
+        cassette = Cassette(path, 'record', flush_every=2)
+        for i in range(3):
+            await cassette.record('chat/completions', {'model': 'm', 'n': i}, 200, f'body {i}', 0.1)
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            flushed = len(f.readlines())
+        await cassette.close()
+        return flushed
+
+    assert asyncio.run(scenario()) == 2
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        assert len(f.readlines()) == 3
+
+    replay = Cassette(path, 'replay', speed=0)
+    assert asyncio.run(replay.replay('chat/completions', {'model': 'm', 'n': 2})) == (200, 'body 2')
+
+
+def test_model_match_logs_fallback_to_other_models(tmp_path, caplog):
+    path = str(tmp_path / 'cassette.jsonl.gz')
+
+    async def record():
+        cassette = Cassette(path, 'record')
+        await cassette.record('chat/completions', {'model': 'a'}, 200, 'from a', 0.1)
+        await cassette.close()
+
+    asyncio.run(record())
+    replay = Cassette(path, 'replay', speed=0, match='model')
+    with caplog.at_level(logging.WARNING, logger='cassette'):
+        for _ in range(2):
+            assert asyncio.run(replay.replay('chat/completions', {'model': 'b', 'x': 1})) == (200, 'from a')
+    assert len([r for r in caplog.records if 'для модели b' in r.getMessage()]) == 1
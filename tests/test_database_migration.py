@@ -0,0 +1,30 @@
+import asyncio
+import sqlite3
+
+from database import Database
+
+
+def test_init_db_upgrades_legacy_users_table(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    # Схема users до колонок модели, настроек и даты регистрации
+    with sqlite3.connect(path) as conn:
+        conn.execute('''
+            CREATE TABLE users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                subscription_level INTEGER NOT NULL DEFAULT 0,
+                subscription_end TIMESTAMP,
+                is_blocked INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'old_user')")
+
+    async def scenario():
+        db = Database(path)
+        await db.init_db()
+        await db.init_db() # Повторный запуск на уже обновленной базе
+        return await db._fetchone('SELECT created_at, temperature FROM users WHERE user_id = 1'), await db.get_user_count()
+
+    (created_at, temperature), count = asyncio.run(scenario())
+    assert created_at is not None and temperature is None
+    assert count == 1
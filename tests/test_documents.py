@@ -0,0 +1,26 @@
+import pytest
+
+from documents import DocumentNotText, IncrementalTextDecoder
+
+
+def _decode(*chunks: bytes) -> str:
+    decoder = IncrementalTextDecoder()
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder.finish()
+
+
+def test_utf8_split_inside_a_character():
+    data = '﻿Привет, мир'.encode('utf-8')
+    assert _decode(data[:4], data[4:9], data[9:]) == 'Привет, мир'
+
+
+def test_falls_back_to_cp1251():
+    data = 'Отчет за квартал'.encode('cp1251')
+    assert _decode(data[:5], data[5:]) == 'Отчет за квартал'
+
+
+def test_binary_rejected_on_first_chunk():
+    decoder = IncrementalTextDecoder()
+    with pytest.raises(DocumentNotText):
+        decoder.feed(b'PK\x03\x04\x00\x00')
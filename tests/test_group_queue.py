@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import config
+import utils
+from group_queue import GroupRequestQueue, dedup_key, message_link
+from task_supervisor import TaskSupervisor
+
+CHAT_ID = -1001234567890
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_parameters=None, **kwargs):
+        self.sent.append((text, reply_parameters.message_id if reply_parameters else None))
+        return _Message(self)
+
+
+class _Message:
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def edit_text(self, text):
+        pass
+
+    async def delete(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fast_sends(monkeypatch):
+    monkeypatch.setattr(utils, 'send_limiter', utils.SendRateLimiter(0, 0, 0))
+    monkeypatch.setattr(config, 'GROUP_STATUS_INTERVAL', 0.01)
+
+
+def test_message_link():
+    assert message_link(CHAT_ID, 42) == 'https://t.me/c/1234567890/42'
+    assert message_link(-4242, 42) is None
+
+
+def test_merged_and_repeated_questions_get_one_link_per_round():
+    async def scenario():
+        bot = _Bot()
+        supervisor = TaskSupervisor()
+        queue = GroupRequestQueue(supervisor, dedup_window=60)
+        key = dedup_key('model', 'Вопрос', None)
+        release = asyncio.Event()
+
+        async def generate():
+            await release.wait()
+            return 500
+
+        statuses = [queue.submit(bot, CHAT_ID, 10, 100, key, generate)]
+        statuses += [queue.submit(bot, CHAT_ID, user_id, 100 + user_id, key, generate) for user_id in (1, 2)]
+        release.set()
+        await asyncio.sleep(0.05)
+        statuses.append(queue.submit(bot, CHAT_ID, 3, 103, key, generate))
+        await supervisor.drain(1)
+        return bot, statuses
+
+    bot, statuses = asyncio.run(scenario())
+    assert statuses == ['queued', 'merged', 'merged', 'answered']
+    pointers = [(text, reply_to) for text, reply_to in bot.sent if text.startswith('☝️')]
+    # Два присоединившихся повтора - одно сообщение в ответ на последний из них, затем ссылка для позднего повтора
+    assert pointers[0][1] == 102 and 'Повторов: 2' in pointers[0][0]
+    assert pointers[1][1] == 103 and 'https://t.me/c/1234567890/500' in pointers[1][0]
+    assert len(pointers) == 2
@@ -0,0 +1,24 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from database import Database
+
+
+def test_image_cache_ttl_and_row_limit(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / 'bot.db'), image_cache_ttl=3600, image_cache_max_rows=2)
+        await db.init_db()
+        for i in range(3):
+            await db.save_cached_image('m', f'h{i}', '1024x1024', f'file{i}')
+        await db._execute("UPDATE image_cache SET created_at = ? WHERE prompt_hash = 'h2'", (datetime.now() - timedelta(hours=2),))
+        expired = await db.get_cached_image('m', 'h2', '1024x1024')
+        removed = await db.cleanup_image_cache()
+        await db.save_cached_image('m', 'h3', '1024x1024', 'file3')
+        overflow = await db.cleanup_image_cache() # Три свежие записи при пределе в две - уходит самая старая
+        rows = await db._fetchall('SELECT prompt_hash FROM image_cache ORDER BY prompt_hash')
+        return expired, removed, overflow, [row[0] for row in rows]
+
+    expired, removed, overflow, left = asyncio.run(scenario())
+    assert expired is None
+    assert (removed, overflow) == (1, 1)
+    assert left == ['h1', 'h3']
@@ -0,0 +1,33 @@
+import pytest
+
+from markdown_render import MarkdownRenderer, render_inline, render_markdown
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('**a _b** c_', '<b>a <i>b</i></b><i> c</i>'),
+    ('**b *i** x*', '<b>b <i>i</i></b><i> x</i>'),
+    ('call __init__ or __main__', 'call __init__ or __main__'),
+    ('__two words__ and _one_', '<b>two words</b> and <i>one</i>'),
+    ('snake_case_name', 'snake_case_name'),
+    ('`**code**` **bold**', '<code>**code**</code> <b>bold</b>'),
+])
+def test_inline(text, expected):
+    assert render_inline(text) == expected
+
+
+def test_fenced_code_inside_blockquote():
+    text = '> quote\n> ```py\n> x = 1 < 2\n> ```\n> after\nplain'
+    assert render_markdown(text) == (
+        '<blockquote>quote\n<pre><code class="language-py">x = 1 &lt; 2</code></pre>\nafter</blockquote>\nplain'
+    )
+
+
+def test_quote_ending_inside_code_closes_both():
+    assert render_markdown('> ```\n> code\nplain') == '<blockquote><pre><code>code</code></pre></blockquote>\nplain'
+
+
+def test_streaming_matches_whole_render():
+    text = '# Title\n> ```\n> a\n> ```\n- **item** _x_\n```\nb\n```\n'
+    renderer = MarkdownRenderer()
+    streamed = ''.join(renderer.feed(text[i:i + 3]) for i in range(0, len(text), 3)) + renderer.finish()
+    assert streamed == render_markdown(text)
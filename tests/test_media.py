@@ -0,0 +1,15 @@
+import asyncio
+
+import pytest
+
+import config
+import media
+from media import FileTooLarge, prepare_vision_image
+
+
+def test_image_over_pass_through_limit_reports_that_limit(monkeypatch):
+    monkeypatch.setattr(media, 'Image', None)
+    monkeypatch.setattr(config, 'VISION_MAX_IMAGE_BYTES', 16)
+    with pytest.raises(FileTooLarge) as error:
+        asyncio.run(prepare_vision_image(b'\xff\xd8\xff' + b'\0' * 32))
+    assert error.value.limit == 16
@@ -0,0 +1,16 @@
+import config
+from model_catalog import CALLBACK_TOKEN_LENGTH, CATEGORY_CALLBACK_PREFIX, MODEL_CALLBACK_PREFIX, ModelCatalog
+
+
+def test_callback_codes_round_trip_and_fit_telegram_limit():
+    catalog = ModelCatalog(config.MODEL_CATALOG_PATH)
+    assert len(catalog.token) == CALLBACK_TOKEN_LENGTH >= 8
+    for level in config.SUB_LEVEL_MAP:
+        for category in catalog.categories_for(level):
+            data = catalog.category_callback(category)
+            assert len(data.encode()) <= 64
+            assert catalog.decode_callback(CATEGORY_CALLBACK_PREFIX, data) == category
+            for model in catalog.models_for(level, category):
+                data = catalog.model_callback(model)
+                assert len(data.encode()) <= 64
+                assert catalog.decode_callback(MODEL_CALLBACK_PREFIX, data) == model
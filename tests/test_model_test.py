@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import admin_handlers
+
+ADMIN_ID = 1
+
+
+class _Message:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.edits.append(text)
+
+
+class _Db:
+    def __init__(self):
+        self.saved = None
+
+    async def add_model_test_results(self, results):
+        self.saved = results
+
+
+class _Prober:
+    def record(self, result):
+        pass
+
+
+class _Catalog:
+    def all_models(self):
+        return ['model-a', 'model-b']
+
+
+async def _start(monkeypatch):
+    probes = []
+
+    async def hanging_probe(api_service, model, timeout):
+        probes.append(asyncio.current_task())
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(admin_handlers, 'probe_model', hanging_probe)
+    monkeypatch.setattr(admin_handlers.config, 'IMAGE_MODEL', None)
+    msg, db = _Message(), _Db()
+    task = asyncio.create_task(admin_handlers.run_model_test(msg, ADMIN_ID, db, None, _Prober(), _Catalog()))
+    admin_handlers._model_test_runs[ADMIN_ID] = task
+    await asyncio.sleep(0.01)
+    return task, probes, msg, db
+
+
+def test_shutdown_cancel_propagates_and_awaits_probes(monkeypatch):
+    async def scenario():
+        task, probes, msg, db = await _start(monkeypatch)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return probes, msg, db
+
+    probes, msg, db = asyncio.run(scenario())
+    assert probes and all(probe.done() for probe in probes)
+    assert db.saved is None and msg.edits == []
+    assert ADMIN_ID not in admin_handlers._model_test_runs
+
+
+def test_admin_cancel_reports_partial_results(monkeypatch):
+    async def scenario():
+        task, probes, msg, db = await _start(monkeypatch)
+        admin_handlers._model_test_cancel_requests.add(ADMIN_ID)
+        task.cancel()
+        await task
+        return probes, msg, db
+
+    probes, msg, db = asyncio.run(scenario())
+    assert all(probe.done() for probe in probes)
+    assert db.saved == [] and 'Тестирование отменено' in msg.edits[-1]
+    assert ADMIN_ID not in admin_handlers._model_test_cancel_requests
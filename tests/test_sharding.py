@@ -0,0 +1,38 @@
+import asyncio
+
+from sharding import UpdateOrder, release_update_order
+
+
+def test_release_update_order_outside_worker_is_noop():
+    release_update_order()
+
+
+def test_updates_of_one_user_run_in_order_until_released():
+    async def scenario():
+        order = UpdateOrder()
+        log = []
+
+        async def generation(release: bool):
+            log.append('generation start')
+            if release:
+                release_update_order()
+            await asyncio.sleep(0.05)
+            log.append('generation end')
+
+        async def menu():
+            log.append('menu')
+
+        async def run(release: bool):
+            first = asyncio.create_task(order.run(1, lambda: generation(release)))
+            await asyncio.sleep(0)
+            await asyncio.gather(first, order.run(1, menu), order.run(2, menu))
+            result, log[:] = list(log), []
+            return result
+
+        return await run(False), await run(True), order._locks
+
+    held, released, locks = asyncio.run(scenario())
+    # Другой пользователь не ждет никогда, тот же - только пока генерация не отпустила очередь
+    assert held == ['generation start', 'menu', 'generation end', 'menu']
+    assert released == ['generation start', 'menu', 'menu', 'generation end']
+    assert locks == {}
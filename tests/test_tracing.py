@@ -0,0 +1,38 @@
+import asyncio
+
+import tracing
+from tracing import span, trace
+
+
+def test_spans_from_tasks_outliving_the_update_are_dropped():
+    async def background(started: asyncio.Event, release: asyncio.Event):
+        with span('db.before'):
+            started.set()
+        await release.wait()
+        with span('db.after') as late:
+            return late
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+        with trace('update') as root:
+            task = asyncio.create_task(background(started, release))
+            await started.wait()
+        release.set()
+        return root, await task
+
+    root, late = asyncio.run(scenario())
+    assert late is None
+    assert [child.name for child in root.children] == ['db.before']
+    assert root.span_count == 1
+
+
+def test_span_limit_is_per_root():
+    with trace('update') as root:
+        for _ in range(tracing.MAX_SPANS_PER_TRACE + 5):
+            with span('db.query'):
+                pass
+    assert root.count('db.') == tracing.MAX_SPANS_PER_TRACE
+    with trace('update') as other:
+        with span('db.query') as child:
+            assert child is not None
+    assert other.span_count == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from utils import _utf16_len, html_to_plain, split_html_message, split_plain_message
+
+
+@pytest.mark.parametrize('limit', [20, 21, 4096])
+def test_astral_characters_at_boundary(limit):
+    # После <b> остается одна единица UTF-16: эмодзи (две единицы) должен уйти в следующую часть
+    text = 'a' * (limit - 8) + '<b>😀😀</b> <pre>😀</pre>'
+    parts = split_html_message(text, limit=limit)
+    assert all(_utf16_len(part) <= limit for part in parts)
+    assert html_to_plain(''.join(parts)) == html_to_plain(text)
+
+
+def test_tags_are_reopened_and_balanced():
+    text = '<pre><code>' + 'line\n' * 30 + '</code></pre>'
+    parts = split_html_message(text, limit=40)
+    assert len(parts) > 1
+    for part in parts:
+        assert part.startswith('<pre><code>') and part.endswith('</code></pre>')
+        assert _utf16_len(part) <= 40
+
+
+def test_whitespace_at_cuts_is_kept():
+    text = ('word ' * 5 + '\n\n') * 10
+    parts = split_html_message(text, limit=32)
+    assert ''.join(parts) == text
+
+
+def test_plain_split_counts_utf16_units():
+    text = '😀' * 10 + '\n' + 'x😀' * 10
+    parts = split_plain_message(text, limit=5)
+    assert ''.join(parts) == text
+    assert all(_utf16_len(part) <= 5 for part in parts)
+
+
+def test_too_deep_nesting_raises():
+    with pytest.raises(ValueError):
+        split_html_message('<b><i><u>' + 'x' * 50 + '</u></i></b>', limit=12)
@@ -0,0 +1,151 @@
+# tracing.py
+"""
+Легковесная трассировка апдейтов. Внешняя мидлварь открывает корневой спан на апдейт,
+вызовы Database, APIService, UserService и Bot API записывают дочерние спаны.
+Если апдейт обрабатывался дольше порога, дерево спанов пишется в лог одной записью.
+"""
+import asyncio
+import functools
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+MAX_SPANS_PER_TRACE = 200 # Чтобы рассылка на тысячи сообщений не раздувала дерево
+
+class Span:
+    __slots__ = ("name", "start", "end", "children", "attrs", "root", "span_count")
+
+    def __init__(self, name: str, root: "Span | None" = None, **attrs):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        self.children: list[Span] = []
+        self.attrs = attrs
+        self.root = root or self
+        self.span_count = 0 # Для корня: сколько спанов записано в дерево
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def format_tree(self, indent: int = 0) -> list[str]:
+        attrs = " ".join(f"{k}={v}" for k, v in self.attrs.items())
+        lines = [f"{'  ' * indent}{self.name} {self.duration * 1000:.1f}ms{' ' + attrs if attrs else ''}"]
+        for child in self.children:
+            lines.extend(child.format_tree(indent + 1))
+        return lines
+
+    def count(self, prefix: str) -> int:
+        """Число вложенных спанов, имя которых начинается с prefix (например, 'db.')."""
+        return sum((child.name.startswith(prefix)) + child.count(prefix) for child in self.children)
+
+    def totals_by_kind(self) -> dict[str, float]:
+        """Суммарное время прямых и вложенных спанов по префиксу имени (db, api, tg, ...)."""
+        totals: dict[str, float] = {}
+        stack = list(self.children)
+        while stack:
+            span = stack.pop()
+            kind = span.name.split(".", 1)[0]
+            totals[kind] = totals.get(kind, 0.0) + span.duration
+            # Вложенные спаны того же вида не суммируем повторно
+            stack.extend(c for c in span.children if c.name.split(".", 1)[0] != kind)
+        return totals
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Дочерний спан текущего апдейта. Вне трассируемого апдейта ничего не делает.
+    Фоновые задачи наследуют контекст апдейта; после завершения корня их спаны не пишутся.
+    """
+    parent = _current_span.get()
+    if parent is None or parent.root.end is not None or parent.root.span_count >= MAX_SPANS_PER_TRACE:
+        yield None
+        return
+    root = parent.root
+    root.span_count += 1
+    child = Span(name, root=root, **attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+@contextmanager
+def trace(name: str, **attrs):
+    """Открывает корневой спан; все спаны, записанные внутри, попадут в его дерево."""
+    root = Span(name, **attrs)
+    token = _current_span.set(root)
+    try:
+        yield root
+    finally:
+        root.end = time.perf_counter()
+        _current_span.reset(token)
+
+def annotate(**attrs):
+    """Добавляет атрибуты корневому спану текущего апдейта (например, имя хэндлера)."""
+    current = _current_span.get()
+    if current is not None:
+        current.root.attrs.update(attrs)
+
+def trace_methods(prefix: str):
+    """Декоратор класса: каждый публичный корутин-метод пишет спан '<prefix>.<method>'."""
+    def decorator(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not asyncio.iscoroutinefunction(method):
+                continue
+
+            def wrap(func, span_name):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with span(span_name):
+                        return await func(*args, **kwargs)
+                return wrapper
+
+            setattr(cls, name, wrap(method, f"{prefix}.{name}"))
+        return cls
+    return decorator
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешняя мидлварь апдейтов: корневой спан, сэмплирование и лог медленных апдейтов."""
+    def __init__(self, slow_threshold: float, sample_rate: float = 1.0):
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if self.slow_threshold <= 0 or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return await handler(event, data)
+
+        with trace(f"update.{getattr(event, 'event_type', 'unknown')}", update_id=getattr(event, 'update_id', '?')) as root:
+            try:
+                return await handler(event, data)
+            finally:
+                root.end = time.perf_counter()
+                if root.duration >= self.slow_threshold:
+                    totals = " ".join(f"{kind}={value * 1000:.1f}ms" for kind, value in sorted(root.totals_by_kind().items()))
+                    logger.warning("Медленный апдейт (%s)\n%s", totals or "нет дочерних спанов", "\n".join(root.format_tree()))
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Мидлварь сессии бота: спан на каждый вызов Bot API."""
+    async def __call__(self, make_request, bot: Bot, method):
+        with span(f"tg.{type(method).__name__}"):
+            return await make_request(bot, method)
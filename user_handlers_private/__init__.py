@@ -12,7 +12,7 @@ user_private_router = Router(name="user_private") # Added a router name for clar
 # Apply global filters to this main router
 # These filters will apply to all messages and callback queries handled by routers included below.
 user_private_router.message.filter(F.chat.type == 'private')
-user_private_router.callback_query.filter(F.chat.type == 'private') # Ensuring callbacks also from private chat context
+user_private_router.callback_query.filter(F.message.chat.type == 'private') # У CallbackQuery нет .chat - чат берется из сообщения с кнопкой
 
 user_private_router.include_routers(
     chat_router,
@@ -6,7 +6,15 @@ from aiogram.fsm.context import FSMContext # Ensure this is imported
 
 import config # Ensure this is imported
 import keyboards as kb
+from api_service import APIService
+from database import Database
+from documents import DocumentNotText, document_budget, download_document_text, is_text_document, prepare_document
+from markdown_render import render_markdown
+from media import FileTooLarge, UnsupportedImage, download_file, pick_photo_size, prepare_vision_image
+from model_catalog import ModelCatalog
+from sharding import release_update_order
 from states import Chatting
+from user_service import UserService
 from utils import send_long_message
 # from api_helpers import prepare_api_payload # Removed this import
 
@@ -66,24 +74,41 @@ async def prepare_api_payload(
 # --- Обработчики выбора модели и чата ---
 
 @chat_router.callback_query(F.data == 'menu_models')
-async def models_categories_menu(callback: types.CallbackQuery, state: FSMContext, user_level: int):
+async def models_categories_menu(callback: types.CallbackQuery, state: FSMContext, user_level: int, model_catalog: ModelCatalog):
     await state.clear()
-    await callback.message.edit_text('Выберите категорию:', reply_markup=kb.get_models_categories_menu(user_level))
+    await callback.message.edit_text('Выберите категорию:', reply_markup=kb.get_models_categories_menu(model_catalog, user_level))
     await callback.answer()
 
-@chat_router.callback_query(F.data.startswith('cat_'))
-async def category_models_menu(callback: types.CallbackQuery, bot: Bot, user_level: int):
-    model_status_cache = bot["model_status_cache"]
-    category = callback.data.split('_', 1)[1]
+async def refresh_stale_menu(callback: types.CallbackQuery, model_catalog: ModelCatalog, user_level: int):
+    # Кнопка от версии каталога, которой уже нет: показываем актуальный список категорий
+    await callback.answer("Список моделей обновился, выберите заново.", show_alert=True)
+    await callback.message.edit_text('Выберите категорию:', reply_markup=kb.get_models_categories_menu(model_catalog, user_level))
+
+@chat_router.callback_query(kb.CATEGORY_BUTTON)
+async def category_models_menu(callback: types.CallbackQuery, user_level: int, model_status_cache: dict, model_latency: dict, model_catalog: ModelCatalog, catalog_item: str | None):
+    category = catalog_item
+    if category is None:
+        await refresh_stale_menu(callback, model_catalog, user_level)
+        return
+
     disabled_models = {model for model, status in model_status_cache.items() if not status}
-    await callback.message.edit_text(f'Модели {category}:', reply_markup=kb.get_category_models_menu(category, user_level, disabled_models))
+    text = f'Модели {category}:'
+    if model_latency:
+        text += '\n<i>Рядом с моделью - среднее время ответа по последним проверкам.</i>'
+    await callback.message.edit_text(text, reply_markup=kb.get_category_models_menu(model_catalog, category, user_level, disabled_models, model_latency))
     await callback.answer()
 
-@chat_router.callback_query(kb.ModelCallback.filter())
-async def select_model(callback: types.CallbackQuery, callback_data: kb.ModelCallback, state: FSMContext, bot: Bot):
-    model_status_cache = bot["model_status_cache"]
-    db = bot["db"]
-    model = callback_data.model_name
+@chat_router.callback_query(kb.MODEL_BUTTON)
+async def select_model(callback: types.CallbackQuery, state: FSMContext, db: Database, user_level: int, model_status_cache: dict, model_catalog: ModelCatalog, catalog_item: str | None):
+    model = catalog_item
+    if model is None:
+        await refresh_stale_menu(callback, model_catalog, user_level)
+        return
+
+    # Модель могла уйти из подписки после перезагрузки каталога
+    if not model_catalog.is_available(model, user_level):
+        await callback.answer("Эта модель больше недоступна для вашей подписки. Откройте список моделей заново.", show_alert=True)
+        return
 
     if model in model_status_cache and not model_status_cache[model]:
         await callback.answer("⚠️ Эта модель временно недоступна.", show_alert=True)
@@ -108,16 +133,15 @@ async def new_chat_callback(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.answer("Контекст диалога очищен. Можете задавать новый вопрос.")
 
 
-@chat_router.message(F.text, StateFilter(Chatting.in_chat))
-async def handle_chat(message: types.Message, state: FSMContext, bot: Bot):
+async def answer_in_chat(message: types.Message, state: FSMContext, bot: Bot, model_catalog: ModelCatalog,
+                         user_service: UserService, api_service: APIService, db: Database,
+                         user_text: str, image_urls: list[str] | None = None, document_text: str | None = None,
+                         msg: types.Message | None = None):
+    """Один ход диалога. Картинки и текст файла уходят только в текущем запросе, в историю попадает user_text."""
     user_id = message.from_user.id
-    msg = await message.answer('🧠 Думаю...')
+    msg = msg or await message.answer('🧠 Думаю...')
     start_time = time.monotonic()
 
-    user_service = bot["user_service"]
-    api_service = bot["api_service"]
-    db = bot["db"]
-
     user_data = await state.get_data()
     model_name = user_data.get('model')
 
@@ -134,15 +158,29 @@ async def handle_chat(message: types.Message, state: FSMContext, bot: Bot):
         system_prompt_default=config.DEFAULT_SYSTEM_PROMPT,
         temperature_default=config.DEFAULT_TEMPERATURE,
         user_id=user_id,
-        user_text=message.text,
+        user_text=user_text,
         model=model_name,
         state=state
     )
 
+    # История с вопросом уже в FSM: следующие апдейты пользователя (меню, кнопки) не ждут конца генерации
+    release_update_order()
+
+    messages = payload['messages']
+    if image_urls or document_text:
+        # Копия списка: base64 картинок и текст файла не должны попасть в сохраненную историю
+        text = f"{user_text}\n\n{document_text}" if document_text else user_text
+        content = text if not image_urls else (
+            [{'type': 'text', 'text': text}] + [{'type': 'image_url', 'image_url': {'url': url}} for url in image_urls]
+        )
+        messages = messages[:-1] + [{'role': 'user', 'content': content}]
+
+    model_info = model_catalog.get(payload['model'])
     answer_text, api_error = await api_service.chat_completion(
         model=payload['model'],
-        messages=payload['messages'],
-        temperature=payload['temperature']
+        messages=messages,
+        temperature=payload['temperature'],
+        timeout=model_info.timeout if model_info else config.DEFAULT_MODEL_TIMEOUT
     )
 
     await msg.delete()
@@ -163,8 +201,10 @@ async def handle_chat(message: types.Message, state: FSMContext, bot: Bot):
         await state.update_data(chat_history=current_history)
 
 
-        final_text = f"{answer_text}\n\n<b>Модель: {payload['model']} | Время: {duration} сек.</b>"
-        await send_long_message(bot, user_id, final_text, reply_markup=kb.get_chat_menu())
+        final_text = f"{render_markdown(answer_text)}\n\n<b>Модель: {payload['model']} | Время: {duration} сек.</b>"
+        if document_text: # Текст файла не хранится в истории, предупреждаем, что для уточнений его нужно прислать снова
+            final_text += "\n\n<i>📎 Файл учтен только в этом ответе. Чтобы задать по нему еще вопрос, отправьте файл снова с вопросом в подписи.</i>"
+        await send_long_message(bot, user_id, final_text, reply_markup=kb.get_chat_menu(), parse_mode="HTML")
 
         if user_id not in config.ADMIN_IDS:
             await db.add_request(user_id, payload['model'])
@@ -172,3 +212,69 @@ async def handle_chat(message: types.Message, state: FSMContext, bot: Bot):
     else:
         error_text = f"❌ Ошибка для админа: {api_error}" if user_id in config.ADMIN_IDS else "❌ Произошла непредвиденная ошибка. Попробуйте позже или обратитесь в поддержку."
         await message.answer(error_text, reply_markup=kb.get_chat_menu())
+
+@chat_router.message(F.text, StateFilter(Chatting.in_chat))
+async def handle_chat(message: types.Message, state: FSMContext, bot: Bot, model_catalog: ModelCatalog,
+                      user_service: UserService, api_service: APIService, db: Database):
+    await answer_in_chat(message, state, bot, model_catalog, user_service, api_service, db, user_text=message.text)
+
+@chat_router.message(F.photo | F.document.mime_type.startswith('image/'), StateFilter(Chatting.in_chat))
+async def handle_chat_image(message: types.Message, state: FSMContext, bot: Bot, model_catalog: ModelCatalog,
+                            user_service: UserService, api_service: APIService, db: Database):
+    model_name = (await state.get_data()).get('model')
+    model_info = model_catalog.get(model_name) if model_name else None
+    if not model_info or not model_info.vision:
+        await message.answer(f"⚠️ Модель {model_name or ''} не принимает изображения. Выберите модель с поддержкой картинок или отправьте текст.",
+                             reply_markup=kb.get_chat_menu())
+        return
+
+    msg = await message.answer('🖼 Загружаю изображение...')
+    if message.photo:
+        file = pick_photo_size(message.photo, config.VISION_MAX_SIDE)
+    else:
+        file = message.document
+    try:
+        data = await download_file(bot, file.file_id, config.VISION_MAX_DOWNLOAD_BYTES)
+        image_url = await prepare_vision_image(data)
+    except FileTooLarge as e: # Без Pillow предел ниже, чем для скачивания
+        await msg.edit_text(f"⚠️ Изображение слишком большое (максимум {e.limit // (1024 * 1024)} МБ).")
+        return
+    except UnsupportedImage:
+        await msg.edit_text("⚠️ Не удалось прочитать изображение. Попробуйте отправить его как фото в формате JPEG или PNG.")
+        return
+
+    await msg.edit_text('🧠 Думаю...')
+    user_text = message.caption or "Опиши изображение."
+    await answer_in_chat(message, state, bot, model_catalog, user_service, api_service, db,
+                         user_text=f"[изображение] {user_text}", image_urls=[image_url], msg=msg)
+
+@chat_router.message(F.document, StateFilter(Chatting.in_chat))
+async def handle_chat_document(message: types.Message, state: FSMContext, bot: Bot, model_catalog: ModelCatalog,
+                               user_service: UserService, api_service: APIService, db: Database):
+    document = message.document
+    if not is_text_document(document):
+        await message.answer("⚠️ Поддерживаются текстовые файлы: txt, md, csv, json, исходный код.", reply_markup=kb.get_chat_menu())
+        return
+
+    model_name = (await state.get_data()).get('model')
+    model_info = model_catalog.get(model_name) if model_name else None
+    budget = document_budget(model_info.context_window if model_info else config.DEFAULT_MODEL_CONTEXT_WINDOW)
+    question = message.caption or "Кратко перескажи содержание файла."
+
+    msg = await message.answer('📄 Читаю файл...')
+    try:
+        text = await download_document_text(bot, document.file_id, config.DOCUMENT_MAX_BYTES)
+        document_text, truncated = await prepare_document(text, question, budget)
+    except FileTooLarge as e:
+        await msg.edit_text(f"⚠️ Файл слишком большой (максимум {e.limit // (1024 * 1024)} МБ).")
+        return
+    except DocumentNotText:
+        await msg.edit_text("⚠️ Не удалось прочитать файл как текст.")
+        return
+
+    file_name = document.file_name or "файл"
+    note = " (файл большой, переданы фрагменты, наиболее подходящие к вопросу)" if truncated else ""
+    await msg.edit_text('🧠 Думаю...')
+    await answer_in_chat(message, state, bot, model_catalog, user_service, api_service, db,
+                         user_text=f"[файл {file_name}] {question}",
+                         document_text=f"Содержимое файла {file_name}{note}:\n\n{document_text}", msg=msg)
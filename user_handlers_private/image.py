@@ -1,9 +1,18 @@
 # user_handlers_private/image.py
+import hashlib
+import html
+
 from aiogram import Router, types, F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
+from aiogram.types import BufferedInputFile
 
 import config
 import keyboards as kb
+from api_service import APIService
+from database import Database
+from image_queue import CLOSED_TEXT, ImageJobQueue
+from metrics import record_cache
 from states import ImageGeneration
 
 image_router = Router(name="user_image")
@@ -13,10 +22,7 @@ image_router = Router(name="user_image")
 # --- Обработчики генерации изображений ---
 
 @image_router.callback_query(F.data == 'menu_image_gen')
-async def image_gen_start(callback: types.CallbackQuery, state: FSMContext, bot: Bot, user_level: int):
-    model_status_cache = bot["model_status_cache"]
-    # api_service = bot["api_service"] # Not directly used here, but process_image_prompt will use it
-
+async def image_gen_start(callback: types.CallbackQuery, state: FSMContext, user_level: int, model_status_cache: dict):
     if config.IMAGE_MODEL in model_status_cache and not model_status_cache[config.IMAGE_MODEL]:
         await callback.answer("⚠️ Эта функция временно недоступна.", show_alert=True)
         return
@@ -32,32 +38,64 @@ async def image_gen_start(callback: types.CallbackQuery, state: FSMContext, bot:
     )
     await callback.answer()
 
+def image_cache_key(prompt: str) -> str:
+    """Хэш нормализованного промпта: регистр и лишние пробелы не влияют на попадание в кэш."""
+    normalized = " ".join(prompt.lower().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
 @image_router.message(ImageGeneration.waiting_for_prompt, F.text)
-async def process_image_prompt(message: types.Message, state: FSMContext, bot: Bot):
+async def process_image_prompt(message: types.Message, state: FSMContext, bot: Bot, api_service: APIService, db: Database,
+                               image_queue: ImageJobQueue, user_level: int):
     await state.clear() # Clear state after getting the prompt
     prompt = message.text
-    msg = await message.answer("🎨 Создаю шедевр... Это может занять до минуты.")
+    caption = f"✅ Ваш шедевр по запросу: <i>{html.escape(prompt[:900])}</i>"
+    prompt_hash = image_cache_key(prompt)
 
-    api_service = bot["api_service"] # Get APIService from bot context
-    db = bot["db"] # Get Database from bot context
+    # Такой же запрос уже генерировали - повторно отправляем файл, уже лежащий у Telegram
+    file_id = await db.get_cached_image(config.IMAGE_MODEL, prompt_hash, config.IMAGE_SIZE)
+    record_cache("image_file_id", file_id is not None)
+    if file_id:
+        try:
+            await bot.send_photo(chat_id=message.chat.id, photo=file_id, caption=caption)
+            if message.from_user.id not in config.ADMIN_IDS:
+                await db.add_request(message.from_user.id, config.IMAGE_MODEL)
+            return
+        except TelegramBadRequest:
+            await db.delete_cached_image(config.IMAGE_MODEL, prompt_hash, config.IMAGE_SIZE)
 
-    try:
-        image_url, error = await api_service.generate_image(model=config.IMAGE_MODEL, prompt=prompt)
+    refusal = image_queue.can_submit(message.from_user.id)
+    if refusal:
+        await message.answer(refusal)
+        return
 
-        if error:
-            error_text = f"❌ Ошибка для админа: {error}" if message.from_user.id in config.ADMIN_IDS else "❌ Произошла ошибка. Попробуйте изменить запрос или обратитесь в поддержку."
-            await msg.edit_text(error_text)
-        else:
-            if image_url: # Ensure URL is not None
-                await bot.send_photo(chat_id=message.chat.id, photo=image_url, caption=f"✅ Ваш шедевр по запросу: `{prompt}`")
+    async def generate(msg: types.Message):
+        try:
+            image_bytes, error = await api_service.generate_image_bytes(
+                model=config.IMAGE_MODEL, prompt=prompt, size=config.IMAGE_SIZE,
+                response_format=config.IMAGE_RESPONSE_FORMAT, max_bytes=config.IMAGE_MAX_BYTES,
+                download_timeout=config.IMAGE_DOWNLOAD_TIMEOUT
+            )
+
+            if error:
+                error_text = f"❌ Ошибка для админа: {error}" if message.from_user.id in config.ADMIN_IDS else "❌ Произошла ошибка. Попробуйте изменить запрос или обратитесь в поддержку."
+                await msg.edit_text(error_text)
+            else:
+                # Загружаем байты сами, чтобы Telegram не ходил за картинкой на сторонний хост
+                sent = await bot.send_photo(
+                    chat_id=message.chat.id, photo=BufferedInputFile(image_bytes, filename="image.png"), caption=caption
+                )
                 await msg.delete()
+                await db.save_cached_image(config.IMAGE_MODEL, prompt_hash, config.IMAGE_SIZE, sent.photo[-1].file_id)
                 if message.from_user.id not in config.ADMIN_IDS:
                     await db.add_request(message.from_user.id, config.IMAGE_MODEL)
-            else: # Should not happen if error is None, but as a safeguard
-                await msg.edit_text("❌ Произошла неизвестная ошибка при генерации изображения.")
-
-    except Exception as e:
-        # Log the full exception e for admin/debug purposes
-        # logger.error(f"Error in process_image_prompt: {e}", exc_info=True)
-        error_text = f"❌ Ошибка для админа (exception): {e}" if message.from_user.id in config.ADMIN_IDS else "❌ Произошла непредвиденная ошибка. Пожалуйста, попробуйте позже."
-        await msg.edit_text(error_text)
+
+        except Exception as e:
+            # Log the full exception e for admin/debug purposes
+            # logger.error(f"Error in process_image_prompt: {e}", exc_info=True)
+            error_text = f"❌ Ошибка для админа (exception): {e}" if message.from_user.id in config.ADMIN_IDS else "❌ Произошла непредвиденная ошибка. Пожалуйста, попробуйте позже."
+            await msg.edit_text(error_text)
+
+    # Генерация идет в очереди с ограниченным числом воркеров, хэндлер сразу освобождается
+    placeholder = await message.answer(image_queue.placeholder_text(user_level))
+    if not await image_queue.submit(message.from_user.id, user_level, placeholder, generate):
+        await placeholder.edit_text(CLOSED_TEXT) # Бот остановился, пока отправляли заглушку
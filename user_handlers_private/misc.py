@@ -4,13 +4,14 @@ from aiogram.filters import StateFilter
 
 import config # For LIMITS and SUBSCRIPTION_MODELS if needed for help_menu
 import keyboards as kb
+from model_catalog import ModelCatalog
 
 misc_router = Router(name="user_misc")
 
 # Note: Global private chat filter (F.chat.type == 'private') is applied in user_handlers_private/__init__.py
 
 @misc_router.callback_query(F.data == 'menu_help')
-async def help_menu(callback: types.CallbackQuery, bot: Bot): # Added bot for potential future use
+async def help_menu(callback: types.CallbackQuery, bot: Bot, model_catalog: ModelCatalog):
     # user_service = bot["user_service"] # Not strictly needed here unless fetching dynamic info
     text = (
         '<b>Доступные команды:</b>\n'
@@ -18,8 +19,7 @@ async def help_menu(callback: types.CallbackQuery, bot: Bot): # Added bot for po
         '/new - начать новый диалог (очистить контекст)\n\n'
         '<b>Планы подписки:</b>\n'
     )
-    # Iterate through defined subscription models in config to display limits
-    for sub_key, sub_details in config.SUBSCRIPTION_MODELS.items():
+    for sub_details in model_catalog.tiers():
         level = sub_details.get('level') # Assuming 'level' key exists in sub_details
         limit_for_level = config.LIMITS.get(level, "N/A") # Get limit based on level
 
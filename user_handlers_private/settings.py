@@ -5,6 +5,7 @@ from aiogram.fsm.context import FSMContext
 import config
 import keyboards as kb
 from states import UserSettings
+from user_service import UserService
 
 settings_router = Router(name="user_settings")
 
@@ -13,8 +14,7 @@ settings_router = Router(name="user_settings")
 # --- Обработчики настроек ---
 
 @settings_router.callback_query(F.data == 'menu_settings')
-async def menu_settings(callback: types.CallbackQuery, bot: Bot):
-    user_service = bot["user_service"]
+async def menu_settings(callback: types.CallbackQuery, user_service: UserService):
     settings = await user_service.get_user_settings(callback.from_user.id)
     prompt, temp = settings if settings else (None, None)
 
@@ -39,8 +39,7 @@ async def settings_prompt_start(callback: types.CallbackQuery, state: FSMContext
     await callback.answer()
 
 @settings_router.message(UserSettings.waiting_for_prompt, F.text)
-async def settings_prompt_process(message: types.Message, state: FSMContext, bot: Bot):
-    user_service = bot["user_service"]
+async def settings_prompt_process(message: types.Message, state: FSMContext, user_service: UserService):
     new_prompt = message.text
 
     if new_prompt == "-": # Command to reset to default
@@ -64,9 +63,7 @@ async def settings_temp_start(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @settings_router.message(UserSettings.waiting_for_temperature, F.text)
-async def settings_temp_process(message: types.Message, state: FSMContext, bot: Bot):
-    user_service = bot["user_service"]
-
+async def settings_temp_process(message: types.Message, state: FSMContext, user_service: UserService):
     if message.text == "-":
         await user_service.update_user_settings(message.from_user.id, temp=config.DEFAULT_TEMPERATURE)
         await message.answer(f"✅ Температура сброшена на стандартное значение ({config.DEFAULT_TEMPERATURE})!")
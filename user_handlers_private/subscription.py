@@ -5,6 +5,8 @@ from aiogram import Router, types, F, Bot
 import config
 import keyboards as kb
 from keyboards import SubDetailCallback # Assuming this is for subscription detail callbacks
+from database import Database
+from model_catalog import ModelCatalog
 
 subscription_router = Router(name="user_subscription")
 
@@ -13,10 +15,8 @@ subscription_router = Router(name="user_subscription")
 # --- Обработчики подписки ---
 
 @subscription_router.callback_query(F.data == 'menu_subscription')
-async def subscription_menu(callback: types.CallbackQuery, bot: Bot, user_level: int, limit: int | float): # user_level & limit from middleware
+async def subscription_menu(callback: types.CallbackQuery, db: Database, user_level: int, limit: int | float, model_catalog: ModelCatalog): # user_level & limit from middleware
     user_id = callback.from_user.id
-    db = bot["db"]
-    # user_service = bot["user_service"] # Not strictly needed if limit is passed by middleware
 
     if user_id in config.ADMIN_IDS:
         await callback.message.edit_text(
@@ -26,8 +26,7 @@ async def subscription_menu(callback: types.CallbackQuery, bot: Bot, user_level:
         await callback.answer()
         return
 
-    sub_name_key = config.SUB_LEVEL_MAP.get(user_level, 'free') # 'free' is a fallback key
-    sub_info = config.SUBSCRIPTION_MODELS.get(sub_name_key, config.SUBSCRIPTION_MODELS['free']) # Fallback to free model info
+    sub_info = model_catalog.tier(user_level)
 
     requests_today = await db.get_user_requests_today(user_id)
     # limit is passed directly from middleware
@@ -61,21 +60,17 @@ async def subscription_menu(callback: types.CallbackQuery, bot: Bot, user_level:
         f"<b>Описание:</b>\n{sub_info['description']}\n\n"
         "Для просмотра деталей и покупки выберите один из планов ниже:"
     )
-    await callback.message.edit_text(text, reply_markup=kb.get_subscription_menu()) # Assuming kb.get_subscription_menu() exists
+    await callback.message.edit_text(text, reply_markup=kb.get_subscription_menu(model_catalog))
     await callback.answer()
 
 @subscription_router.callback_query(SubDetailCallback.filter()) # Assuming SubDetailCallback is correctly defined
-async def show_subscription_details(callback: types.CallbackQuery, callback_data: SubDetailCallback, bot: Bot): # Added bot for potential future use
+async def show_subscription_details(callback: types.CallbackQuery, callback_data: SubDetailCallback, bot: Bot, model_catalog: ModelCatalog):
     level = callback_data.level
-    sub_name_key = config.SUB_LEVEL_MAP.get(level)
-    if not sub_name_key:
+    if not model_catalog.has_tier(level):
         await callback.answer("Неизвестный уровень подписки.", show_alert=True)
         return
 
-    sub_info = config.SUBSCRIPTION_MODELS.get(sub_name_key)
-    if not sub_info: # Should not happen if SUB_LEVEL_MAP and SUBSCRIPTION_MODELS are consistent
-        await callback.answer("Информация о подписке не найдена.", show_alert=True)
-        return
+    sub_info = model_catalog.tier(level)
 
     text = (
         f"<b>Подписка: {sub_info['name']} ({sub_info['price']}₽)</b>\n\n"
@@ -83,37 +78,28 @@ async def show_subscription_details(callback: types.CallbackQuery, callback_data
         "<b>Доступные модели:</b>"
     )
 
-    available_models_for_level = set(sub_info['models'])
-
-    # Assuming config.ALL_MODELS is a dict like {'ProviderName': ['model1', 'model2'], ...}
-    for provider, models_in_provider_list in config.ALL_MODELS.items():
-        included_models = [model for model in models_in_provider_list if model in available_models_for_level]
-        if included_models:
-            text += f"\n\n<b>{provider}</b>\n"
-            text += " • " + "\n • ".join(included_models)
+    for provider, included_models in model_catalog.models_by_category(level).items():
+        text += f"\n\n<b>{provider}</b>\n"
+        text += " • " + "\n • ".join(included_models)
 
-    reply_markup = kb.get_subscription_details_keyboard(level) # Assuming this keyboard exists
+    reply_markup = kb.get_subscription_details_keyboard(model_catalog, level)
 
     await callback.message.edit_text(text, reply_markup=reply_markup)
     await callback.answer()
 
 @subscription_router.callback_query(F.data.startswith('buy_'))
-async def buy_subscription(callback: types.CallbackQuery, bot: Bot): # Added bot for potential future use
+async def buy_subscription(callback: types.CallbackQuery, bot: Bot, model_catalog: ModelCatalog):
     try:
         level = int(callback.data.split('_')[1])
     except (ValueError, IndexError):
         await callback.answer("Ошибка при выборе подписки. Попробуйте снова.", show_alert=True)
         return
 
-    sub_name_key = config.SUB_LEVEL_MAP.get(level)
-    if not sub_name_key:
+    if not model_catalog.has_tier(level):
         await callback.answer("Неизвестный уровень подписки.", show_alert=True)
         return
 
-    sub_info = config.SUBSCRIPTION_MODELS.get(sub_name_key)
-    if not sub_info:
-        await callback.answer("Информация о подписке не найдена.", show_alert=True)
-        return
+    sub_info = model_catalog.tier(level)
 
     text = (
         f"Для покупки подписки <b>{sub_info['name']} ({sub_info['price']}₽)</b> свяжитесь с администратором: @{config.PAYMENT_USERNAME}\n\n"
@@ -1,7 +1,9 @@
 # Assuming config and database.Database are available
 import config
 from database import Database # Assuming Database class is in database.py
+from tracing import trace_methods
 
+@trace_methods("user_service")
 class UserService:
     def __init__(self, db: Database):
         self.db = db
@@ -37,12 +39,7 @@ class UserService:
                     return 2
 
 
-        # If no active paid subscription, check if user exists for basic level
-        user_exists = await self.db.check_user_exists(user_id)
-        if user_exists:
-            return 1 # Basic/Free tier for existing users without active paid subscription
-
-        # If user does not exist and is not admin, they have no access or level 0
+        # No active paid subscription (or unknown user): Free tier, level 0
         return 0
 
     async def get_user_limit(self, user_id: int) -> int | float:
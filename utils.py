@@ -1,44 +1,222 @@
+import asyncio
+import html
+import re
+import time
+
 from aiogram import Bot
-from aiogram.types import InlineKeyboardMarkup # Or ReplyKeyboardMarkup, depending on usage
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message, ReplyParameters
+
+import config
 
 MAX_MESSAGE_LENGTH = 4096
 
-async def send_long_message(bot: Bot, chat_id: int, text: str, reply_markup=None, parse_mode: str = None):
+# Tags and entities are atomic tokens: the chunker never cuts inside them
+_TOKEN_RE = re.compile(r'<(/?)([a-zA-Z][\w-]*)[^<>]*>|&(?:#\d+|#x[0-9a-fA-F]+|\w+);')
+_TAG_RE = re.compile(r'<[^<>]*>')
+
+
+def _utf16_len(text: str) -> int:
+    # Telegram counts message length in UTF-16 code units (emoji take two)
+    return len(text.encode('utf-16-le')) // 2
+
+
+class SendRateLimiter:
     """
-    Sends a long message, splitting it into parts if it exceeds Telegram's limit.
+    Spaces out sendMessage calls: a global budget per second plus a minimal interval per chat
+    (Telegram allows roughly 30 messages/s overall, 1/s per chat and 20/min per group).
     """
-    if len(text) <= MAX_MESSAGE_LENGTH:
-        await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode=parse_mode)
-    else:
-        parts = []
-        while len(text) > 0:
-            if len(text) > MAX_MESSAGE_LENGTH:
-                part = text[:MAX_MESSAGE_LENGTH]
-                # Try to split at the last newline character to make messages prettier
-                last_newline = part.rfind('\n')
-                if last_newline != -1:
-                    # Check if the newline is too far back (e.g., more than half the message length)
-                    # to avoid creating very small initial parts if the last newline is very early.
-                    # This threshold can be adjusted.
-                    if last_newline > MAX_MESSAGE_LENGTH / 2:
-                        part = text[:last_newline]
-                        text = text[last_newline+1:]
-                    else:
-                        # If newline is too early, or for very long lines without newlines,
-                        # just split at MAX_MESSAGE_LENGTH
-                        part = text[:MAX_MESSAGE_LENGTH]
-                        text = text[MAX_MESSAGE_LENGTH:]
-                else:
-                    # If no newline, split at MAX_MESSAGE_LENGTH
-                    part = text[:MAX_MESSAGE_LENGTH]
-                    text = text[MAX_MESSAGE_LENGTH:]
-                parts.append(part)
-            else:
-                parts.append(text)
-                break
+    def __init__(self, global_per_second: float, private_interval: float, group_interval: float):
+        self.global_interval = 1 / global_per_second if global_per_second else 0.0
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self._next_global = 0.0
+        self._next_by_chat: dict[int, float] = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        # Reserve the slot before sleeping so concurrent senders queue up instead of bursting
+        slot = max(now, self._next_global, self._next_by_chat.get(chat_id, 0.0))
+        self._next_global = slot + self.global_interval
+        self._next_by_chat[chat_id] = slot + (self.group_interval if chat_id < 0 else self.private_interval)
+        if len(self._next_by_chat) > 10000:
+            self._next_by_chat = {chat: t for chat, t in self._next_by_chat.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
 
-        for i, part_text in enumerate(parts):
-            if i == len(parts) - 1: # Send reply_markup only with the last part
-                await bot.send_message(chat_id=chat_id, text=part_text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+send_limiter = SendRateLimiter(config.SEND_GLOBAL_PER_SECOND, config.SEND_PRIVATE_INTERVAL, config.SEND_GROUP_INTERVAL)
+
+
+def _cut(segment: str, pos: int, available: int) -> int:
+    """
+    End of the longest piece of `segment` starting at `pos` that fits in `available` UTF-16 units,
+    moved back to a newline (then a space) in its second half. Returns `pos` if not even one character fits.
+    """
+    end = min(len(segment), pos + max(available, 0))
+    # Shrink until the piece fits in UTF-16 units; a character takes at most two units
+    while (surplus := _utf16_len(segment[pos:end]) - available) > 0:
+        end -= (surplus + 1) // 2
+    if pos < end < len(segment):
+        cut = segment.rfind('\n', pos, end)
+        if cut <= pos + (end - pos) // 2:
+            cut = segment.rfind(' ', pos, end)
+        if cut > pos + (end - pos) // 2:
+            end = cut + 1
+    return end
+
+
+def split_plain_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Splits plain text into parts of at most `limit` UTF-16 units, preferring newlines, then spaces."""
+    parts = []
+    pos = 0
+    while pos < len(text):
+        end = _cut(text, pos, limit)
+        parts.append(text[pos:end])
+        pos = end
+    return parts
+
+
+def split_html_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Splits HTML text into parts of at most `limit` UTF-16 units in a single pass.
+    Tags open at a cut are closed at the end of the part and reopened at the start of the next one,
+    so every part is balanced (e.g. a <pre><code> block continues as a code block). Text is cut
+    at a newline when possible, then at a space. Raises ValueError if the open tags alone
+    do not leave room for text.
+    """
+    if _utf16_len(text) <= limit:
+        return [text]
+
+    parts: list[str] = []
+    current: list[str] = []
+    size = 0
+    has_content = False  # Whether the current part has anything besides reopened tags and whitespace
+    whitespace: list[str] = []  # Text of the current part while it is whitespace only
+    stack: list[tuple[str, str]] = []  # (tag name, full opening tag)
+    closing_size = 0  # Length of the closing tags needed for the current stack
+
+    def flush():
+        nonlocal current, size, has_content, whitespace
+        # A whitespace-only part would be rejected by Telegram: its text moves to the next part instead
+        carried = [] if has_content else whitespace
+        if has_content:
+            parts.append(''.join(current) + ''.join(f'</{name}>' for name, _ in reversed(stack)))
+        current = [opening for _, opening in stack]
+        size = sum(_utf16_len(opening) for opening in current)
+        if carried and _utf16_len(''.join(carried)) <= (limit - size - closing_size) // 2:
+            current.extend(carried)
+            size += _utf16_len(''.join(carried))
+        has_content = False
+        whitespace = []
+
+    def append_text(piece: str):
+        nonlocal size, has_content
+        current.append(piece)
+        size += _utf16_len(piece)
+        if not has_content:
+            if piece.isspace():
+                whitespace.append(piece)
             else:
-                await bot.send_message(chat_id=chat_id, text=part_text, parse_mode=parse_mode)
+                has_content = True
+
+    def add_text(segment: str):
+        pos = 0
+        while pos < len(segment):
+            end = _cut(segment, pos, limit - size - closing_size)
+            if end == pos:  # The next character does not fit: continue in a new part
+                flush()
+                if _cut(segment, pos, limit - size - closing_size) == pos:
+                    raise ValueError("HTML nesting is too deep to fit in one message")
+                continue
+            append_text(segment[pos:end])
+            pos = end
+            if pos < len(segment):
+                flush()
+
+    last = 0
+    for match in _TOKEN_RE.finditer(text):
+        if match.start() > last:
+            add_text(text[last:match.start()])
+        last = match.end()
+        token = match.group(0)
+        token_size = _utf16_len(token)
+        is_tag = token.startswith('<')
+        is_closing = is_tag and match.group(1) == '/'
+        name = match.group(2).lower() if is_tag else ''
+
+        if is_closing:
+            if stack and (stack[-1][0] == name or any(open_name == name for open_name, _ in stack)):
+                # Close the matching tag (and anything left unclosed inside it)
+                while stack:
+                    open_name, _ = stack.pop()
+                    closing_size -= len(open_name) + 3
+                    current.append(f'</{open_name}>')
+                    size += len(open_name) + 3
+                    if open_name == name:
+                        break
+            continue
+
+        extra_closing = len(name) + 3 if is_tag else 0
+        if size + token_size + closing_size + extra_closing > limit:
+            flush()
+            if size + token_size + closing_size + extra_closing > limit:
+                raise ValueError("HTML tag is too long to fit in one message")
+        current.append(token)
+        size += token_size
+        if is_tag:
+            stack.append((name, token))
+            closing_size += extra_closing
+        else:
+            has_content = True
+
+    if last < len(text):
+        add_text(text[last:])
+    flush()
+    return parts
+
+
+def html_to_plain(text: str) -> str:
+    return html.unescape(_TAG_RE.sub('', text))
+
+
+async def _send_part(bot: Bot, chat_id: int, text: str, parse_mode: str | None, **kwargs) -> Message:
+    for attempt in range(3):
+        await send_limiter.wait(chat_id)
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode, **kwargs)
+        except TelegramRetryAfter as e:
+            if attempt == 2:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+
+async def send_long_message(bot: Bot, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup | None = None,
+                            parse_mode: str | None = None, reply_to_message_id: int | None = None) -> list[Message]:
+    """
+    Sends a long message, splitting it into parts if it exceeds Telegram's limit.
+    The first part replies to `reply_to_message_id`, the last one carries `reply_markup`.
+    A part that Telegram cannot parse as HTML is resent as plain text. Returns the sent messages.
+    """
+    if parse_mode == "HTML":
+        try:
+            parts = split_html_message(text)
+        except ValueError:  # Markup that cannot be split within the limit goes out as plain text
+            parse_mode = None
+            parts = split_plain_message(html_to_plain(text))
+    else:
+        parts = split_plain_message(text)
+    sent = []
+    for i, part_text in enumerate(parts):
+        kwargs = {}
+        if i == 0 and reply_to_message_id:
+            kwargs["reply_parameters"] = ReplyParameters(message_id=reply_to_message_id, allow_sending_without_reply=True)
+        if i == len(parts) - 1 and reply_markup:  # Send reply_markup only with the last part
+            kwargs["reply_markup"] = reply_markup
+        try:
+            sent.append(await _send_part(bot, chat_id, part_text, parse_mode, **kwargs))
+        except TelegramBadRequest as e:
+            if parse_mode is None or "parse" not in str(e).lower():
+                raise
+            sent.append(await _send_part(bot, chat_id, html_to_plain(part_text), None, **kwargs))
+    return sent